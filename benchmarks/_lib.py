@@ -0,0 +1,114 @@
+import asyncio
+import sys
+import time
+from importlib import import_module
+from os.path import join, dirname, abspath
+from timeit import repeat
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'src'))
+
+
+def import_cc(name):
+    # package directory is not a valid identifier, so plain import won't do
+    return import_module('cc-secure.' + name)
+
+
+def measure(fn, *args, budget=0.5, runs=5):
+    # seconds per call of each run
+    once = min(repeat(lambda: fn(*args), number=1, repeat=3))
+    number = max(1, int(budget / max(once, 1e-7)))
+    return [t / number for t in repeat(
+        lambda: fn(*args), number=number, repeat=runs)]
+
+
+def bench(fn, *args, budget=0.5):
+    # seconds per call, best of 5 runs
+    return min(measure(fn, *args, budget=budget))
+
+
+def inventory(n):
+    return {i: {
+        b'name': b'minecraft:cobblestone',
+        b'count': i % 64,
+        b'nbt': b'3f0c2a9d5b1e7f6a',
+    } for i in range(1, n + 1)}
+
+
+def block_infos(n):
+    return [{
+        b'name': b'minecraft:oak_log',
+        b'state': {b'axis': b'y'},
+        b'tags': {b'minecraft:logs': True, b'minecraft:oak_logs': True},
+        b'x': i % 16, b'y': 0.5 * i, b'z': -i,
+    } for i in range(n)]
+
+
+def term_blits(width=51, height=19):
+    return [(
+        b'return term.blit(...)',
+        (b'#' * width, b'0' * width, b'f' * width),
+    ) for _ in range(height)]
+
+
+
+class FakeComputer:
+    # Stands in for back.lua: answers every call with reply(lua_code, params)
+    # after a fixed network latency, counts round trips.
+    def __init__(self, latency=0.05, reply=lambda code, params: (),
+                 codec=None):
+        self.latency = latency
+        self.reply = reply
+        self.codec = codec or import_cc('bser')
+        self.round_trips = 0
+        self.chunks = {}
+        self.sess = import_cc('sess').CCSession(0, self.send, self.codec)
+
+    def call(self, item):
+        # item is (slot, params) or (lua_code, params, slot),
+        # tables come deserialized as dicts
+        if isinstance(item, dict):
+            item = [item[k] for k in sorted(item)]
+        if len(item) == 3:
+            self.chunks[item[2]] = item[0]
+            item = item[2], item[1]
+        slot, params = item
+        params = tuple(params[k] for k in sorted(params))
+        return self.reply(self.chunks[slot], params)
+
+    def send(self, data):
+        msg = self.codec.dcmditer(data)
+        action = next(msg)
+        if action in (b'T', b'I'):
+            task_id = next(msg)
+            result = [True, *self.call(list(msg))]
+        elif action == b'B':
+            task_id = next(msg)
+            calls = next(msg)
+            result = [True, [
+                [True, *self.call(calls[i])]
+                for i in range(1, len(calls) + 1)]]
+        else:
+            return
+        self.round_trips += 1
+        asyncio.get_running_loop().call_later(
+            self.latency, self.sess.on_task_result,
+            task_id, self.codec.serialize(result))
+
+    def run(self, fn):
+        # runs fn as a program, returns seconds it took
+        async def main():
+            done = asyncio.get_running_loop().create_future()
+
+            def program():
+                try:
+                    fn()
+                finally:
+                    done.set_result(None)
+
+            start = time.perf_counter()
+            self.sess._run_sandboxed_greenlet(program)
+            await done
+            return time.perf_counter() - start
+
+        self.round_trips = 0
+        return asyncio.run(main())
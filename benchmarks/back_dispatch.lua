@@ -0,0 +1,103 @@
+-- Cost of delivering one event in back.lua main loop while thousands of
+-- tasks are parked waiting for timers, against the previous dispatcher,
+-- which checked the filter of every task on every event.
+--
+-- Usage (from repository root, stock Lua 5.1 or 5.2):
+--   lua benchmarks/back_dispatch.lua
+
+local loadstring = loadstring or load
+local unpack = table.unpack or unpack
+
+local function load_dispatcher()
+    local f = assert(io.open('src/cc-secure/back.lua', 'r'))
+    local src = f:read('*a')
+    f:close()
+    local from = assert(src:find('function set_filter', 1, true))
+    local to = assert(src:find('\nfunction ws_send', 1, true))
+    local body_from = assert(src:find('    -- new filters of resumed tasks', 1, true))
+    local body_to = assert(src:find('\nend\n\nws.close()', 1, true))
+    local chunk = table.concat({
+        'local tasks, filters, waiting, unfiltered = {}, {}, {}, {}',
+        'local new_tasks = {}',
+        'local ycounts, coparams = {}, {}',
+        'local function ws_send() end',
+        'local function ws_flush() end',
+        'local function serialize() end',
+        'local function safe_unpack(a) return unpack(a, 1, table.maxn(a)) end',
+        src:sub(from, to),
+        'local function dispatch(event, p1, p2, p3, p4, p5)',
+        src:sub(body_from, body_to),
+        'end',
+        'return new_task, dispatch',
+    }, '\n')
+    return assert(loadstring(chunk))()
+end
+
+local new_task, dispatch = load_dispatcher()
+
+local old_new_task, old_dispatch
+do
+    local tasks, filters, ycounts, coparams = {}, {}, {}, {}
+
+    old_new_task = function(task_id, fn, params)
+        tasks[task_id] = coroutine.create(fn)
+        ycounts[task_id] = 0
+        coparams[task_id] = params
+    end
+
+    old_dispatch = function(event, p1, p2, p3, p4, p5)
+        for task_id in pairs(tasks) do
+            if filters[task_id] == nil or filters[task_id] == event then
+                local r
+                if coparams[task_id] ~= nil then
+                    r = {coroutine.resume(tasks[task_id], unpack(coparams[task_id]))}
+                    coparams[task_id] = nil
+                else
+                    r = {coroutine.resume(tasks[task_id], event, p1, p2, p3, p4, p5)}
+                end
+                ycounts[task_id] = ycounts[task_id] + 1
+                if coroutine.status(tasks[task_id]) == 'dead' then
+                    error('sleepers never finish')
+                elseif r[1] == true then
+                    filters[task_id] = r[2]
+                else
+                    filters[task_id] = nil
+                end
+            end
+        end
+    end
+end
+
+local function sleeper()
+    -- like os.sleep with a timer which never fires
+    while true do coroutine.yield('timer') end
+end
+
+local function timeit(fn, event)
+    local rounds, start = 0, os.clock()
+    repeat
+        fn(event)
+        rounds = rounds + 1
+    until os.clock() - start > 0.2
+    return (os.clock() - start) / rounds * 1e6
+end
+
+print('other event: nobody waits for it, timer: every task is resumed')
+print(string.format('%-8s%14s%14s%14s%14s',
+    'tasks', 'old other us', 'new other us', 'old timer us', 'new timer us'))
+local created = 0
+for _, n in ipairs({1000, 2000, 4000, 8000}) do
+    while created < n do
+        created = created + 1
+        new_task(created, sleeper, {})
+        old_new_task(created, sleeper, {})
+    end
+    -- first run starts the new tasks
+    dispatch('timer')
+    old_dispatch('timer')
+    print(string.format('%-8d%14.1f%14.1f%14.1f%14.1f', n,
+        timeit(old_dispatch, 'websocket_message'),
+        timeit(dispatch, 'websocket_message'),
+        timeit(old_dispatch, 'timer'),
+        timeit(dispatch, 'timer')))
+end
@@ -0,0 +1,132 @@
+-- Scaling of back.lua text serializer and deserializer against the
+-- previous implementation, which concatenated strings in a loop.
+--
+-- Usage (from repository root, stock Lua 5.1 or 5.2):
+--   lua benchmarks/back_serialize.lua
+
+local loadstring = loadstring or load
+
+local function load_back_lua()
+    local f = assert(io.open('src/cc-secure/back.lua', 'r'))
+    local src = f:read('*a')
+    f:close()
+    local from = assert(src:find('local serialize\n', 1, true))
+    local to = assert(src:find('\nfunction set_filter', 1, true))
+    local chunk = src:sub(from, to) .. '\nreturn serialize, create_stream, deserialize'
+    return assert(loadstring(chunk))()
+end
+
+local serialize, create_stream, deserialize = load_back_lua()
+
+local old_serialize
+do
+    local function s_rec(v, tracking)
+        local t = type(v)
+        if v == nil then
+            return 'N'
+        elseif v == false then
+            return 'F'
+        elseif v == true then
+            return 'T'
+        elseif t == 'number' then
+            return '\[' .. tostring(v) .. '\]'
+        elseif t == 'string' then
+            return string.format('<%u>', #v) .. v
+        elseif t == 'table' then
+            if tracking[v] ~= nil then
+                error('Cannot serialize table with recursive entries', 0)
+            end
+            tracking[v] = true
+            local r = '{'
+            for k, x in pairs(v) do
+                r = r .. ':' .. s_rec(k, tracking) .. s_rec(x, tracking)
+            end
+            return r .. '}'
+        else
+            error('Cannot serialize type ' .. t, 0)
+        end
+    end
+    old_serialize = function(v) return s_rec(v, {}) end
+end
+
+local function old_create_stream(s, idx)
+    if idx == nil then idx = 1 end
+    return {
+        fixed=function(n)
+            local r = s:sub(idx, idx + n - 1)
+            if #r ~= n then error('Unexpected end of stream') end
+            idx = idx + n
+            return r
+        end,
+        tostop=function(sym)
+            local newidx = s:find(sym, idx, true)
+            if newidx == nil then error('Unexpected end of stream') end
+            local r = s:sub(idx, newidx - 1)
+            idx = newidx + 1
+            return r
+        end,
+    }
+end
+
+local function old_deserialize(stream)
+    local tok = stream.fixed(1)
+    if tok == 'N' then
+        return nil
+    elseif tok == 'F' then
+        return false
+    elseif tok == 'T' then
+        return true
+    elseif tok == '\[' then
+        return tonumber(stream.tostop('\]'))
+    elseif tok == '<' then
+        local slen = tonumber(stream.tostop('>'))
+        return stream.fixed(slen)
+    elseif tok == '{' then
+        local r = {}
+        while true do
+            tok = stream.fixed(1)
+            if tok == ':' then
+                local key = old_deserialize(stream)
+                r[key] = old_deserialize(stream)
+            else break end
+        end
+        return r
+    else
+        error('Unknown token ' .. tok)
+    end
+end
+
+local function block_infos(n)
+    local r = {}
+    for i = 1, n do
+        r[i] = {
+            name = 'minecraft:oak_log',
+            state = {axis = 'y'},
+            tags = {['minecraft:logs'] = true},
+            x = i % 16, y = i * 0.5, z = -i,
+        }
+    end
+    return r
+end
+
+local function timeit(fn, arg)
+    local rounds, start = 0, os.clock()
+    repeat
+        fn(arg)
+        rounds = rounds + 1
+    until os.clock() - start > 0.2
+    return (os.clock() - start) / rounds * 1000
+end
+
+print(string.format('%-8s%10s%12s%12s%12s%12s',
+    'entries', 'bytes', 'old ser ms', 'new ser ms', 'old de ms', 'new de ms'))
+for _, n in ipairs({250, 500, 1000, 2000, 4000, 8000}) do
+    local value = block_infos(n)
+    local data = serialize(value)
+    assert(data == old_serialize(value))
+    print(string.format('%-8d%10d%12.2f%12.2f%12.2f%12.2f', n, #data,
+        timeit(old_serialize, value),
+        timeit(serialize, value),
+        timeit(function(s) return old_deserialize(old_create_stream(s)) end, data),
+        timeit(function(s) return deserialize(create_stream(s)) end, data)))
+end
@@ -0,0 +1,55 @@
+'''
+Latency of many independent calls, sequential against batch().
+
+Computer is simulated by FakeComputer which answers after a fixed latency,
+so the numbers show round trips rather than Lua execution time.
+
+Usage: python benchmarks/batch_calls.py
+'''
+from _lib import import_cc, FakeComputer
+
+sess = import_cc('sess')
+turtle = import_cc('subapis.turtle')
+redstone = import_cc('subapis.redstone')
+
+SIDES = ('top', 'bottom', 'left', 'right', 'front', 'back')
+WORKLOADS = [
+    ('getItemDetail x16',
+     [(turtle.getItemDetail, slot) for slot in range(1, 17)]),
+    ('getInput x6',
+     [(redstone.getInput, side) for side in SIDES]),
+]
+
+
+def reply(code, params):
+    if code == b'return redstone.getInput(...)':
+        return (False, )
+    return ()  # empty slot for getItemDetail
+
+
+def sequential(calls):
+    return [fn(*args) for fn, *args in calls]
+
+
+def batched(calls):
+    return sess.batch(*calls)
+
+
+def main():
+    for latency in (0.005, 0.05):
+        print('latency {:.0f} ms'.format(latency * 1000))
+        print('{:<20}{:>8}{:>10}{:>10}{:>10}{:>9}'.format(
+            'workload', 'seq rt', 'seq ms', 'batch rt', 'batch ms',
+            'speedup'))
+        for name, calls in WORKLOADS:
+            fc = FakeComputer(latency, reply)
+            old = fc.run(lambda: sequential(calls))
+            old_rt = fc.round_trips
+            new = fc.run(lambda: batched(calls))
+            new_rt = fc.round_trips
+            print('{:<20}{:>8}{:>10.1f}{:>10}{:>10.1f}{:>8.2f}x'.format(
+                name, old_rt, old * 1000, new_rt, new * 1000, old / new))
+
+
+if __name__ == '__main__':
+    main()
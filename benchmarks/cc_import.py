@@ -0,0 +1,96 @@
+'''
+Cost of cc modules: process startup, first import of every cc.* module
+in a fresh process, and memory and time of a session importing them.
+
+Usage:
+    python benchmarks/cc_import.py
+    python benchmarks/cc_import.py --src /path/to/old/checkout/src
+'''
+import argparse
+import json
+import subprocess
+import sys
+from os.path import join, dirname, abspath
+
+
+# runs in a fresh interpreter, prints json
+CHILD = '''
+import importlib, json, os, sys, time, tracemalloc
+sys.path.insert(0, {src!r})
+tracemalloc.start()
+t = time.perf_counter()
+sess = importlib.import_module('cc-secure.sess')
+startup = time.perf_counter() - t
+startup_mem = tracemalloc.get_traced_memory()[0]
+# every module the cc package exposes, older checkouts have no registry
+if hasattr(sess, '_subapi_names'):
+    modules = sorted(sess._subapi_names())
+else:
+    subapis = importlib.import_module('cc-secure.subapis')
+    modules = sorted(
+        n[:-3] for n in os.listdir(subapis.__path__[0])
+        if n.endswith('.py') and not n.startswith('_')
+        and n not in ('base.py', 'mixins.py'))
+
+# a typical program touches a few modules
+t = time.perf_counter()
+import cc
+from cc import os, term, fs
+os.getComputerID, term.write, fs.open
+typical = time.perf_counter() - t
+
+before = tracemalloc.get_traced_memory()[0]
+t = time.perf_counter()
+for name in modules:
+    mod = importlib.import_module('cc.' + name)
+    for k in dir(mod):
+        getattr(mod, k)
+cold = time.perf_counter() - t
+cold_mem = tracemalloc.get_traced_memory()[0] - before
+
+# every further session runs the same imports
+n = 1000
+before = tracemalloc.get_traced_memory()[0]
+for name in modules:
+    importlib.import_module('cc.' + name)
+warm_mem = tracemalloc.get_traced_memory()[0] - before
+tracemalloc.stop()
+t = time.perf_counter()
+for _ in range(n):
+    for name in modules:
+        importlib.import_module('cc.' + name)
+warm = (time.perf_counter() - t) / n
+print(json.dumps(dict(
+    startup=startup, startup_mem=startup_mem, typical=typical,
+    cold=cold, cold_mem=cold_mem, warm=warm, warm_mem=warm_mem,
+    modules=len(modules))))
+'''
+
+
+def run_child(src):
+    out = subprocess.run(
+        [sys.executable, '-c', CHILD.format(src=src)],
+        stdout=subprocess.PIPE, check=True).stdout
+    return json.loads(out)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        '--src', default=join(dirname(dirname(abspath(__file__))), 'src'))
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    results = [run_child(args.src) for _ in range(args.runs)]
+    best = {k: min(r[k] for r in results) for k in results[0]}
+    print('import sess:           {:8.2f} ms {:8.0f} KiB'.format(
+        best['startup'] * 1e3, best['startup_mem'] / 1024))
+    print('os, term, fs:          {:8.2f} ms'.format(best['typical'] * 1e3))
+    print('all {} modules, cold:  {:8.2f} ms {:8.0f} KiB'.format(
+        best['modules'], best['cold'] * 1e3, best['cold_mem'] / 1024))
+    print('all {} modules, warm:  {:8.2f} us {:8.0f} B'.format(
+        best['modules'], best['warm'] * 1e6, best['warm_mem']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,114 @@
+'''
+Fleet deployment: many simulated computers boot against a server
+running with --sync, which brings a program library up to date
+on each of them before their program starts.
+
+Three rounds: empty disks (everything is sent, like writing every file
+on each boot did), a library with one small edit, and a library
+which is already up to date.
+
+Usage: python benchmarks/fleet_sync.py --computers 300 --latency 0.05
+'''
+import argparse
+import asyncio
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from os.path import join, dirname, abspath
+
+from _lib import import_cc
+
+emulator = import_cc('emulator')
+
+SRC_DIR = join(dirname(dirname(abspath(__file__))), 'src')
+
+
+def make_library(directory, files, size):
+    # lua-like text files, a few kilobytes to size bytes each
+    rnd = random.Random(0)
+    words = [b'local', b'function', b'end', b'return', b'if', b'then',
+             b'turtle.dig()', b'x', b'y', b'=', b'1', b'\n']
+    lib = {}
+    for i in range(files):
+        n = rnd.randrange(size // 8, size)
+        data = b' '.join(rnd.choice(words) for _ in range(n // 5))[:n]
+        lib['lib/dir{}/mod{}.lua'.format(i % 4, i)] = data
+    for path, data in lib.items():
+        path = join(directory, path)
+        os.makedirs(dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(data)
+    return lib
+
+
+async def boot(url, count, latency, disks):
+    computers = [
+        emulator.VirtualComputer(
+            i, ['prog.py'], files=dict(disks[i], **{'prog.py': b''}),
+            latency=latency)
+        for i in range(count)]
+    elapsed = await emulator.run_computers(url, computers)
+    for c in computers:
+        if c.error:
+            raise RuntimeError(c.error)
+    return elapsed, computers
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--computers', type=int, default=300)
+    parser.add_argument('--files', type=int, default=40)
+    parser.add_argument('--size', type=int, default=40000,
+                        help='largest file of the library')
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--port', type=int, default=8766)
+    args = parser.parse_args()
+
+    tmp = tempfile.mkdtemp()
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    try:
+        lib = make_library(tmp, args.files, args.size)
+        total = sum(map(len, lib.values()))
+        proc = subprocess.Popen(
+            [sys.executable, '-m', 'cc-secure.server', '--port',
+             str(args.port), '--sync', join(tmp, 'lib') + ':lib'],
+            env=env, stdout=subprocess.DEVNULL,
+        )
+        try:
+            time.sleep(1)
+            url = 'http://127.0.0.1:{}/'.format(args.port)
+            print('{} computers, {} files, {} KiB, latency {} s'.format(
+                args.computers, len(lib), total // 1024, args.latency))
+            disks = [{} for _ in range(args.computers)]
+            for name in ('empty disks', 'one file edited', 'up to date'):
+                if name == 'one file edited':
+                    path = sorted(lib)[0]
+                    with open(join(tmp, path), 'r+b') as f:
+                        f.seek(100)
+                        f.write(b'-- edited --')
+                elapsed, computers = asyncio.run(
+                    boot(url, args.computers, args.latency, disks))
+                frames = sum(c.frames_in for c in computers)
+                print('{:16} {:6.2f} s, {:5.1f} frames per computer'.format(
+                    name, elapsed, frames / len(computers)))
+                disks = [
+                    {p: d for p, d in c.fs._files.items()
+                     if p.startswith('lib/')}
+                    for c in computers]
+            path = sorted(lib)[0]
+            with open(join(tmp, path), 'rb') as f:
+                data = f.read()
+            assert all(d[path] == data for d in disks)
+        finally:
+            proc.terminate()
+            proc.wait()
+    finally:
+        shutil.rmtree(tmp)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+'''
+Dashboard frames drawn directly with term calls against FrameBuffer.
+
+Computer is simulated by FakeComputer which answers after a fixed latency.
+Each frame redraws every row of a 51x19 screen as three colored segments,
+next frames change only a couple of values.
+
+Usage: python benchmarks/framebuffer.py
+'''
+from _lib import import_cc, FakeComputer
+
+term = import_cc('subapis.term')
+colors = import_cc('subapis.colors')
+FrameBuffer = import_cc('subapis.framebuffer').FrameBuffer
+
+WIDTH, HEIGHT = 51, 19
+FRAMES = 5
+
+
+def reply(code, params):
+    if code == b'return term.getSize(...)':
+        return (WIDTH, HEIGHT)
+    return ()
+
+
+def draw(t, frame):
+    for y in range(1, HEIGHT + 1):
+        t.setCursorPos(1, y)
+        t.setTextColor(colors.white)
+        t.write('sensor {:<10}'.format(y))
+        t.setTextColor(colors.lime)
+        t.write('{:>16}'.format(frame if y < 3 else y * 100))
+        t.setTextColor(colors.gray)
+        t.write(' ' * (WIDTH - 33))
+
+
+def direct():
+    for frame in range(FRAMES):
+        draw(term, frame)
+
+
+def buffered():
+    fb = FrameBuffer()
+    for frame in range(FRAMES):
+        draw(fb, frame)
+        fb.flush()
+
+
+def main():
+    for latency in (0.005, 0.02):
+        print('latency {:.0f} ms, {} frames'.format(latency * 1000, FRAMES))
+        print('{:<10}{:>8}{:>10}{:>10}'.format(
+            'mode', 'rt', 'ms', 'fps'))
+        for name, fn in (('direct', direct), ('buffered', buffered)):
+            fc = FakeComputer(latency, reply)
+            t = fc.run(fn)
+            print('{:<10}{:>8}{:>10.1f}{:>10.1f}'.format(
+                name, fc.round_trips, t * 1000, FRAMES / t))
+
+
+if __name__ == '__main__':
+    main()
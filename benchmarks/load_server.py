@@ -0,0 +1,87 @@
+'''
+Load test: many simulated computers against a real server process.
+
+Each computer opens a REPL session and types a loop which alternates
+some Python work with os.getComputerID() calls. Computers answer calls
+right away (or after --latency), so the server is the bottleneck.
+
+Usage: python benchmarks/load_server.py --computers 300 --workers 4
+'''
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from os.path import join, dirname, abspath
+
+import aiohttp
+
+from _lib import import_cc
+
+emulator = import_cc('emulator')
+
+SRC_DIR = join(dirname(dirname(abspath(__file__))), 'src')
+
+
+def repl_lines(calls, work):
+    return [
+        b'from cc import os',
+        'for i in range({}): w = sum(j * j for j in range({})); '
+        'c = os.getComputerID()'.format(calls, work).encode(),
+        b'',
+        b'exit()',
+    ]
+
+
+async def load(url, args):
+    lines = repl_lines(args.calls, args.work)
+    computers = [
+        emulator.VirtualComputer(i, lines=lines, latency=args.latency)
+        for i in range(args.computers)]
+    elapsed = await emulator.run_computers(url, computers)
+    # separate connections, each one is routed to the asked worker
+    async with aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(force_close=True)) as session:
+        stats = []
+        for i in range(args.workers):
+            async with session.get('{}stats?worker={}'.format(url, i)) as r:
+                stats.append(await r.json())
+    return elapsed, sum(c.calls for c in computers), stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--computers', type=int, default=100)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--calls', type=int, default=100,
+                        help='os.getComputerID() calls per computer')
+    parser.add_argument('--work', type=int, default=2000,
+                        help='python work between calls')
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--port', type=int, default=8765)
+    args = parser.parse_args()
+
+    env = dict(os.environ, PYTHONPATH=SRC_DIR)
+    proc = subprocess.Popen(
+        [sys.executable, '-m', 'cc-secure.server', '--port', str(args.port),
+         '--workers', str(args.workers)],
+        env=env, stdout=subprocess.DEVNULL,
+    )
+    try:
+        time.sleep(1 + args.workers * 0.5)
+        url = 'http://127.0.0.1:{}/'.format(args.port)
+        elapsed, calls, stats = asyncio.run(load(url, args))
+    finally:
+        proc.terminate()
+        proc.wait()
+
+    print('{} computers, {} workers: {:.2f} s, {:.0f} calls/s'.format(
+        args.computers, args.workers, elapsed, calls / elapsed))
+    for s in stats:
+        print(json.dumps(s))
+
+
+if __name__ == '__main__':
+    main()
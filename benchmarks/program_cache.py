@@ -0,0 +1,50 @@
+'''
+Cost of starting a program: RestrictedPython compile against cached code.
+
+Usage: python benchmarks/program_cache.py
+'''
+import tempfile
+import warnings
+
+from _lib import import_cc, bench
+
+progcache = import_cc('progcache')
+
+
+def program(functions):
+    # turtle farm style program, many small functions
+    return ''.join(
+        'def step{0}(turtle, n):\n'
+        '    for i in range(n):\n'
+        '        if turtle.detect():\n'
+        '            turtle.dig()\n'
+        '        turtle.forward()\n'
+        '    return n * {0}\n\n'.format(i)
+        for i in range(functions)).encode()
+
+
+def main():
+    warnings.simplefilter('ignore')
+    print('{:<12}{:>10}{:>12}{:>12}{:>12}'.format(
+        'lines', 'bytes', 'compile ms', 'memory us', 'disk us'))
+    for functions in (10, 100, 1000):
+        source = program(functions)
+        path = b'farm.py'
+        cold = progcache.ProgramCache()
+        compile_time = bench(
+            lambda: (cold._codes.clear(), cold.compile(path, source)))
+        warm = progcache.ProgramCache()
+        warm.compile(path, source)
+        memory_time = bench(warm.compile, path, source)
+        with tempfile.TemporaryDirectory() as d:
+            progcache.ProgramCache(directory=d).compile(path, source)
+            disk = progcache.ProgramCache(directory=d)
+            disk_time = bench(
+                lambda: (disk._codes.clear(), disk.compile(path, source)))
+        print('{:<12}{:>10}{:>12.2f}{:>12.1f}{:>12.1f}'.format(
+            source.count(b'\n'), len(source), compile_time * 1000,
+            memory_time * 1e6, disk_time * 1e6))
+
+
+if __name__ == '__main__':
+    main()
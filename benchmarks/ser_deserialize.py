@@ -0,0 +1,67 @@
+'''
+Throughput of ser.deserialize against the previous recursive implementation.
+
+Usage: python benchmarks/ser_deserialize.py
+'''
+from _lib import import_cc, bench, inventory, block_infos
+
+ser = import_cc('ser')
+
+
+def legacy_deserialize(b, _idx=0):
+    # recursive deserializer as it was before the single-pass rewrite
+    tok = b[_idx]
+    _idx += 1
+    if tok == 78:  # N
+        return None, _idx
+    elif tok == 70:  # F
+        return False, _idx
+    elif tok == 84:  # T
+        return True, _idx
+    elif tok == 91:  # [
+        newidx = b.index(b']', _idx)
+        f = float(b[_idx:newidx])
+        if f.is_integer():
+            f = int(f)
+        return f, newidx + 1
+    elif tok == 60:  # <
+        newidx = b.index(b'>', _idx)
+        ln = int(b[_idx:newidx])
+        return b[newidx + 1:newidx + 1 + ln], newidx + 1 + ln
+    elif tok == 123:  # {
+        r = {}
+        while True:
+            tok = b[_idx]
+            _idx += 1
+            if tok == 125:  # }
+                break
+            key, _idx = legacy_deserialize(b, _idx)
+            value, _idx = legacy_deserialize(b, _idx)
+            r[key] = value
+        return r, _idx
+    else:
+        raise ValueError
+
+
+PAYLOADS = [
+    ('inventory 27', inventory(27)),
+    ('inventory 1k', inventory(1000)),
+    ('block infos 100', block_infos(100)),
+    ('block infos 10k', block_infos(10000)),
+]
+
+
+def main():
+    print('{:<18}{:>10}{:>12}{:>12}{:>9}'.format(
+        'payload', 'bytes', 'old MiB/s', 'new MiB/s', 'speedup'))
+    for name, value in PAYLOADS:
+        data = ser.serialize(value)
+        assert legacy_deserialize(data)[0] == ser.deserialize(data)
+        old = len(data) / bench(legacy_deserialize, data, 0) / 2 ** 20
+        new = len(data) / bench(ser._deserialize, data, 0) / 2 ** 20
+        print('{:<18}{:>10}{:>12.2f}{:>12.2f}{:>8.2f}x'.format(
+            name, len(data), old, new, new / old))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,35 @@
+'''
+Printing 10k lines with and without stdout buffering.
+
+Computer is simulated by FakeComputer which answers after a fixed latency.
+
+Usage: python benchmarks/stdout_buffer.py
+'''
+from _lib import import_cc, FakeComputer
+
+sess = import_cc('sess')
+
+LINES = 10000
+LATENCY = 0.001
+
+
+def program():
+    for i in range(LINES):
+        print('line', i)
+
+
+def main():
+    print('{} lines, latency {:.0f} ms'.format(LINES, LATENCY * 1000))
+    print('{:<12}{:>8}{:>10}'.format('mode', 'rt', 'ms'))
+    buffer_size = sess.OUTPUT_BUFFER_SIZE
+    for name, size in (('unbuffered', 0), ('buffered', buffer_size)):
+        sess.OUTPUT_BUFFER_SIZE = size
+        fc = FakeComputer(LATENCY)
+        t = fc.run(program)
+        print('{:<12}{:>8}{:>10.1f}'.format(
+            name, fc.round_trips, t * 1000))
+    sess.OUTPUT_BUFFER_SIZE = buffer_size
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,465 @@
+'''
+Benchmark suite for hot paths, with JSON reports to track regressions.
+
+Round trips go through a real CCSession and an in-process computer
+(FakeComputer with zero latency), so they measure server CPU per call.
+fs calls are answered by the emulator.
+
+Usage:
+    python benchmarks/suite.py --json before.json
+    python benchmarks/suite.py --compare before.json  # exits 1 on regression
+    python benchmarks/suite.py -k roundtrip --fast
+'''
+import argparse
+import asyncio
+import json
+import platform
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+from os.path import dirname, abspath
+
+from greenlet import greenlet
+
+from _lib import (
+    import_cc, measure, inventory, block_infos, term_blits, FakeComputer)
+
+ser = import_cc('ser')
+bser = import_cc('bser')
+rproc = import_cc('rproc')
+sess = import_cc('sess')
+emulator = import_cc('emulator')
+os = import_cc('subapis.os')
+fs = import_cc('subapis.fs')
+term = import_cc('subapis.term')
+parallel = import_cc('subapis.parallel')
+scodeop = import_cc('scacop.scodeop')
+
+BENCHMARKS = []
+
+
+def benchmark(name, unit='s'):
+    # fn(budget) returns list of values, seconds per operation by default
+    def deco(fn):
+        BENCHMARKS.append((name, unit, fn))
+        return fn
+    return deco
+
+
+# ---- serialization
+
+PAYLOADS = [
+    ('inventory27', inventory(27)),
+    ('inventory1k', inventory(1000)),
+    ('blocks100', block_infos(100)),
+    ('blits51x19', term_blits()),
+]
+
+for _codec_name, _codec in (('text', ser), ('binary', bser)):
+    for _name, _value in PAYLOADS:
+        _data = _codec.serialize(_value)
+        benchmark('serialize.{}.{}'.format(_codec_name, _name))(
+            lambda budget, c=_codec, v=_value: measure(
+                c.serialize, v, budget=budget))
+        benchmark('deserialize.{}.{}'.format(_codec_name, _name))(
+            lambda budget, c=_codec, d=_data: measure(
+                c.deserialize, d, budget=budget))
+
+
+@benchmark('rproc.take_inventory27')
+def _rproc_inventory(budget):
+    keys = (b'name', b'count', b'nbt')
+    result = {i: item for i, item in inventory(27).items()}
+
+    def take():
+        rp = rproc.ResultProc(result)
+        for _ in range(27):
+            tp = rp.take_dict(keys)
+            tp.take_string()
+            tp.take_int()
+            tp.take_option_string()
+    return measure(take, budget=budget)
+
+
+@benchmark('rproc.take_list_of_strings100')
+def _rproc_strings(budget):
+    result = {1: {i: b'file%d.lua' % i for i in range(1, 101)}}
+    return measure(
+        lambda: rproc.ResultProc(result).take_list_of_strings(),
+        budget=budget)
+
+
+# ---- greenlets and session
+
+@benchmark('greenlet.switch')
+def _greenlet_switch(budget):
+    n = 10000
+
+    def pingpong():
+        main = greenlet.getcurrent().parent
+        while True:
+            main.switch()
+
+    def run():
+        g = greenlet(pingpong)
+        for _ in range(n):
+            g.switch()
+    return [t / n for t in measure(run, budget=budget)]
+
+
+def _program_runs(fn, ops, budget, reply=lambda code, params: (), runs=5):
+    # seconds per operation of a program run on FakeComputer
+    fc = FakeComputer(0, reply)
+    fc.run(fn)  # warm up chunk cache and imports
+    once = fc.run(fn)
+    number = max(1, int(budget / runs / max(once, 1e-7)))
+    values = []
+    for _ in range(runs):
+        values.append(sum(fc.run(fn) for _ in range(number)) / number / ops)
+    return values
+
+
+@benchmark('roundtrip.eval_lua')
+def _roundtrip(budget):
+    n = 500
+
+    def program():
+        for _ in range(n):
+            sess.eval_lua('return os.getComputerID(...)').take_int()
+    return _program_runs(program, n, budget, lambda code, params: (1,))
+
+
+@benchmark('roundtrip.pipelined_void')
+def _pipelined(budget):
+    n = 2000
+
+    def program():
+        with sess.pipelined():
+            for _ in range(n):
+                term.write('x')
+    return _program_runs(program, n, budget)
+
+
+@benchmark('roundtrip.batch16')
+def _batch(budget):
+    n = 50
+    calls = [(os.getComputerID,)] * 16
+
+    def program():
+        for _ in range(n):
+            sess.batch(*calls)
+    return _program_runs(program, n, budget, lambda code, params: (1,))
+
+
+@benchmark('events.fanout100')
+def _event_fanout(budget):
+    receivers, events = 100, 20
+
+    def receiver():
+        for i, _ in enumerate(os.captureEvent('bench'), start=1):
+            if i == events:
+                return
+
+    def run():
+        async def main():
+            fc = FakeComputer(0)
+            evr = fc.sess._evr
+            done = asyncio.get_running_loop().create_future()
+
+            def program():
+                try:
+                    parallel.waitForAll(*[receiver] * receivers)
+                finally:
+                    done.set_result(None)
+
+            fc.sess._run_sandboxed_greenlet(program)
+            while len(evr._stacks.get(b'bench', ())) < receivers:
+                await asyncio.sleep(0)
+            start = time.perf_counter()
+            for _ in range(events):
+                fc.sess.on_event(b'bench', {})
+            await done
+            return time.perf_counter() - start
+        return asyncio.run(main())
+
+    run()
+    once = run()
+    number = max(1, int(budget / 5 / max(once, 1e-7)))
+    return [
+        sum(run() for _ in range(number)) / number / (receivers * events)
+        for _ in range(5)]
+
+
+@benchmark('memory.session', unit='B')
+def _session_memory(budget):
+    # python memory of a session blocked in a call, greenlet stack included
+    n = 200
+
+    def run():
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        sessions = []
+        for i in range(n):
+            s = sess.CCSession(i, lambda data: None, bser)
+            s._run_sandboxed_greenlet(os.getComputerID)
+            sessions.append(s)
+        size = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        return size / n
+    return [run() for _ in range(3)]
+
+
+# ---- subapi workloads
+
+@benchmark('term.redraw51x19')
+def _term_redraw(budget):
+    blits = term_blits()
+
+    def program():
+        with sess.pipelined():
+            for y, (_, (text, fg, bg)) in enumerate(blits, start=1):
+                term.setCursorPos(1, y)
+                term.blit(ser.decode(text), fg, bg)
+        term.getCursorPos()
+    return _program_runs(program, 1, budget, lambda code, params: (1, 1))
+
+
+def _emulated(files=None):
+    # answers calls like a computer would, through emulator APIs
+    computer = emulator.VirtualComputer(0, files=files)
+
+    def reply(code, params):
+        return emulator.compile_chunk(code)(computer, params)
+    return reply
+
+
+@benchmark('fs.write_read100')
+def _fs_lines(budget):
+    n = 100
+
+    def program():
+        with fs.open('bench.txt', 'w') as f:
+            for i in range(n):
+                f.writeLine('line {}'.format(i))
+        with fs.open('bench.txt', 'r') as f:
+            for line in f:
+                pass
+    return _program_runs(program, n, budget, _emulated())
+
+
+@benchmark('fs.list_isdir20')
+def _fs_list(budget):
+    files = {'dir/file{}.lua'.format(i): b'' for i in range(20)}
+
+    def program():
+        for name in fs.list('dir'):
+            fs.isDir(fs.combine('dir', name))
+    return _program_runs(program, 1, budget, _emulated(files))
+
+
+def _fs_probe(budget, cached):
+    # a program polling the same paths, per exists/isDir/getSize call
+    files = {'dir/file{}.lua'.format(i): b'' for i in range(20)}
+    rounds = 10
+
+    def program():
+        fs.cache(cached)
+        for _ in range(rounds):
+            for name in fs.list('dir'):
+                p = 'dir/' + name
+                if fs.exists(p) and not fs.isDir(p):
+                    fs.getSize(p)
+    return _program_runs(
+        program, rounds * len(files) * 3, budget, _emulated(files))
+
+
+benchmark('fs.probe20')(lambda budget: _fs_probe(budget, False))
+benchmark('fs.probe20_cached')(lambda budget: _fs_probe(budget, True))
+
+
+@benchmark('fs.iter_lines20k')
+def _fs_iter_lines(budget):
+    n = 20000
+    files = {'data.csv': b''.join(b'%d,%d,stone\n' % (i, i * 7) for i in range(n))}
+
+    def program():
+        with fs.open('data.csv', 'r') as f:
+            for line in f:
+                pass
+    return _program_runs(program, n, budget, _emulated(files))
+
+
+@benchmark('fs.tree2k')
+def _fs_tree(budget):
+    files = {
+        'a{}/b{}/f{}.txt'.format(a, b, f): b'x'
+        for a in range(10) for b in range(10) for f in range(20)}
+
+    def program():
+        fs.tree('/')
+    return _program_runs(program, len(files), budget, _emulated(files))
+
+
+@benchmark('fs.stream_read500k')
+def _fs_stream_read(budget):
+    files = {'big.log': bytes(range(256)) * 2000}
+
+    def program():
+        with fs.open('big.log', 'rb') as f:
+            f.stream().read()
+    return _program_runs(program, 1, budget, _emulated(files))
+
+
+@benchmark('fs.stream_write500k')
+def _fs_stream_write(budget):
+    record = bytes(range(256)) * 4
+
+    def program():
+        with fs.open('big.log', 'wb') as f:
+            s = f.stream()
+            for _ in range(500):
+                s.write(record)
+    return _program_runs(program, 1, budget, _emulated())
+
+
+# ---- repl
+
+PASTED_BLOCK = '''\
+def dig_row(length):
+    for i in range(length):
+        while turtle.detect():
+            turtle.dig()
+        turtle.forward()
+        if turtle.getFuelLevel() < 10:
+            for slot in range(1, 17):
+                turtle.select(slot)
+                if turtle.refuel(1):
+                    break
+    return length
+
+'''.split('\n')
+
+
+def _push_lines(lines):
+    # like InteractiveConsole.push: compile the buffer after each line
+    compiler = scodeop.CommandCompiler()
+    buffer = []
+    for line in lines:
+        buffer.append(line)
+        if compiler('\n'.join(buffer), '<console>') is not None:
+            buffer = []
+
+
+@benchmark('repl.paste_block12')
+def _repl_paste(budget):
+    def run():
+        scodeop._cache.clear()
+        _push_lines(PASTED_BLOCK)
+    return measure(run, budget=budget)
+
+
+@benchmark('repl.repeat_line')
+def _repl_repeat(budget):
+    compiler = scodeop.CommandCompiler()
+    return measure(
+        compiler, 'turtle.forward(); turtle.turnLeft()', '<console>',
+        budget=budget)
+
+
+# ---- reports
+
+def _meta():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=dirname(abspath(__file__)),
+            stdout=subprocess.PIPE, stderr=subprocess.DEVNULL,
+        ).stdout.decode().strip() or None
+    except OSError:
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'commit': commit,
+        'date': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+
+
+def _format(value, unit):
+    if unit == 'B':
+        return '{:.0f} B'.format(value)
+    for scale, suffix in ((1, 's'), (1e-3, 'ms'), (1e-6, 'us')):
+        if value >= scale:
+            return '{:.2f} {}'.format(value / scale, suffix)
+    return '{:.0f} ns'.format(value * 1e9)
+
+
+def run(names, budget):
+    results = {}
+    for name, unit, fn in BENCHMARKS:
+        if names and not any(n in name for n in names):
+            continue
+        values = fn(budget)
+        mean = statistics.mean(values)
+        stdev = statistics.stdev(values) if len(values) > 1 else 0.0
+        results[name] = {
+            'unit': unit,
+            'values': values,
+            'mean': mean,
+            'stdev': stdev,
+        }
+        print('{:<36}{:>12} +- {:<10}'.format(
+            name, _format(mean, unit), _format(stdev, unit)), flush=True)
+    return results
+
+
+def compare(results, base, threshold):
+    # returns names of benchmarks which got slower (or bigger)
+    print()
+    print('{:<36}{:>12}{:>12}{:>9}'.format('benchmark', 'base', 'now', 'change'))
+    regressions = []
+    for name, r in results.items():
+        b = base.get(name)
+        if b is None or b['unit'] != r['unit']:
+            continue
+        ratio = r['mean'] / b['mean']
+        noise = (r['stdev'] + b['stdev']) / b['mean']
+        mark = ''
+        if ratio > 1 + max(threshold, noise):
+            mark = '  slower'
+            regressions.append(name)
+        elif ratio < 1 - max(threshold, noise):
+            mark = '  faster'
+        print('{:<36}{:>12}{:>12}{:>8.2f}x{}'.format(
+            name, _format(b['mean'], b['unit']), _format(r['mean'], r['unit']),
+            ratio, mark))
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-k', dest='names', action='append',
+                        help='run benchmarks which names contain this')
+    parser.add_argument('--json', help='write report to this file')
+    parser.add_argument('--compare', help='report to compare against')
+    parser.add_argument('--threshold', type=float, default=0.1,
+                        help='relative change reported as regression')
+    parser.add_argument('--fast', action='store_true',
+                        help='shorter runs, noisier numbers')
+    args = parser.parse_args()
+
+    results = run(args.names, 0.1 if args.fast else 0.5)
+    if args.json:
+        with open(args.json, 'w') as f:
+            json.dump({'meta': _meta(), 'benchmarks': results}, f, indent=1)
+    if args.compare:
+        with open(args.compare) as f:
+            base = json.load(f)['benchmarks']
+        if compare(results, base, args.threshold):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,41 @@
+'''
+Size and throughput of the text (v3) and binary (v4) wire formats.
+
+Usage: python benchmarks/wire_formats.py
+'''
+from _lib import import_cc, bench, inventory, block_infos, term_blits
+
+ser = import_cc('ser')
+bser = import_cc('bser')
+
+
+PAYLOADS = [
+    ('inventory 27', inventory(27)),
+    ('inventory 1k', inventory(1000)),
+    ('block infos 10k', block_infos(10000)),
+    ('term blits 51x19', term_blits()),
+    ('monitor blits 164x81', term_blits(164, 81)),
+]
+
+
+def main():
+    print('{:<22}{:>10}{:>10}{:>7}  {:>9}{:>9}  {:>9}{:>9}'.format(
+        'payload', 'text B', 'binary B', 'ratio',
+        'text ser', 'bin ser', 'text de', 'bin de'))
+    for name, value in PAYLOADS:
+        tdata = ser.serialize(value)
+        bdata = bser.serialize(value)
+        assert ser.deserialize(tdata) == bser.deserialize(bdata)
+        # MiB/s of the decoded python value, measured by text size
+        mib = len(tdata) / 2 ** 20
+        print('{:<22}{:>10}{:>10}{:>7.2f}  {:>9.1f}{:>9.1f}  {:>9.1f}{:>9.1f}'.format(
+            name, len(tdata), len(bdata), len(bdata) / len(tdata),
+            mib / bench(ser.serialize, value),
+            mib / bench(bser.serialize, value),
+            mib / bench(ser.deserialize, tdata),
+            mib / bench(bser.deserialize, bdata),
+        ))
+
+
+if __name__ == '__main__':
+    main()
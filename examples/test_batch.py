@@ -0,0 +1,152 @@
+from cc import (
+    LuaException, batch, eval_lua, fs, import_file, os, parallel, pipelined,
+    term)
+
+_lib = import_file('_lib.py', __file__)
+assert_raises = _lib.assert_raises
+
+
+for name in ('tbatch', 'tbatch2'):
+    if fs.exists(name):
+        fs.delete(name)
+
+
+# results come in order of calls, whatever order computer runs them in
+assert batch() == []
+assert batch(
+    (fs.exists, 'rom'),
+    (fs.exists, 'doesnotexist'),
+    (fs.isDir, 'rom'),
+    os.getComputerID,
+) == [True, False, True, os.getComputerID()]
+assert batch(*(
+    (lambda i=i: eval_lua('return ...', i).take_int())
+    for i in range(20)
+)) == list(range(20))
+print('Order OK')
+
+
+# functions making several calls wait for a round trip per call
+def make_dir(path):
+    fs.makeDir(path)
+    return fs.isDir(path), fs.list(path)
+
+
+assert batch(
+    (make_dir, 'tbatch'),
+    (make_dir, 'tbatch2'),
+) == [(True, []), (True, [])]
+fs.delete('tbatch2')
+print('Several calls OK')
+
+
+# error of the first failed function is raised after all of them have run
+with assert_raises(LuaException):
+    batch(
+        (fs.getSize, 'tbatch/nope1'),
+        (fs.makeDir, 'tbatch2'),
+        (fs.getSize, 'tbatch/nope2'),
+    )
+assert fs.isDir('tbatch2')
+fs.delete('tbatch2')
+
+try:
+    batch(
+        (fs.exists, 'rom'),
+        (fs.getSize, 'tbatch/nope1'),
+        (fs.getSize, 'tbatch/nope2'),
+    )
+except LuaException as e:
+    assert 'nope1' in str(e), str(e)
+else:
+    raise AssertionError('batch must raise')
+
+
+def breaks():
+    raise ValueError
+
+
+with assert_raises(ValueError):
+    batch(breaks, (fs.getSize, 'tbatch/nope1'))
+print('Errors OK')
+
+
+# nested batch is collected by the outer one
+def probe():
+    return batch((fs.exists, 'rom'), (fs.exists, 'doesnotexist'))
+
+
+assert batch(probe, probe, (fs.isDir, 'tbatch')) == [
+    [True, False], [True, False], True]
+
+with assert_raises(LuaException):
+    batch(probe, lambda: batch((fs.getSize, 'tbatch/nope')))
+print('Nested OK')
+
+
+# calls returning nothing and values mix, pipelined calls go before
+assert batch(
+    (term.setCursorPos, 2, 3),
+    term.getCursorPos,
+) == [None, (2, 3)]
+
+with pipelined():
+    term.setCursorPos(4, 5)
+    r = batch(term.getCursorPos, (fs.exists, 'rom'), (term.setCursorPos, 1, 1))
+assert r == [(4, 5), True, None]
+assert term.getCursorPos() == (1, 1)
+term.clear()
+print('Void and value calls OK')
+
+
+# output of the functions is sent after the batch,
+# more than fits the output buffer doesn't break it
+def chatty(path):
+    for i in range(40):
+        print(path, i)
+    print(path, 'done', flush=True)
+    return fs.exists(path)
+
+
+assert batch(
+    (chatty, 'rom'), (chatty, 'doesnotexist'), (chatty, 'tbatch'),
+) == [True, False, True]
+print('Output OK')
+
+
+# sleeping functions use computer timer
+def nap(path):
+    os.sleep(0.5)
+    return fs.exists(path)
+
+
+with _lib.assert_takes_time(0.4, 2):
+    assert batch((nap, 'rom'), (nap, 'doesnotexist')) == [True, False]
+print('Sleep OK')
+
+
+# functions can't wait for events or other greenlets
+def waits():
+    for e in os.captureEvent('timer'):
+        pass
+
+
+with assert_raises(RuntimeError):
+    batch(waits, (fs.exists, 'rom'))
+with assert_raises(RuntimeError):
+    batch(lambda: parallel.waitForAll(term.getCursorPos))
+assert fs.exists('rom') is True
+
+
+def piped():
+    with pipelined():
+        term.setCursorPos(1, 1)
+    return term.getCursorPos()
+
+
+assert batch(piped, piped) == [(1, 1), (1, 1)]
+print('Waiting OK')
+
+
+fs.delete('tbatch')
+print('Test finished successfully')
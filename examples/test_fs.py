@@ -1,12 +1,16 @@
-from cc import LuaException, import_file, fs
+from cc import LuaException, eval_lua, import_file, fs
 
 _lib = import_file('_lib.py', __file__)
 assert_raises, AnyInstanceOf = _lib.assert_raises, _lib.AnyInstanceOf
 
 
-assert _lib.get_class_table(fs) == _lib.get_object_table('fs')
+# walk, tree, cache and invalidate are python only
+table = _lib.get_class_table(fs)
+for name in ('walk', 'tree', 'cache', 'invalidate'):
+    del table['function'][name]
+assert table == _lib.get_object_table('fs')
 
-for name in ('tdir', 'tfile'):
+for name in ('tdir', 'tfile', 'twalk', 'tcache'):
     if fs.exists(name):
         fs.delete(name)
 
@@ -201,6 +205,98 @@ with fs.open('tdir/binfile', 'rb') as f:
 with fs.open('tdir/binfile', 'r') as f:
     assert [line for line in f] == ['bbcccaaaaddd']
 
+# \r\n ends a line like \n, also when lines come from a stream
+with fs.open('tdir/crlf', 'wb') as f:
+    f.write(b'one\r\ntwo\nthree\r\n')
+with fs.open('tdir/crlf', 'r') as f:
+    assert f.readLine() == 'one'
+    assert f.readLine(withTrailing=True) == 'two\n'
+with fs.open('tdir/crlf', 'r') as f:
+    assert [line for line in f] == ['one', 'two', 'three']
+with fs.open('tdir/crlf', 'rb') as f:
+    f.stream()
+    assert f.readLine(withTrailing=True) == b'one\r\n'
+    assert f.readLine() == b'two'
+    assert f.readLine() == b'three'
+    assert f.readLine() is None
+
+# streams send and receive several chunks per round trip
+data = bytes(range(256)) * 1000
+with fs.open('tdir/bigfile', 'wb') as f:
+    s = f.stream()
+    assert s.write(data[:1000]) == 1000
+    assert s.write(data[1000:]) == len(data) - 1000
+assert fs.getSize('tdir/bigfile') == len(data)
+
+with fs.open('tdir/bigfile', 'rb') as f:
+    s = f.stream()
+    assert s.read(10) == data[:10]
+    assert s.read() == data[10:]
+    assert s.read() == b''
+
+with fs.open('tdir/bigfile', 'rb') as f:
+    assert f.stream().readline() == data[:11]
+    assert f.read(2) == data[11:13]
+
+# walk and tree go top-down, every directory once
+assert fs.makeDir('twalk/a/b') is None
+with fs.open('twalk/x', 'w') as f:
+    f.write('xxx')
+with fs.open('twalk/a/y', 'w') as f:
+    f.write('y')
+
+assert [*fs.walk('twalk')] == [
+    ('twalk', ['a'], ['x']),
+    ('twalk/a', ['b'], ['y']),
+    ('twalk/a/b', [], []),
+]
+
+tree = fs.tree('twalk')
+assert sorted(tree) == ['twalk/a', 'twalk/a/b', 'twalk/a/y', 'twalk/x']
+assert tree['twalk/x'] == {
+    'created': AnyInstanceOf(int),
+    'modification': AnyInstanceOf(int),
+    'isDir': False,
+    'size': 3,
+}
+assert tree['twalk/a/b']['isDir'] is True
+assert fs.delete('twalk') is None
+
+# cached results are dropped by changes made through fs
+c = fs.cache()
+assert fs.cache() is c
+assert fs.exists('tcache') is False
+assert fs.makeDir('tcache') is None
+assert fs.exists('tcache') is True
+assert fs.isDir('tcache') is True
+assert fs.list('tcache') == []
+
+with fs.open('tcache/a', 'w') as f:
+    f.write('abc')
+assert fs.list('tcache') == ['a']
+assert fs.getSize('tcache/a') == 3
+assert fs.getSize('tcache/a') == 3
+with fs.open('tcache/a', 'a') as f:
+    f.write('de')
+assert fs.getSize('tcache/a') == 5
+
+assert fs.makeDir('tcache/b') is None
+assert fs.list('tcache') == ['a', 'b']
+assert fs.delete('tcache/a') is None
+assert fs.exists('tcache/a') is False
+assert fs.list('tcache') == ['b']
+assert c.stats()['hits'] > 0
+
+# other changes are seen after invalidate
+eval_lua('return fs.makeDir(...)', b'tcache/c')
+assert fs.list('tcache') == ['b']
+fs.invalidate('tcache/c')
+assert fs.list('tcache') == ['b', 'c']
+
+assert fs.cache(False) is None
+assert fs.delete('tcache') is None
+assert fs.exists('tcache') is False
+
 assert fs.delete('tdir') is None
 assert fs.delete('tfile') is None
 assert fs.delete('doesnotexist') is None
@@ -44,6 +44,7 @@ assert os.cancelAlarm(alarm_id) is None
 
 with _lib.assert_takes_time(1.5, 3):
     assert os.sleep(2) is None
+assert os.sleep(None) is None
 
 assert (os.version()).startswith('CraftOS ')
 assert isinstance(os.getComputerID(), int)
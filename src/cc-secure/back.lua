@@ -3,117 +3,425 @@ local temp = {}
 local event_sub = {}
 genv.temp = temp
 local url = '<pyserv>'
-local proto_version = 3
+local proto_version = 9
+local wire_format = 'binary'
 local tasks = {}
 local filters = {}
+local waiting = {}  -- event name to set of tasks waiting for it
+local unfiltered = {}  -- set of tasks resumed by any event
+local new_tasks = {}  -- tasks not started yet, in order of arrival
 local ycounts = {}
 local coparams = {}
+local chunks = {}  -- compiled code by slot number, slots are managed by server
 
-local ws = http.websocket(url..'ws/')
+-- computer id lets multi-process server route the computer to its worker
+local ws = http.websocket(url..'ws/?id='..os.getComputerID())
 if ws == false then
     error('Unable to connect to server '..url..'ws/')
 end
 
 local serialize
 do
-    local function s_rec(v, tracking)
+    local function s_rec(v, buf, tracking)
         local t = type(v)
         if v == nil then
-            return 'N'
+            buf[#buf + 1] = 'N'
         elseif v == false then
-            return 'F'
+            buf[#buf + 1] = 'F'
         elseif v == true then
-            return 'T'
+            buf[#buf + 1] = 'T'
         elseif t == 'number' then
-            return '\[' .. tostring(v) .. '\]'
+            buf[#buf + 1] = '\[' .. tostring(v) .. '\]'
         elseif t == 'string' then
-            return string.format('<%u>', #v) .. v
+            buf[#buf + 1] = string.format('<%u>', #v)
+            buf[#buf + 1] = v
         elseif t == 'table' then
             if tracking[v] ~= nil then
                 error('Cannot serialize table with recursive entries', 0)
             end
             tracking[v] = true
-            local r = '{'
+            buf[#buf + 1] = '{'
             for k, x in pairs(v) do
-                r = r .. ':' .. s_rec(k, tracking) .. s_rec(x, tracking)
+                buf[#buf + 1] = ':'
+                s_rec(k, buf, tracking)
+                s_rec(x, buf, tracking)
             end
-            return r .. '}'
+            buf[#buf + 1] = '}'
         else
             error('Cannot serialize type ' .. t, 0)
         end
-        local tp = type(t)
     end
-    serialize = function(v) return s_rec(v, {}) end
+    serialize = function(v)
+        local buf = {}
+        s_rec(v, buf, {})
+        return table.concat(buf)
+    end
 end
 
 function create_stream(s, idx)
-    if idx == nil then idx = 1 end
-    return {
-        getidx=function() return idx end,
-        isend=function() return idx > #s end,
-        fixed=function(n)
-            local r = s:sub(idx, idx + n - 1)
-            if #r ~= n then error('Unexpected end of stream') end
-            idx = idx + n
-            return r
-        end,
-        tostop=function(sym)
-            local newidx = s:find(sym, idx, true)
+    -- decoders read s and idx directly, other readers go through methods
+    local stream = {s=s, idx=idx or 1}
+    stream.getidx = function() return stream.idx end
+    stream.isend = function() return stream.idx > #s end
+    stream.fixed = function(n)
+        local r = s:sub(stream.idx, stream.idx + n - 1)
+        if #r ~= n then error('Unexpected end of stream') end
+        stream.idx = stream.idx + n
+        return r
+    end
+    return stream
+end
+
+local function unexpected_token(tok)
+    if tok == nil then error('Unexpected end of stream') end
+    error('Unknown token ' .. string.char(tok))
+end
+
+local function substr(s, from, to)
+    if to > #s then error('Unexpected end of stream') end
+    return s:sub(from, to)
+end
+
+local deserialize
+do
+    local byte, find, sub = string.byte, string.find, string.sub
+
+    local function tostop(s, idx, sym)
+        local newidx = find(s, sym, idx, true)
+        if newidx == nil then error('Unexpected end of stream') end
+        return sub(s, idx, newidx - 1), newidx + 1
+    end
+
+    local function d_rec(s, idx)
+        local tok = byte(s, idx)
+        idx = idx + 1
+        if tok == 60 then  -- <
+            local newidx = find(s, '>', idx, true)
             if newidx == nil then error('Unexpected end of stream') end
-            local r = s:sub(idx, newidx - 1)
-            idx = newidx + 1
-            return r
-        end,
-    }
-end
-
-function deserialize(stream)
-    local tok = stream.fixed(1)
-    if tok == 'N' then
-        return nil
-    elseif tok == 'F' then
-        return false
-    elseif tok == 'T' then
-        return true
-    elseif tok == '\[' then
-        return tonumber(stream.tostop('\]'))
-    elseif tok == '<' then
-        local slen = tonumber(stream.tostop('>'))
-        return stream.fixed(slen)
-    elseif tok == 'E' then
-        -- same as string (<), but intended for evaluation
-        local slen = tonumber(stream.tostop('>'))
-        local fn = assert(loadstring(stream.fixed(slen)))
-        setfenv(fn, genv)
-        return fn()
-    elseif tok == '{' then
-        local r = {}
+            local last = newidx + tonumber(sub(s, idx, newidx - 1))
+            if last > #s then error('Unexpected end of stream') end
+            return sub(s, newidx + 1, last), last + 1
+        elseif tok == 91 then  -- [
+            local newidx = find(s, '\]', idx, true)
+            if newidx == nil then error('Unexpected end of stream') end
+            return tonumber(sub(s, idx, newidx - 1)), newidx + 1
+        elseif tok == 123 then  -- {
+            local r = {}
+            while byte(s, idx) == 58 do  -- :
+                local key, value
+                key, idx = d_rec(s, idx + 1)
+                value, idx = d_rec(s, idx)
+                r[key] = value
+            end
+            if byte(s, idx) ~= 125 then unexpected_token(byte(s, idx)) end
+            return r, idx + 1
+        elseif tok == 78 then  -- N
+            return nil, idx
+        elseif tok == 70 then  -- F
+            return false, idx
+        elseif tok == 84 then  -- T
+            return true, idx
+        elseif tok == 69 then  -- E
+            -- same as string (<), but intended for evaluation
+            local slen
+            slen, idx = tostop(s, idx, '>')
+            slen = tonumber(slen)
+            local fn = assert(loadstring(substr(s, idx, idx + slen - 1)))
+            setfenv(fn, genv)
+            return fn(), idx + slen
+        else
+            unexpected_token(tok)
+        end
+    end
+    deserialize = function(stream)
+        local r
+        r, stream.idx = d_rec(stream.s, stream.idx)
+        return r
+    end
+end
+
+-- binary wire format, see bser.py for the description
+local bin_serialize, bin_deserialize
+do
+    local byte, char, floor = string.byte, string.char, math.floor
+    local frexp, ldexp = math.frexp, math.ldexp
+    local huge = math.huge
+    local int_limit = 2 ^ 53
+
+    local pack_double, unpack_double
+    if string.pack ~= nil then
+        pack_double = function(x) return string.pack('>d', x) end
+        unpack_double = function(s) return (string.unpack('>d', s)) end
+    else
+        pack_double = function(x)
+            local sign = 0
+            if x < 0 or (x == 0 and 1 / x < 0) then
+                sign = 128
+                x = -x
+            end
+            local mant, expo
+            if x ~= x then
+                return char(127, 248, 0, 0, 0, 0, 0, 0)
+            elseif x == huge then
+                mant, expo = 0, 2047
+            elseif x == 0 then
+                mant, expo = 0, 0
+            else
+                local m, e = frexp(x)
+                expo = e + 1022
+                if expo <= 0 then
+                    mant, expo = ldexp(x, 1074), 0
+                else
+                    mant = ldexp(m, 53) - 2 ^ 52
+                end
+            end
+            local r = {}
+            for i = 8, 3, -1 do
+                r[i] = char(mant % 256)
+                mant = floor(mant / 256)
+            end
+            r[2] = char((expo % 16) * 16 + mant)
+            r[1] = char(sign + floor(expo / 16))
+            return table.concat(r)
+        end
+        unpack_double = function(s)
+            local b1, b2 = byte(s, 1, 2)
+            local expo = (b1 % 128) * 16 + floor(b2 / 16)
+            local mant = b2 % 16
+            for i = 3, 8 do
+                mant = mant * 256 + byte(s, i)
+            end
+            local x
+            if expo == 2047 then
+                if mant == 0 then x = huge else x = 0 / 0 end
+            elseif expo == 0 then
+                x = ldexp(mant, -1074)
+            else
+                x = ldexp(mant + 2 ^ 52, expo - 1075)
+            end
+            if b1 >= 128 then x = -x end
+            return x
+        end
+    end
+
+    local function put_varint(buf, n)
+        while n >= 128 do
+            buf[#buf + 1] = char(n % 128 + 128)
+            n = floor(n / 128)
+        end
+        buf[#buf + 1] = char(n)
+    end
+
+    local function s_rec(v, buf, tracking)
+        local t = type(v)
+        if v == nil then
+            buf[#buf + 1] = 'N'
+        elseif v == false then
+            buf[#buf + 1] = 'F'
+        elseif v == true then
+            buf[#buf + 1] = 'T'
+        elseif t == 'number' then
+            if v ~= floor(v) or v >= int_limit or v <= -int_limit then
+                buf[#buf + 1] = 'd' .. pack_double(v)
+            elseif v >= 0 and v < 64 then
+                buf[#buf + 1] = char(128 + v)
+            elseif v >= 0 then
+                buf[#buf + 1] = 'i'
+                put_varint(buf, v)
+            else
+                buf[#buf + 1] = 'j'
+                put_varint(buf, -v)
+            end
+        elseif t == 'string' then
+            if #v < 64 then
+                buf[#buf + 1] = char(192 + #v)
+            else
+                buf[#buf + 1] = 's'
+                put_varint(buf, #v)
+            end
+            buf[#buf + 1] = v
+        elseif t == 'table' then
+            if tracking[v] ~= nil then
+                error('Cannot serialize table with recursive entries', 0)
+            end
+            tracking[v] = true
+            buf[#buf + 1] = '{'
+            for k, x in pairs(v) do
+                s_rec(k, buf, tracking)
+                s_rec(x, buf, tracking)
+            end
+            buf[#buf + 1] = '}'
+        else
+            error('Cannot serialize type ' .. t, 0)
+        end
+    end
+    bin_serialize = function(v)
+        local buf = {}
+        s_rec(v, buf, {})
+        return table.concat(buf)
+    end
+
+    local function get_varint(s, idx)
+        local n, mul = 0, 1
         while true do
-            tok = stream.fixed(1)
-            if tok == ':' then
-                local key = deserialize(stream)
-                r[key] = deserialize(stream)
-            else break end
+            local b = byte(s, idx)
+            if b == nil then error('Unexpected end of stream') end
+            idx = idx + 1
+            if b < 128 then return n + b * mul, idx end
+            n = n + (b - 128) * mul
+            mul = mul * 128
+        end
+    end
+
+    local table_end = {}
+
+    local function d_rec(s, idx)
+        local tok = byte(s, idx)
+        idx = idx + 1
+        if tok == nil then
+            unexpected_token(tok)
+        elseif tok >= 192 then
+            local e = idx + tok - 192
+            return substr(s, idx, e - 1), e
+        elseif tok >= 128 then
+            return tok - 128, idx
+        elseif tok == 125 then  -- }
+            return table_end, idx
+        elseif tok == 123 then  -- {
+            local r = {}
+            while true do
+                local key, value
+                key, idx = d_rec(s, idx)
+                if key == table_end then break end
+                value, idx = d_rec(s, idx)
+                r[key] = value
+            end
+            return r, idx
+        elseif tok == 105 then  -- i
+            return get_varint(s, idx)
+        elseif tok == 106 then  -- j
+            local n
+            n, idx = get_varint(s, idx)
+            return -n, idx
+        elseif tok == 100 then  -- d
+            return unpack_double(substr(s, idx, idx + 7)), idx + 8
+        elseif tok == 115 then  -- s
+            local n
+            n, idx = get_varint(s, idx)
+            return substr(s, idx, idx + n - 1), idx + n
+        elseif tok == 78 then  -- N
+            return nil, idx
+        elseif tok == 70 then  -- F
+            return false, idx
+        elseif tok == 84 then  -- T
+            return true, idx
+        elseif tok == 69 then  -- E
+            local n
+            n, idx = get_varint(s, idx)
+            local fn = assert(loadstring(substr(s, idx, idx + n - 1)))
+            setfenv(fn, genv)
+            return fn(), idx + n
+        else
+            unexpected_token(tok)
         end
+    end
+    bin_deserialize = function(stream)
+        local r
+        r, stream.idx = d_rec(stream.s, stream.idx)
         return r
+    end
+end
+
+function set_filter(task_id, filter)
+    -- keeps waiting and unfiltered indexes in sync with filters
+    local old = filters[task_id]
+    if old == nil then
+        unfiltered[task_id] = nil
     else
-        error('Unknown token ' .. tok)
+        local w = waiting[old]
+        w[task_id] = nil
+        if next(w) == nil then waiting[old] = nil end
     end
+    filters[task_id] = filter
+    if filter == nil then
+        unfiltered[task_id] = true
+    else
+        local w = waiting[filter]
+        if w == nil then
+            w = {}
+            waiting[filter] = w
+        end
+        w[task_id] = true
+    end
+end
+
+function new_task(task_id, fn, params)
+    tasks[task_id] = coroutine.create(fn)
+    ycounts[task_id] = 0
+    coparams[task_id] = params
+    set_filter(task_id, nil)
+    new_tasks[#new_tasks + 1] = task_id
 end
 
 function drop_task(task_id)
+    if tasks[task_id] == nil then return end
+    set_filter(task_id, nil)
+    unfiltered[task_id] = nil
     tasks[task_id] = nil
-    filters[task_id] = nil
     ycounts[task_id] = nil
     coparams[task_id] = nil
 end
 
+local function resume_task(task_id, ...)
+    local r
+    if coparams[task_id] ~= nil then
+        r = {coroutine.resume(tasks[task_id], safe_unpack(coparams[task_id]))}
+        coparams[task_id] = nil
+    else
+        r = {coroutine.resume(tasks[task_id], ...)}
+    end
+    ycounts[task_id] = ycounts[task_id] + 1
+    if coroutine.status(tasks[task_id]) == 'dead' then
+        ws_send('T', task_id, serialize(r), ycounts[task_id])
+        drop_task(task_id)
+    else
+        local filter = nil
+        if r[1] == true then filter = r[2] end
+        -- most tasks wait for the same event again
+        if filter ~= filters[task_id] then set_filter(task_id, filter) end
+    end
+end
+
+local outbox = {}  -- messages of current dispatcher iteration
+
 function ws_send(action, ...)
-    local m = action
-    for _, v in ipairs(arg) do
-        m = m .. serialize(v)
+    local m = {action}
+    for i, v in ipairs(arg) do
+        m[i + 1] = serialize(v)
     end
-    ws.send(m, true)
+    outbox[#outbox + 1] = table.concat(m)
+end
+
+function ws_flush()
+    -- several messages go as one 'M' frame,
+    -- frames are kept small as websocket messages are limited to 128k
+    local frame, size = {}, 0
+    local function send_frame()
+        if #frame == 1 then
+            ws.send(frame[1], true)
+        elseif #frame > 1 then
+            for i, m in ipairs(frame) do frame[i] = serialize(m) end
+            ws.send('M' .. table.concat(frame), true)
+        end
+        frame, size = {}, 0
+    end
+    for _, m in ipairs(outbox) do
+        if size + #m > 65536 then send_frame() end
+        frame[#frame + 1] = m
+        size = size + #m + 5  -- roughly, with serialized length
+    end
+    send_frame()
+    outbox = {}
 end
 
 function safe_unpack(a)
@@ -121,82 +429,142 @@ function safe_unpack(a)
     return table.unpack(a, 1, table.maxn(a))
 end
 
-ws_send('0', proto_version, os.getComputerID(), arg)
+function load_chunk(code, slot)
+    -- code is either source or slot number of already compiled chunk
+    if type(code) == 'number' then
+        -- failed compilation is kept as error text
+        local fn = chunks[code]
+        if type(fn) ~= 'function' then
+            return nil, fn or 'Unknown code slot'
+        end
+        return fn
+    end
+    local fn, err = loadstring(code)
+    if fn ~= nil then setfenv(fn, genv) end
+    if slot ~= nil then chunks[slot] = fn or err end
+    return fn, err
+end
 
-while true do
-    local event, p1, p2, p3, p4, p5 = os.pullEvent()
+function run_call(fn, params)
+    -- runs fn in own coroutine, its yields are passed through to dispatcher
+    local co = coroutine.create(fn)
+    local r = {coroutine.resume(co, safe_unpack(params))}
+    while coroutine.status(co) ~= 'dead' do
+        r = {coroutine.resume(co, coroutine.yield(table.unpack(r, 2, table.maxn(r))))}
+    end
+    return r
+end
 
-    if event == 'websocket_message' then
-        local msg = create_stream(p2)
-        local action = msg.fixed(1)
-
-        if action == 'T' or action == 'I' then  -- new task
-            local task_id = deserialize(msg)
-            local code = deserialize(msg)
-            local params = deserialize(msg)
-
-            local fn, err = loadstring(code)
-            if fn == nil then
-                -- couldn't compile
-                ws_send('T', task_id, serialize{false, err}, 0)
-            else
-                setfenv(fn, genv)
-                if action == 'I' then
-                    ws_send('T', task_id, serialize{fn(safe_unpack(params))}, 0)
-                else
-                    tasks[task_id] = coroutine.create(fn)
-                    ycounts[task_id] = 0
-                    coparams[task_id] = params
-                end
-            end
-        elseif action == 'D' then  -- drop tasks
-            while not msg.isend() do
-                drop_task(deserialize(msg))
-            end
-        elseif action == 'S' or action == 'U' then  -- (un)subscribe to event
-            local event = deserialize(msg)
-            if action == 'S' then
-                event_sub[event] = true
+function run_batch(calls, stop)
+    -- with stop set, calls after the first failed one are not run
+    local results = {}
+    for i, call in ipairs(calls) do
+        if call.fn == nil then
+            results[i] = {false, call.err}
+        else
+            results[i] = run_call(call.fn, call[2])
+        end
+        if stop and results[i][1] == false then break end
+    end
+    return results
+end
+
+function handle_message(data)
+    -- returns true when session is closed
+    local msg = create_stream(data)
+    local action = msg.fixed(1)
+
+    if action == 'T' or action == 'I' then  -- new task
+        local task_id = deserialize(msg)
+        local code = deserialize(msg)
+        local params = deserialize(msg)
+
+        local slot
+        if not msg.isend() then slot = deserialize(msg) end
+
+        local fn, err = load_chunk(code, slot)
+        if fn == nil then
+            -- couldn't compile
+            ws_send('T', task_id, serialize{false, err}, 0)
+        else
+            if action == 'I' then
+                ws_send('T', task_id, serialize{fn(safe_unpack(params))}, 0)
             else
-                event_sub[event] = nil
+                new_task(task_id, fn, params)
             end
-        elseif action == 'C' then  -- close session
-            local err = deserialize(msg)
-            if err ~= nil then
-                io.stderr:write(err .. '\n')
-            end
-            break
         end
+    elseif action == 'B' then  -- batch of calls in a single task
+        local task_id = deserialize(msg)
+        local calls = deserialize(msg)
+        local stop = deserialize(msg)
+        for _, call in ipairs(calls) do
+            call.fn, call.err = load_chunk(call[1], call[3])
+        end
+        new_task(task_id, run_batch, {calls, stop})
+    elseif action == 'D' then  -- drop tasks
+        while not msg.isend() do
+            drop_task(deserialize(msg))
+        end
+    elseif action == 'S' or action == 'U' then  -- (un)subscribe to event
+        local event = deserialize(msg)
+        if action == 'S' then
+            event_sub[event] = true
+        else
+            event_sub[event] = nil
+        end
+    elseif action == 'M' then  -- several messages in one frame
+        while not msg.isend() do
+            if handle_message(deserialize(msg)) then return true end
+        end
+    elseif action == 'C' then  -- close session
+        local err = deserialize(msg)
+        if err ~= nil then
+            io.stderr:write(err .. '\n')
+        end
+        return true
+    end
+end
+
+ws_send('0', proto_version, os.getComputerID(), arg, wire_format)
+ws_flush()
+if wire_format == 'binary' then
+    serialize = bin_serialize
+    deserialize = bin_deserialize
+end
+
+while true do
+    local event, p1, p2, p3, p4, p5 = os.pullEvent()
+
+    if event == 'websocket_message' then
+        if handle_message(p2) then break end
     elseif event == 'websocket_closed' then
         error('Connection with server has been closed')
     elseif event_sub[event] == true then
         ws_send('E', event, {p1, p2, p3, p4, p5})
     end
 
-    local del_tasks = {}
-    for task_id in pairs(tasks) do
-        if filters[task_id] == nil or filters[task_id] == event then
-            local r
-            if coparams[task_id] ~= nil then
-                r = {coroutine.resume(tasks[task_id], safe_unpack(coparams[task_id]))}
-                coparams[task_id] = nil
-            else
-                r = {coroutine.resume(tasks[task_id], event, p1, p2, p3, p4, p5)}
-            end
-            ycounts[task_id] = ycounts[task_id] + 1
-            if coroutine.status(tasks[task_id]) == 'dead' then
-                ws_send('T', task_id, serialize(r), ycounts[task_id])
-                del_tasks[task_id] = true
-            else
-                if r[1] == true then
-                    filters[task_id] = r[2]
-                else
-                    filters[task_id] = nil
-                end
-            end
+    -- new filters of resumed tasks don't take effect until the next event:
+    -- unfiltered tasks are collected before, waiting ones can only leave
+    -- the set they are iterated in
+    local ready = {}
+    for _, task_id in ipairs(new_tasks) do
+        -- could be dropped already
+        if tasks[task_id] ~= nil then ready[#ready + 1] = task_id end
+    end
+    new_tasks = {}
+    for task_id in pairs(unfiltered) do
+        -- new tasks are started above in order they came
+        if coparams[task_id] == nil then ready[#ready + 1] = task_id end
+    end
+    if waiting[event] ~= nil then
+        for task_id in pairs(waiting[event]) do
+            resume_task(task_id, event, p1, p2, p3, p4, p5)
         end
     end
-    for task_id in pairs(del_tasks) do drop_task(task_id) end
+    for _, task_id in ipairs(ready) do
+        resume_task(task_id, event, p1, p2, p3, p4, p5)
+    end
+    ws_flush()
 end
 
 ws.close()
@@ -0,0 +1,179 @@
+from struct import Struct
+from typing import Any, Tuple
+
+from . import lua
+from .ser import encode
+
+__all__ = (
+    'serialize',
+    'deserialize',
+)
+
+# Binary wire format (protocol v4, wire_format = 'binary' in back.lua)
+#
+# N F T             nil, false, true
+# 0x80..0xbf        integer 0..63
+# 0xc0..0xff        string of length 0..63, followed by its bytes
+# i <varint>        non-negative integer
+# j <varint>        negative integer, varint holds its absolute value
+# d <8 bytes>       big-endian IEEE 754 double
+# s <varint> ...    string, varint holds its length
+# E <varint> ...    lua expression (server to computer only)
+# { k v ... }       table, sequence of key-value pairs
+#
+# varint is unsigned LEB128. Integers are limited to 2^53, like lua numbers.
+
+_SMALL_INT = 0x80
+_SHORT_STR = 0xc0
+_SHORT_LIMIT = 0x40
+_INT_LIMIT = 2 ** 53
+_double = Struct('>d')
+
+
+def _put_varint(out: bytearray, n: int):
+    while n >= 0x80:
+        out.append(n & 0x7f | 0x80)
+        n >>= 7
+    out.append(n)
+
+
+def _put_bytes(out: bytearray, b: bytes):
+    if len(b) < _SHORT_LIMIT:
+        out.append(_SHORT_STR + len(b))
+    else:
+        out.append(115)  # s
+        _put_varint(out, len(b))
+    out += b
+
+
+def _put_number(out: bytearray, v):
+    if isinstance(v, float):
+        if not v.is_integer():
+            out.append(100)  # d
+            out += _double.pack(v)
+            return
+        v = int(v)
+    if 0 <= v < _SHORT_LIMIT:
+        out.append(_SMALL_INT + v)
+    elif 0 <= v < _INT_LIMIT:
+        out.append(105)  # i
+        _put_varint(out, v)
+    elif -_INT_LIMIT < v < 0:
+        out.append(106)  # j
+        _put_varint(out, -v)
+    else:
+        out.append(100)  # d
+        out += _double.pack(v)
+
+
+def _serialize(v: Any, out: bytearray):
+    if v is None:
+        out.append(78)  # N
+    elif v is False:
+        out.append(70)  # F
+    elif v is True:
+        out.append(84)  # T
+    elif isinstance(v, (int, float)):
+        _put_number(out, v)
+    elif isinstance(v, bytes):
+        _put_bytes(out, v)
+    elif isinstance(v, str):
+        raise ValueError('Strings are not allowed for serialization')
+    elif isinstance(v, (list, tuple)):
+        out.append(123)  # {
+        for k, x in enumerate(v, start=1):
+            _put_number(out, k)
+            _serialize(x, out)
+        out.append(125)  # }
+    elif isinstance(v, dict):
+        out.append(123)  # {
+        for k, x in v.items():
+            _serialize(k, out)
+            _serialize(x, out)
+        out.append(125)  # }
+    elif isinstance(v, lua.LuaExpr):
+        e = encode('return ' + v.get_expr_code())
+        out.append(69)  # E
+        _put_varint(out, len(e))
+        out += e
+    else:
+        raise ValueError('Value can\'t be serialized: {}'.format(repr(v)))
+
+
+def serialize(v: Any) -> bytes:
+    out = bytearray()
+    _serialize(v, out)
+    return bytes(out)
+
+
+_NO_KEY = object()  # marks that the next parsed value is a table key
+
+
+def _deserialize(b: bytes, _idx: int) -> Tuple[Any, int]:
+    unpack_double = _double.unpack_from
+    stack = []
+    table = key = None
+    while True:
+        tok = b[_idx]
+        _idx += 1
+        if tok >= _SHORT_STR:
+            ln = _idx + tok - _SHORT_STR
+            v = b[_idx:ln]
+            _idx = ln
+        elif tok >= _SMALL_INT:
+            v = tok - _SMALL_INT
+        elif tok == 125:  # }
+            v = table
+            table, key = stack.pop()
+        elif tok == 123:  # {
+            stack.append((table, key))
+            table = {}
+            key = _NO_KEY
+            continue
+        elif tok == 105 or tok == 106 or tok == 115:  # i j s
+            v = shift = 0
+            while True:
+                byte = b[_idx]
+                _idx += 1
+                v |= (byte & 0x7f) << shift
+                if byte < 0x80:
+                    break
+                shift += 7
+            if tok == 106:
+                v = -v
+            elif tok == 115:
+                ln = _idx + v
+                v = b[_idx:ln]
+                _idx = ln
+        elif tok == 100:  # d
+            v = unpack_double(b, _idx)[0]
+            if v.is_integer():
+                v = int(v)
+            _idx += 8
+        elif tok == 78:  # N
+            v = None
+        elif tok == 84:  # T
+            v = True
+        elif tok == 70:  # F
+            v = False
+        else:
+            raise ValueError
+        if table is None:
+            return v, _idx
+        if key is _NO_KEY:
+            key = v
+        else:
+            table[key] = v
+            key = _NO_KEY
+
+
+def deserialize(b: bytes) -> Any:
+    return _deserialize(b, 0)[0]
+
+
+def dcmditer(b: bytes):
+    yield b[0:1]
+    idx = 1
+    while idx < len(b):
+        chunk, idx = _deserialize(b, idx)
+        yield chunk
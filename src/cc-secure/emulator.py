@@ -0,0 +1,1417 @@
+import argparse
+import asyncio
+import fnmatch
+import os
+import posixpath
+import re
+import sys
+import time
+import zlib
+from functools import lru_cache
+from inspect import isawaitable
+from itertools import count
+
+import aiohttp
+
+from . import ser
+from .server import LUA_FILE_VERSION, WIRE_FORMATS
+
+
+__all__ = (
+    'LuaError',
+    'VirtualComputer',
+    'Terminal',
+    'FileSystem',
+    'Peripheral',
+    'Monitor',
+    'run_computers',
+)
+
+
+# Headless stand-in for a ComputerCraft computer running py (back.lua).
+# It speaks the websocket protocol, but instead of running Lua it maps
+# code snippets sent by subapis to python implementations of fs, term,
+# os, turtle and peripheral. Anything else fails like a Lua error would.
+# Computers are cheap, a single process can run thousands of them
+# against a server to measure it without Minecraft.
+
+DEFAULT_WIDTH = 51
+DEFAULT_HEIGHT = 19
+DISK_CAPACITY = 1000000
+TURTLE_FUEL_LIMIT = 20000
+TURTLE_FUELS = {
+    b'minecraft:coal': 80,
+    b'minecraft:charcoal': 80,
+}
+_BLIT_CHARS = b'0123456789abcdef'
+
+
+class LuaError(Exception):
+    pass
+
+
+# ---- snippets
+
+_LUA_STRING = r'"(?:[^"\\]|\\.)*"'
+_LUA_UNESCAPE = {
+    'a': '\a', 'b': '\b', 'f': '\f', 'n': '\n', 'r': '\r', 't': '\t',
+    'v': '\v',
+}
+_EXPR_TOKEN = re.compile(
+    r'\.?([A-Za-z_]\w*)|\[(' + _LUA_STRING + r')\]'
+    r'|\(((?:' + _LUA_STRING + r'(?:, )?)*)\)')
+_EXPR = (r'\w+(?:\.\w+|\[' + _LUA_STRING + r'\]|\((?:[^()"]|'
+         + _LUA_STRING + r')*\))*')
+
+_RE_METHOD = re.compile(r'return ({e})\.(\w+)\(\.\.\.\)$'.format(e=_EXPR))
+_RE_ASSIGN = re.compile(r'({e}) = ({e})\.(\w+)\(\.\.\.\)$'.format(e=_EXPR))
+_RE_RELEASE = re.compile(
+    r'(?:({e})\.(\w+)\(\); )?({e}) = nil$'.format(e=_EXPR))
+_RE_PRESENT = re.compile(r'return (\w+) ~= nil$')
+_RUN_PROGRAM = 'local name, known = ...\nlocal p = fs.combine(shell.dir(), name)\n'
+_WALK = 'local stack, limit, every = ...\n'
+_SUMS = 'local paths, block, every = ...\n'
+_PATCH = 'local p, size, blocks, block = ...\n'
+
+
+def _lua_unstring(s):
+    return ser.encode(re.sub(
+        r'\\(.)', lambda m: _LUA_UNESCAPE.get(m.group(1), m.group(1)),
+        s[1:-1]))
+
+
+def _parse_expr(expr):
+    # expression is a list of steps: name, [index] or (call with strings)
+    steps = []
+    idx = 0
+    while idx < len(expr):
+        m = _EXPR_TOKEN.match(expr, idx)
+        if m is None:
+            raise LuaError('emulator: unsupported expression ' + expr)
+        name, key, args = m.groups()
+        if name is not None:
+            steps.append(('get', ser.encode(name)))
+        elif key is not None:
+            steps.append(('get', _lua_unstring(key)))
+        else:
+            steps.append(('call', tuple(
+                _lua_unstring(a) for a in re.findall(_LUA_STRING, args))))
+        idx = m.end()
+    return steps
+
+
+def _method_chunk(steps, name):
+    def chunk(c, params):
+        return c.eval_expr(steps).invoke(name, params)
+    return chunk
+
+
+def _assign_chunk(target, steps, name):
+    key = target[-1][1]
+
+    def chunk(c, params):
+        results = c.eval_expr(steps).invoke(name, params)
+        c.eval_expr(target[:-1]).set(key, results[0] if results else None)
+        return []
+    return chunk
+
+
+def _release_chunk(steps, name, target):
+    key = target[-1][1]
+
+    def chunk(c, params):
+        if steps is not None:
+            c.eval_expr(steps).invoke(name, ())
+        c.eval_expr(target[:-1]).set(key, None)
+        return []
+    return chunk
+
+
+def _present_chunk(name):
+    def chunk(c, params):
+        return [c.globals.get(name) is not None]
+    return chunk
+
+
+def _io_read(c, params):
+    return [c.read_line()]
+
+
+def _io_write(c, params):
+    c.stdout += params[0]
+    return []
+
+
+def _io_stderr_write(c, params):
+    c.stderr += params[0]
+    return []
+
+
+def _run_program(c, params):
+    # source isn't sent when server knows this file already
+    name, known = (params + (None, None))[:2]
+    path = c.fs.resolve(name)
+    code = c.fs.read_file(path)
+    if code is None:
+        return []
+    p = ser.encode(path)
+    attrs = (len(code), c.fs.modification(path))
+    if known is not None and known.get(b'p') == p and attrs == (
+            known.get(b'size'), known.get(b'modification')):
+        code = None
+    return [p, code, *attrs]
+
+
+def _walk(c, params):
+    # fs.walk traversal, see subapis.fs; tables come as dicts
+    stack, limit = params[0], params[1]
+    stack = [stack[k] for k in sorted(stack)]
+    out, n = [], 0
+    while stack and n < limit:
+        top = stack.pop()
+        d = ser.encode(c.fs.resolve(top[1]))
+        i = top[2]
+        subdirs = [v for _, v in sorted((top.get(3) or {}).items())]
+        names = c.fs.list(d)
+        entries = []
+        while i < len(names) and n < limit:
+            p = c.fs.combine(d, names[i])
+            a = c.fs.attributes(p)
+            entries.append([names[i], a])
+            if a[b'isDir']:
+                subdirs.append(p)
+            i += 1
+            n += 1
+        done = i >= len(names)
+        out.append([d, entries, done])
+        if done:
+            stack.extend({1: p, 2: 0} for p in reversed(subdirs))
+        else:
+            stack.append({1: d, 2: i, 3: dict(enumerate(subdirs, 1))})
+        n += 1
+    return [out, [[x[1], x[2], x.get(3)] for x in stack]]
+
+
+@lru_cache(maxsize=1024)
+def _block_sums(data, block):
+    # computers of a fleet mostly have the same files
+    sums = []
+    for pos in range(0, len(data), block):
+        b = data[pos:pos + block]
+        sums.append(zlib.adler32(b))
+        sums.append(int.from_bytes(b, 'big') % 2147483647)
+    return sums
+
+
+def _sums(c, params):
+    # block sums of sync, see sync.block_sums
+    paths, block = params[0], params[1]
+    out = {}
+    for i, p in paths.items():
+        data = c.fs.read_file(c.fs.resolve(p))
+        if data is not None:
+            out[i] = [len(data), _block_sums(data, block)]
+    return [out]
+
+
+def _patch(c, params):
+    p, size, blocks, block = params
+    path = c.fs.resolve(p)
+    old = c.fs.read_file(path) or b''
+    parts = []
+    for i in range(1, -(-size // block) + 1):
+        parts.append(blocks.get(i, old[(i - 1) * block:i * block]))
+    c.fs.write_file(path, b''.join(parts)[:size])
+    return []
+
+
+_STATIC_CHUNKS = {
+    'return io.read()': _io_read,
+    'io.write(...)': _io_write,
+    'io.stderr:write(...)': _io_stderr_write,
+}
+# compiled chunks are shared by all computers
+_chunk_cache = {}
+
+
+def compile_chunk(code: bytes):
+    # returns fn(computer, params) -> results, raises LuaError
+    # when snippet isn't supported by emulator
+    fn = _chunk_cache.get(code)
+    if fn is not None:
+        return fn
+    src = ser.decode(code)
+    fn = _STATIC_CHUNKS.get(src)
+    if fn is None and src.startswith(_RUN_PROGRAM):
+        fn = _run_program
+    if fn is None and src.startswith(_WALK):
+        fn = _walk
+    if fn is None and src.startswith(_SUMS):
+        fn = _sums
+    if fn is None and src.startswith(_PATCH):
+        fn = _patch
+    m = fn is None and _RE_METHOD.match(src)
+    if m:
+        fn = _method_chunk(_parse_expr(m.group(1)), ser.encode(m.group(2)))
+    m = fn is None and _RE_ASSIGN.match(src)
+    if m:
+        fn = _assign_chunk(
+            _parse_expr(m.group(1)), _parse_expr(m.group(2)),
+            ser.encode(m.group(3)))
+    m = fn is None and _RE_RELEASE.match(src)
+    if m:
+        fn = _release_chunk(
+            _parse_expr(m.group(1)) if m.group(1) else None,
+            ser.encode(m.group(2) or ''), _parse_expr(m.group(3)))
+    m = fn is None and _RE_PRESENT.match(src)
+    if m:
+        fn = _present_chunk(ser.encode(m.group(1)))
+    if fn is None:
+        raise LuaError('emulator: unsupported code: ' + src[:60])
+    _chunk_cache[code] = fn
+    return fn
+
+
+# ---- lua objects
+
+class LuaObject:
+    # table of functions, lua names are camelCase methods of subclass
+    _not_lua = frozenset((
+        'invoke', 'get', 'set', 'resolve', 'lines', 'modification'))
+
+    def invoke(self, name, params):
+        fn = self.get(name)
+        if not callable(fn):
+            raise LuaError('attempt to call nil ({})'.format(ser.decode(name)))
+        try:
+            r = fn(*params)
+        except TypeError as e:
+            raise LuaError('bad arguments ({})'.format(e))
+        if isawaitable(r):
+            return r
+        if r is None:
+            return []
+        if isinstance(r, tuple):
+            return list(r)
+        return [r]
+
+    def get(self, key):
+        if not isinstance(key, bytes):
+            return None
+        name = ser.decode(key)
+        if '_' in name or name in self._not_lua:
+            return None
+        return getattr(self, name, None)
+
+    def set(self, key, value):
+        raise LuaError('attempt to modify read-only table')
+
+
+class Table(LuaObject):
+    # plain lua table, e.g. temp
+    def __init__(self):
+        self._items = {}
+
+    def get(self, key):
+        return self._items.get(key)
+
+    def set(self, key, value):
+        if value is None:
+            self._items.pop(key, None)
+        else:
+            self._items[key] = value
+
+
+class Terminal(LuaObject):
+    def __init__(self, width=DEFAULT_WIDTH, height=DEFAULT_HEIGHT, color=True):
+        self._color = color
+        self._x = self._y = 1
+        self._blink = True
+        self._fg = _BLIT_CHARS[0]
+        self._bg = _BLIT_CHARS[15]
+        self._resize(width, height)
+
+    def _resize(self, width, height):
+        self._width, self._height = width, height
+        self._text = [bytearray(b' ' * width) for _ in range(height)]
+        self._fgs = [bytearray([self._fg]) * width for _ in range(height)]
+        self._bgs = [bytearray([self._bg]) * width for _ in range(height)]
+
+    def lines(self):
+        # screen contents for checks
+        return [bytes(row).rstrip() for row in self._text]
+
+    def _put(self, text, fg, bg):
+        y, x = self._y - 1, self._x - 1
+        self._x += len(text)
+        if not 0 <= y < self._height:
+            return
+        if x < 0:
+            text, fg, bg = text[-x:], fg[-x:], bg[-x:]
+            x = 0
+        n = min(x + len(text), self._width) - x
+        if n <= 0:
+            return
+        self._text[y][x:x + n] = text[:n]
+        self._fgs[y][x:x + n] = fg[:n]
+        self._bgs[y][x:x + n] = bg[:n]
+
+    def write(self, text):
+        if not isinstance(text, bytes):
+            text = ser.encode(str(text))
+        n = len(text)
+        self._put(text, bytes([self._fg]) * n, bytes([self._bg]) * n)
+
+    def blit(self, text, textColors, backgroundColors):
+        if not len(text) == len(textColors) == len(backgroundColors):
+            raise LuaError('Arguments must be the same length')
+        self._put(text, textColors.lower(), backgroundColors.lower())
+
+    def clear(self):
+        for y in range(self._height):
+            self._clear_row(y)
+
+    def clearLine(self):
+        if 0 < self._y <= self._height:
+            self._clear_row(self._y - 1)
+
+    def _clear_row(self, y):
+        self._text[y][:] = b' ' * self._width
+        self._fgs[y][:] = bytes([self._fg]) * self._width
+        self._bgs[y][:] = bytes([self._bg]) * self._width
+
+    def scroll(self, lines):
+        lines = max(-self._height, min(int(lines), self._height))
+        for y in (range(self._height) if lines > 0
+                  else range(self._height - 1, -1, -1)):
+            src = y + lines
+            if 0 <= src < self._height:
+                self._text[y][:] = self._text[src]
+                self._fgs[y][:] = self._fgs[src]
+                self._bgs[y][:] = self._bgs[src]
+            else:
+                self._clear_row(y)
+
+    def getCursorPos(self):
+        return self._x, self._y
+
+    def setCursorPos(self, x, y):
+        self._x, self._y = int(x), int(y)
+
+    def getCursorBlink(self):
+        return self._blink
+
+    def setCursorBlink(self, value):
+        self._blink = bool(value)
+
+    def isColor(self):
+        return self._color
+
+    def getSize(self):
+        return self._width, self._height
+
+    def _color_char(self, colorID):
+        colorID = int(colorID)
+        if colorID <= 0 or colorID & (colorID - 1) or colorID > 32768:
+            raise LuaError('Invalid color (got {})'.format(colorID))
+        return _BLIT_CHARS[colorID.bit_length() - 1]
+
+    def setTextColor(self, colorID):
+        self._fg = self._color_char(colorID)
+
+    def getTextColor(self):
+        return 1 << _BLIT_CHARS.index(self._fg)
+
+    def setBackgroundColor(self, colorID):
+        self._bg = self._color_char(colorID)
+
+    def getBackgroundColor(self):
+        return 1 << _BLIT_CHARS.index(self._bg)
+
+    def getPaletteColor(self, colorID):
+        self._color_char(colorID)
+        return 0.5, 0.5, 0.5
+
+    def setPaletteColor(self, colorID, r, g, b):
+        self._color_char(colorID)
+
+    setTextColour = setTextColor
+    getTextColour = getTextColor
+    setBackgroundColour = setBackgroundColor
+    getBackgroundColour = getBackgroundColor
+    isColour = isColor
+
+
+class TermAPI(Terminal):
+    def current(self):
+        return self
+
+    def native(self):
+        return self
+
+
+class FileHandle(LuaObject):
+    # every file is opened in binary mode by subapis
+    def __init__(self, fs, path, mode):
+        self._fs = fs
+        self._path = path
+        self._mode = mode
+        if mode == b'rb':
+            self._data = fs.read_file(path)
+        elif mode == b'ab':
+            self._data = bytearray(fs.read_file(path) or b'')
+        else:
+            self._data = bytearray()
+        self._pos = len(self._data) if mode == b'ab' else 0
+        self._open = True
+
+    def _check(self, reading):
+        if not self._open:
+            raise LuaError('attempt to use a closed file')
+        if reading != (self._mode == b'rb'):
+            raise LuaError('attempt to call nil')
+
+    def read(self, count=None):
+        self._check(True)
+        if self._pos >= len(self._data):
+            return None
+        if count is None:
+            self._pos += 1
+            return self._data[self._pos - 1]
+        r = self._data[self._pos:self._pos + int(count)]
+        self._pos += len(r)
+        return bytes(r)
+
+    def readLine(self, withTrailing=False):
+        self._check(True)
+        if self._pos >= len(self._data):
+            return None
+        end = self._data.find(b'\n', self._pos)
+        end = len(self._data) if end < 0 else end + 1
+        line = self._data[self._pos:end]
+        self._pos = end
+        if not withTrailing:
+            if line.endswith(b'\r\n'):
+                line = line[:-2]
+            elif line.endswith(b'\n'):
+                line = line[:-1]
+        return bytes(line)
+
+    def readAll(self):
+        self._check(True)
+        if self._pos >= len(self._data):
+            return None
+        r = self._data[self._pos:]
+        self._pos = len(self._data)
+        return bytes(r)
+
+    def write(self, data):
+        self._check(False)
+        if isinstance(data, int):
+            data = bytes([data])
+        self._data[self._pos:self._pos + len(data)] = data
+        self._pos += len(data)
+
+    def writeLine(self, data):
+        self.write(data + b'\n')
+
+    def flush(self):
+        self._check(False)
+        self._fs.write_file(self._path, bytes(self._data))
+
+    def seek(self, whence=None, offset=None):
+        if not self._open:
+            raise LuaError('attempt to use a closed file')
+        base = {
+            None: self._pos, b'cur': self._pos, b'set': 0,
+            b'end': len(self._data)}.get(whence)
+        if base is None:
+            raise LuaError('bad argument #1 to \'seek\' (invalid option)')
+        pos = base + int(offset or 0)
+        if pos < 0:
+            return None, b'Position is negative'
+        self._pos = pos
+        return pos
+
+    def close(self):
+        if self._open and self._mode != b'rb':
+            self._fs.write_file(self._path, bytes(self._data))
+        self._open = False
+
+
+class FileSystem(LuaObject):
+    # flat dict of paths, paths are normalized without leading slash
+    def __init__(self, files=None, capacity=DISK_CAPACITY):
+        self._files = {}
+        self._mtimes = {}
+        self._dirs = {''}
+        self._capacity = capacity
+        for path, content in (files or {}).items():
+            self.write_file(self.resolve(ser.encode(path)), content)
+
+    @staticmethod
+    def resolve(path):
+        path = ser.decode(path).replace('\\', '/')
+        path = posixpath.normpath('/' + path).lstrip('/')
+        if path.startswith('..'):
+            raise LuaError('Invalid Path')
+        return path
+
+    def read_file(self, path):
+        return self._files.get(path)
+
+    def _add_dir(self, path):
+        while path not in self._dirs:
+            self._dirs.add(path)
+            path = posixpath.dirname(path)
+
+    def write_file(self, path, data):
+        self._add_dir(posixpath.dirname(path))
+        self._files[path] = data
+        self._mtimes[path] = int(time.time() * 1000)
+
+    def modification(self, path):
+        return self._mtimes.get(path, 0)
+
+    def _children(self, path):
+        prefix = path + '/' if path else ''
+        for p in list(self._files) + list(self._dirs):
+            if p and p.startswith(prefix) and '/' not in p[len(prefix):]:
+                yield p
+
+    def _subtree(self, path):
+        prefix = path + '/'
+        return (
+            [p for p in self._files if p == path or p.startswith(prefix)],
+            [p for p in self._dirs if p == path or p.startswith(prefix)],
+        )
+
+    def list(self, path):
+        path = self.resolve(path)
+        if path not in self._dirs:
+            raise LuaError('/{}: Not a directory'.format(path))
+        return sorted(
+            ser.encode(posixpath.basename(p)) for p in self._children(path))
+
+    def exists(self, path):
+        path = self.resolve(path)
+        return path in self._files or path in self._dirs
+
+    def isDir(self, path):
+        return self.resolve(path) in self._dirs
+
+    def isReadOnly(self, path):
+        return self.resolve(path).startswith('rom')
+
+    def isDriveRoot(self, path):
+        return self.resolve(path) == ''
+
+    def getDrive(self, path):
+        return b'hdd' if self.exists(path) else None
+
+    def getSize(self, path):
+        path = self.resolve(path)
+        if path in self._dirs:
+            return 0
+        if path not in self._files:
+            raise LuaError('/{}: No such file'.format(path))
+        return len(self._files[path])
+
+    def getFreeSpace(self, path):
+        return max(0, self._capacity - sum(map(len, self._files.values())))
+
+    def getCapacity(self, path):
+        return self._capacity
+
+    def makeDir(self, path):
+        path = self.resolve(path)
+        if path in self._files:
+            raise LuaError('/{}: File exists'.format(path))
+        self._add_dir(path)
+
+    def delete(self, path):
+        files, dirs = self._subtree(self.resolve(path))
+        for p in files:
+            del self._files[p]
+            self._mtimes.pop(p, None)
+        self._dirs.difference_update(dirs)
+        self._dirs.add('')
+
+    def copy(self, fromPath, toPath, _move=False):
+        src, dst = self.resolve(fromPath), self.resolve(toPath)
+        if src not in self._files and src not in self._dirs:
+            raise LuaError('/{}: No such file'.format(src))
+        if dst in self._files or dst in self._dirs:
+            raise LuaError('/{}: File exists'.format(dst))
+        files, dirs = self._subtree(src)
+        for p in dirs:
+            self._dirs.add(dst + p[len(src):])
+        for p in files:
+            self.write_file(dst + p[len(src):], self._files[p])
+        if _move:
+            self.delete(fromPath)
+
+    def move(self, fromPath, toPath):
+        self.copy(fromPath, toPath, _move=True)
+
+    def combine(self, basePath, localPath):
+        return ser.encode(self.resolve(basePath + b'/' + localPath))
+
+    def getName(self, path):
+        return ser.encode(posixpath.basename(self.resolve(path)) or 'root')
+
+    def getDir(self, path):
+        path = self.resolve(path)
+        return ser.encode(posixpath.dirname(path) if path else '..')
+
+    def find(self, wildcard):
+        pattern = self.resolve(wildcard)
+        return sorted(
+            ser.encode(p) for p in list(self._files) + list(self._dirs)
+            if p and fnmatch.fnmatchcase(p, pattern))
+
+    def complete(self, partialName, path, includeFiles=None, includeDirs=None):
+        base = self.resolve(path + b'/' + partialName)
+        prefix = posixpath.basename(base) if partialName else ''
+        parent = posixpath.dirname(base) if partialName else base
+        r = []
+        for p in sorted(self._children(parent)):
+            name = posixpath.basename(p)
+            if name.startswith(prefix):
+                is_dir = p in self._dirs
+                if is_dir and includeDirs is not False:
+                    r.append(ser.encode(name[len(prefix):] + '/'))
+                if (not is_dir and includeFiles is not False) or is_dir:
+                    r.append(ser.encode(name[len(prefix):]))
+        return r
+
+    def attributes(self, path):
+        size = self.getSize(path)
+        mtime = self.modification(self.resolve(path))
+        return {
+            b'created': mtime,
+            b'modification': mtime,
+            b'isDir': self.isDir(path),
+            b'size': size,
+        }
+
+    def open(self, path, mode):
+        path = self.resolve(path)
+        mode = mode.replace(b'b', b'') + b'b'
+        if mode not in (b'rb', b'wb', b'ab'):
+            raise LuaError('Unsupported mode')
+        if mode == b'rb' and path not in self._files:
+            return None, ser.encode('/{}: No such file'.format(path))
+        if path in self._dirs:
+            return None, ser.encode('/{}: Cannot write to directory'.format(path))
+        return FileHandle(self, path, mode)
+
+
+class OsAPI(LuaObject):
+    def __init__(self, computer):
+        self._c = computer
+        self._timers = {}
+        self._timer_ids = count(1)
+
+    def version(self):
+        return b'CraftOS 1.8'
+
+    def getComputerID(self):
+        return self._c.computer_id
+
+    def getComputerLabel(self):
+        return self._c.label
+
+    def setComputerLabel(self, label=None):
+        self._c.label = label
+
+    def clock(self):
+        return round(time.monotonic() - self._c.started, 2)
+
+    def time(self, locale=None):
+        return round(self.clock() / 50 % 24, 3)
+
+    def day(self, locale=None):
+        return int(self.clock() / 1200)
+
+    def epoch(self, locale=None):
+        return int(self.clock() * 1000)
+
+    def queueEvent(self, event, *params):
+        self._c.queue_event(event, *params)
+
+    def startTimer(self, timeout):
+        timer_id = next(self._timer_ids)
+        self._timers[timer_id] = asyncio.get_running_loop().call_later(
+            max(timeout, 0), self._fire, timer_id)
+        return timer_id
+
+    def _fire(self, timer_id):
+        del self._timers[timer_id]
+        self._c.queue_event(b'timer', timer_id)
+        self._c.flush()
+
+    def cancelTimer(self, timerID):
+        handle = self._timers.pop(timerID, None)
+        if handle is not None:
+            handle.cancel()
+
+    async def sleep(self, seconds=0):
+        await asyncio.sleep(max(seconds, 0.05))
+
+    def shutdown(self):
+        self._c.shutdown()
+
+    def reboot(self):
+        self._c.shutdown()
+
+
+class TurtleAPI(LuaObject):
+    # flat world: blocks is dict of (x, y, z) to block name
+    _DIRECTIONS = ((0, 0, -1), (1, 0, 0), (0, 0, 1), (-1, 0, 0))
+
+    def __init__(self, fuel=TURTLE_FUEL_LIMIT, inventory=None, blocks=None):
+        self._pos = (0, 0, 0)
+        self._facing = 0
+        self._fuel = fuel
+        self._slots = [None] * 16
+        for slot, (name, count) in (inventory or {}).items():
+            self._slots[slot - 1] = [name, count]
+        self._selected = 1
+        self._blocks = dict(blocks or {})
+
+    def _target(self, where):
+        x, y, z = self._pos
+        if where == 'up':
+            return x, y + 1, z
+        if where == 'down':
+            return x, y - 1, z
+        dx, dy, dz = self._DIRECTIONS[self._facing]
+        if where == 'back':
+            return x - dx, y, z - dz
+        return x + dx, y, z + dz
+
+    def _move(self, where):
+        if self._fuel <= 0:
+            return False, b'Out of fuel'
+        target = self._target(where)
+        if target in self._blocks:
+            return False, b'Movement obstructed'
+        self._fuel -= 1
+        self._pos = target
+        return True
+
+    def forward(self):
+        return self._move('forward')
+
+    def back(self):
+        return self._move('back')
+
+    def up(self):
+        return self._move('up')
+
+    def down(self):
+        return self._move('down')
+
+    def turnLeft(self):
+        self._facing = (self._facing - 1) % 4
+        return True
+
+    def turnRight(self):
+        self._facing = (self._facing + 1) % 4
+        return True
+
+    def _detect(self, where):
+        return self._target(where) in self._blocks
+
+    def detect(self):
+        return self._detect('forward')
+
+    def detectUp(self):
+        return self._detect('up')
+
+    def detectDown(self):
+        return self._detect('down')
+
+    def _inspect(self, where):
+        name = self._blocks.get(self._target(where))
+        if name is None:
+            return False, b'No block to inspect'
+        return True, {b'name': name, b'state': {}, b'tags': {}}
+
+    def inspect(self):
+        return self._inspect('forward')
+
+    def inspectUp(self):
+        return self._inspect('up')
+
+    def inspectDown(self):
+        return self._inspect('down')
+
+    def _dig(self, where):
+        name = self._blocks.pop(self._target(where), None)
+        if name is None:
+            return False, b'Nothing to dig here'
+        self._store(name, 1)
+        return True
+
+    def dig(self, side=None):
+        return self._dig('forward')
+
+    def digUp(self, side=None):
+        return self._dig('up')
+
+    def digDown(self, side=None):
+        return self._dig('down')
+
+    def _place(self, where):
+        slot = self._slots[self._selected - 1]
+        target = self._target(where)
+        if slot is None or target in self._blocks:
+            return False, b'Cannot place block here'
+        self._blocks[target] = slot[0]
+        self._take(self._selected, 1)
+        return True
+
+    def place(self, text=None):
+        return self._place('forward')
+
+    def placeUp(self, text=None):
+        return self._place('up')
+
+    def placeDown(self, text=None):
+        return self._place('down')
+
+    def _store(self, name, amount):
+        for slot in self._slots:
+            if slot is not None and slot[0] == name and slot[1] < 64:
+                moved = min(amount, 64 - slot[1])
+                slot[1] += moved
+                amount -= moved
+        for i, slot in enumerate(self._slots):
+            if amount and slot is None:
+                self._slots[i] = [name, min(amount, 64)]
+                amount -= self._slots[i][1]
+        return amount
+
+    def _take(self, slot_num, amount):
+        slot = self._slots[slot_num - 1]
+        slot[1] -= amount
+        if slot[1] <= 0:
+            self._slots[slot_num - 1] = None
+
+    def _slot(self, slotNum):
+        if slotNum is None:
+            slotNum = self._selected
+        if not 1 <= slotNum <= 16:
+            raise LuaError('Slot number {} out of range'.format(slotNum))
+        return slotNum
+
+    def select(self, slotNum):
+        self._selected = self._slot(slotNum)
+        return True
+
+    def getSelectedSlot(self):
+        return self._selected
+
+    def getItemCount(self, slotNum=None):
+        slot = self._slots[self._slot(slotNum) - 1]
+        return 0 if slot is None else slot[1]
+
+    def getItemSpace(self, slotNum=None):
+        return 64 - self.getItemCount(slotNum)
+
+    def getItemDetail(self, slotNum=None, detailed=None):
+        slot = self._slots[self._slot(slotNum) - 1]
+        if slot is None:
+            return None
+        return {b'name': slot[0], b'count': slot[1]}
+
+    def transferTo(self, slot, quantity=None):
+        src = self._slots[self._selected - 1]
+        dst_num = self._slot(slot)
+        dst = self._slots[dst_num - 1]
+        if src is None or (dst is not None and dst[0] != src[0]):
+            return False
+        moved = min(src[1] if quantity is None else quantity,
+                    64 - (dst[1] if dst else 0))
+        if dst is None:
+            self._slots[dst_num - 1] = [src[0], 0]
+        self._slots[dst_num - 1][1] += moved
+        self._take(self._selected, moved)
+        return True
+
+    def _drop(self, count=None):
+        slot = self._slots[self._selected - 1]
+        if slot is None:
+            return False, b'No items to drop'
+        self._take(self._selected, slot[1] if count is None else count)
+        return True
+
+    def drop(self, count=None):
+        return self._drop(count)
+
+    def dropUp(self, count=None):
+        return self._drop(count)
+
+    def dropDown(self, count=None):
+        return self._drop(count)
+
+    def suck(self, amount=None):
+        return False, b'No items to take'
+
+    suckUp = suckDown = suck
+
+    def attack(self, side=None):
+        return False, b'Nothing to attack here'
+
+    attackUp = attackDown = attack
+
+    def compare(self):
+        return False
+
+    compareUp = compareDown = compare
+
+    def compareTo(self, slot):
+        return self._slots[self._selected - 1] == self._slots[slot - 1]
+
+    def getFuelLevel(self):
+        return self._fuel
+
+    def getFuelLimit(self):
+        return TURTLE_FUEL_LIMIT
+
+    def refuel(self, count=None):
+        slot = self._slots[self._selected - 1]
+        if slot is None or slot[0] not in TURTLE_FUELS:
+            return False, b'Items not combustible'
+        count = slot[1] if count is None else min(count, slot[1])
+        self._fuel = min(
+            TURTLE_FUEL_LIMIT, self._fuel + count * TURTLE_FUELS[slot[0]])
+        self._take(self._selected, count)
+        return True
+
+
+class Peripheral(LuaObject):
+    # subclass and add methods, peripheral_type is what getType returns
+    peripheral_type = None
+
+
+class Monitor(Terminal, Peripheral):
+    peripheral_type = b'monitor'
+
+    def __init__(self, width=39, height=19):
+        super().__init__(width, height)
+        self._scale = 1
+
+    def getTextScale(self):
+        return self._scale
+
+    def setTextScale(self, scale):
+        self._scale = scale
+
+
+class PeripheralAPI(LuaObject):
+    def __init__(self, peripherals):
+        self._peripherals = peripherals
+
+    def _get(self, side):
+        p = self._peripherals.get(side)
+        if p is None:
+            raise LuaError('No peripheral attached')
+        return p
+
+    def isPresent(self, side):
+        return side in self._peripherals
+
+    def getType(self, side):
+        p = self._peripherals.get(side)
+        return None if p is None else p.peripheral_type
+
+    def getNames(self):
+        return sorted(self._peripherals)
+
+    def getMethods(self, side):
+        p = self._peripherals.get(side)
+        if p is None:
+            return None
+        return sorted(
+            ser.encode(name) for name in dir(p)
+            if not name.startswith('_') and name not in (
+                'invoke', 'get', 'set', 'peripheral_type', 'lines'))
+
+    def call(self, side, method, *params):
+        r = self._get(side).invoke(method, params)
+        if isawaitable(r):
+            return r
+        return tuple(r)
+
+    def wrap(self, side):
+        return self._peripherals.get(side)
+
+
+# ---- computer
+
+class VirtualComputer:
+    '''
+    Emulated computer, runs one py session.
+
+    c = VirtualComputer(1, args=['prog.py'], files={'prog.py': b'...'})
+    asyncio.run(run_computers('http://127.0.0.1:8080/', [c]))
+    c.stdout
+
+    Lines are typed into io.read, that's how REPL is driven.
+    Responses are sent latency seconds after messages came.
+    '''
+    def __init__(self, computer_id, args=(), lines=(), files=None,
+                 latency=0.0, turtle=False, peripherals=None, label=None,
+                 wire_format=b'binary'):
+        self.computer_id = computer_id
+        self.label = label
+        self.args = [ser.encode(a) if isinstance(a, str) else a for a in args]
+        self.latency = latency
+        self.wire_format = wire_format
+        self.started = time.monotonic()
+        self.stdout = bytearray()
+        self.stderr = bytearray()
+        self.error = None
+        # server side time between reply and next request, seconds
+        self.turnarounds = []
+        self.calls = 0
+        self.frames_in = 0
+        self.frames_out = 0
+        self._lines = iter(lines)
+        self._codec = ser
+        self._chunks = {}
+        self._subs = set()
+        self._tasks = {}
+        self._outbox = []
+        self._send_queue = None
+        self._replied_at = None
+        self._closed = False
+        self.fs = FileSystem(files)
+        self.term = TermAPI()
+        self.globals = Table()
+        for name, api in (
+            ('fs', self.fs),
+            ('term', self.term),
+            ('os', OsAPI(self)),
+            ('peripheral', PeripheralAPI({
+                ser.encode(side): p
+                for side, p in (peripherals or {}).items()})),
+            ('temp', Table()),
+        ):
+            self.globals.set(ser.encode(name), api)
+        if turtle:
+            self.globals.set(
+                b'turtle', turtle if isinstance(turtle, TurtleAPI)
+                else TurtleAPI())
+
+    def eval_expr(self, steps):
+        obj = self.globals
+        for op, arg in steps:
+            if op == 'get':
+                if not isinstance(obj, LuaObject):
+                    raise LuaError('attempt to index ? (a nil value)')
+                obj = obj.get(arg)
+            else:
+                if not callable(obj):
+                    raise LuaError('attempt to call ? (a nil value)')
+                obj = obj(*arg)
+        if obj is None:
+            raise LuaError('attempt to index ? (a nil value)')
+        return obj
+
+    def read_line(self):
+        line = next(self._lines, None)
+        if line is None:
+            # no more input, leave REPL
+            return b'exit()'
+        if isinstance(line, str):
+            line = ser.encode(line)
+        return line
+
+    def queue_event(self, event, *params):
+        if event in self._subs:
+            self._send(b'E', event, {
+                i: v for i, v in enumerate(params, start=1)
+                if v is not None})
+
+    def shutdown(self):
+        self._closed = True
+
+    # ---- protocol
+
+    def _send(self, action, *values):
+        self._outbox.append(action + b''.join(map(
+            self._codec.serialize, values)))
+
+    def _send_result(self, task_id, result, ycount=1):
+        self._send(b'T', task_id, self._codec.serialize({
+            i: v for i, v in enumerate(result, start=1)
+            if v is not None}), ycount)
+
+    def flush(self):
+        # messages of a single dispatcher iteration go as one frame
+        if not self._outbox:
+            return
+        frames, frame, size = [], [], 0
+        for m in self._outbox:
+            if frame and size + len(m) > 65536:
+                frames.append(frame)
+                frame, size = [], 0
+            frame.append(m)
+            size += len(m) + 5
+        frames.append(frame)
+        self._outbox = []
+        due = time.monotonic() + self.latency
+        for frame in frames:
+            if len(frame) > 1:
+                frame = [b'M' + b''.join(map(self._codec.serialize, frame))]
+            self._send_queue.put_nowait((due, frame[0]))
+
+    def _call(self, code, params):
+        # returns result list or awaitable of it
+        self.calls += 1
+        try:
+            if isinstance(code, int):
+                fn = self._chunks.get(code)
+                if fn is None:
+                    raise LuaError('Unknown code slot')
+                if isinstance(fn, LuaError):
+                    raise fn
+            else:
+                fn = compile_chunk(code)
+            params = tuple(params.get(i) for i in range(
+                1, max(params, default=0) + 1))
+            r = fn(self, params)
+        except LuaError as e:
+            return [False, ser.encode(str(e))]
+        except Exception as e:
+            return [False, ser.encode('emulator: {!r}'.format(e))]
+        if isawaitable(r):
+            return self._finish_call(r)
+        return [True, *r]
+
+    async def _finish_call(self, aw):
+        try:
+            return [True, *(await aw or ())]
+        except LuaError as e:
+            return [False, ser.encode(str(e))]
+
+    def _load(self, code, slot):
+        if slot is not None:
+            try:
+                self._chunks[slot] = compile_chunk(code)
+            except LuaError as e:
+                self._chunks[slot] = e
+            return slot
+        return code
+
+    def _run_task(self, task_id, calls, stop, batch):
+        results = []
+        for i, (code, params) in enumerate(calls):
+            r = self._call(code, params)
+            if isawaitable(r):
+                fut = asyncio.ensure_future(self._run_task_async(
+                    task_id, calls[i + 1:], stop, batch, results, r))
+                self._tasks[task_id] = fut
+                return
+            results.append(r)
+            if stop and r[0] is False:
+                break
+        self._send_result(task_id, [True, results] if batch else results[0])
+
+    async def _run_task_async(self, task_id, calls, stop, batch, results, aw):
+        try:
+            r = await aw
+            results.append(r)
+            for code, params in calls:
+                if stop and r[0] is False:
+                    break
+                r = self._call(code, params)
+                if isawaitable(r):
+                    r = await r
+                results.append(r)
+        finally:
+            self._tasks.pop(task_id, None)
+        self._send_result(task_id, [True, results] if batch else results[0])
+        self.flush()
+
+    def _handle(self, data):
+        # returns True when session is closed
+        msg = self._codec.dcmditer(data)
+        action = next(msg)
+        if action in (b'T', b'I'):
+            task_id = next(msg)
+            code = next(msg)
+            params = next(msg)
+            code = self._load(code, next(msg, None))
+            if action == b'I':
+                r = self._call(code, params)
+                if isawaitable(r):
+                    r.close()
+                    r = [False, b'attempt to yield across C-call boundary']
+                self._send_result(task_id, r, 0)
+            else:
+                self._run_task(task_id, [(code, params)], False, False)
+        elif action == b'B':
+            task_id = next(msg)
+            calls = next(msg)
+            stop = next(msg)
+            items = []
+            for i in range(1, len(calls) + 1):
+                call = calls[i]
+                items.append((
+                    self._load(call[1], call.get(3)), call.get(2) or {}))
+            self._run_task(task_id, items, stop, True)
+        elif action == b'D':
+            for task_id in msg:
+                fut = self._tasks.pop(task_id, None)
+                if fut is not None:
+                    fut.cancel()
+        elif action == b'S':
+            self._subs.add(next(msg))
+        elif action == b'U':
+            self._subs.discard(next(msg))
+        elif action == b'M':
+            for m in msg:
+                if self._handle(m):
+                    return True
+        elif action == b'C':
+            err = next(msg, None)
+            if err is not None:
+                self.stderr += err + b'\n'
+            return True
+        return False
+
+    async def _sender(self, ws):
+        loop = asyncio.get_running_loop()
+        while True:
+            due, frame = await self._send_queue.get()
+            delay = due - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self.frames_out += 1
+            self._replied_at = loop.time()
+            await ws.send_bytes(frame)
+
+    async def run(self, session, url):
+        loop = asyncio.get_running_loop()
+        self.started = time.monotonic()
+        self._send_queue = asyncio.Queue()
+        async with session.ws_connect(
+                '{}ws/?id={}'.format(url, self.computer_id)) as ws:
+            await ws.send_bytes(b'0' + b''.join(map(ser.serialize, (
+                LUA_FILE_VERSION, self.computer_id,
+                {i: a for i, a in enumerate([b'py', *self.args])},
+                self.wire_format))))
+            self._codec = WIRE_FORMATS[self.wire_format]
+            sender = asyncio.ensure_future(self._sender(ws))
+            try:
+                async for msg in ws:
+                    if msg.type != aiohttp.WSMsgType.BINARY:
+                        continue
+                    self.frames_in += 1
+                    if self._replied_at is not None:
+                        self.turnarounds.append(
+                            loop.time() - self._replied_at)
+                        self._replied_at = None
+                    try:
+                        done = self._handle(msg.data)
+                    except (ValueError, KeyError, StopIteration) as e:
+                        self.error = 'bad message: {!r}'.format(e)
+                        break
+                    self.flush()
+                    if done or self._closed:
+                        break
+            finally:
+                sender.cancel()
+                for fut in self._tasks.values():
+                    fut.cancel()
+                self._tasks.clear()
+
+
+async def run_computers(url, computers, connections=None):
+    # runs computers concurrently, returns seconds it took;
+    # connections limits how many are connected at once
+    connector = aiohttp.TCPConnector(limit=0, force_close=True)
+    sem = asyncio.Semaphore(connections or len(computers) or 1)
+
+    async def run(session, c):
+        async with sem:
+            try:
+                await c.run(session, url)
+            except aiohttp.ClientError as e:
+                c.error = 'connection failed: {!r}'.format(e)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        start = time.perf_counter()
+        await asyncio.gather(*(run(session, c) for c in computers))
+        return time.perf_counter() - start
+
+
+def _percentile(values, p):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def _load_files(root):
+    files = {}
+    for dirpath, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(dirpath, name)
+            with open(path, 'rb') as f:
+                files[os.path.relpath(path, root)] = f.read()
+    return files
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Run emulated computers against py server')
+    parser.add_argument('program', nargs='?', help='runs REPL when omitted')
+    parser.add_argument('args', nargs='*')
+    parser.add_argument('--url', default='http://127.0.0.1:8080/')
+    parser.add_argument('--computers', type=int, default=1)
+    parser.add_argument('--first-id', type=int, default=0)
+    parser.add_argument('--latency', type=float, default=0.05)
+    parser.add_argument('--format', default='binary',
+                        choices=[ser.decode(f) for f in WIRE_FORMATS])
+    parser.add_argument('--files', help='directory copied to every computer')
+    parser.add_argument('--input', help='lines typed into io.read')
+    parser.add_argument('--turtle', action='store_true')
+    parser.add_argument('--monitor', help='side of attached monitor')
+    args = parser.parse_args()
+
+    files = _load_files(args.files) if args.files else {}
+    lines = []
+    if args.input:
+        with open(args.input, 'rb') as f:
+            lines = f.read().splitlines()
+    program = [args.program, *args.args] if args.program else []
+    computers = [VirtualComputer(
+        i, program, lines, files, args.latency, args.turtle,
+        {args.monitor: Monitor()} if args.monitor else None,
+        wire_format=ser.encode(args.format),
+    ) for i in range(args.first_id, args.first_id + args.computers)]
+    elapsed = asyncio.run(run_computers(args.url, computers))
+
+    if len(computers) == 1:
+        sys.stdout.write(ser.decode(bytes(computers[0].stdout)))
+        sys.stderr.write(ser.decode(bytes(computers[0].stderr)))
+    calls = sum(c.calls for c in computers)
+    turnarounds = [t for c in computers for t in c.turnarounds]
+    errors = [c for c in computers if c.error]
+    print('{} computers: {:.2f} s, {} calls, {:.0f} calls/s'.format(
+        len(computers), elapsed, calls, calls / elapsed), file=sys.stderr)
+    print('server turnaround p50 {:.2f} ms, p99 {:.2f} ms'.format(
+        _percentile(turnarounds, 0.5) * 1000,
+        _percentile(turnarounds, 0.99) * 1000), file=sys.stderr)
+    for c in errors[:10]:
+        print('computer {}: {}'.format(c.computer_id, c.error), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    main()
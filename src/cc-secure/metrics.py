@@ -0,0 +1,204 @@
+import re
+from bisect import bisect_left
+from functools import lru_cache
+
+from . import ser
+
+
+__all__ = (
+    'SessionMetrics',
+    'call_label',
+    'render_prometheus',
+)
+
+
+# upper bounds in seconds, the last bucket is +Inf
+LATENCY_BUCKETS = (
+    0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+BATCH_LABEL = 'batch'
+# snippets of user code could make endless labels
+MAX_LABELS = 256
+OTHER_LABEL = 'other'
+
+_RE_METHOD = re.compile(r'return (.+)\(\.\.\.\)$')
+_RE_TEMP = re.compile(r'temp\["(?:[^"\\]|\\.)*"\]')
+
+
+@lru_cache(maxsize=1024)
+def call_label(lua_code: bytes) -> str:
+    # subapi method name like fs.open, or start of the snippet;
+    # handles of lua_context_object are the same temp[] to keep labels few
+    code = _RE_TEMP.sub('temp[]', ser.decode(lua_code)).strip()
+    m = _RE_METHOD.match(code)
+    if m is not None:
+        return m.group(1)
+    if code.endswith('(...)') and '\n' not in code:
+        return code[:-5]
+    return 'lua:' + code.split('\n', 1)[0][:40]
+
+
+class CallStats:
+    __slots__ = (
+        'calls', 'round_trips', 'latency', 'latency_sum',
+        'request_bytes', 'response_bytes', 'yields')
+
+    def __init__(self):
+        self.calls = 0
+        self.round_trips = 0
+        # non-cumulative counts per bucket
+        self.latency = [0] * (len(LATENCY_BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+        self.yields = 0
+
+    def merge(self, other):
+        self.calls += other.calls
+        self.round_trips += other.round_trips
+        for i, n in enumerate(other.latency):
+            self.latency[i] += n
+        self.latency_sum += other.latency_sum
+        self.request_bytes += other.request_bytes
+        self.response_bytes += other.response_bytes
+        self.yields += other.yields
+
+    def as_dict(self):
+        return {
+            'calls': self.calls,
+            'round_trips': self.round_trips,
+            'latency_buckets': dict(zip(
+                [str(b) for b in LATENCY_BUCKETS] + ['+Inf'], self.latency)),
+            'latency_sum': self.latency_sum,
+            'request_bytes': self.request_bytes,
+            'response_bytes': self.response_bytes,
+            'yields': self.yields,
+        }
+
+
+class SessionMetrics:
+    # Stats of Lua calls by label. A round trip is a request waiting
+    # for computer: a single call or a batch of them (labeled 'batch',
+    # calls inside count under their own labels).
+    def __init__(self):
+        self.methods = {}
+        # time spent running python code of the program
+        self.python_seconds = 0.0
+        self.events = 0
+        # fs metadata answered by the cache of fs.cache() or by computer
+        self.fs_cache_hits = 0
+        self.fs_cache_misses = 0
+
+    def _stats(self, label):
+        st = self.methods.get(label)
+        if st is None:
+            if len(self.methods) >= MAX_LABELS:
+                label = OTHER_LABEL
+                st = self.methods.get(label)
+            if st is None:
+                st = self.methods[label] = CallStats()
+        return st
+
+    def count_call(self, label):
+        self._stats(label).calls += 1
+
+    def on_round_trip(self, label, latency, request_bytes, response_bytes,
+                      yields=None):
+        st = self._stats(label)
+        st.round_trips += 1
+        st.latency[bisect_left(LATENCY_BUCKETS, latency)] += 1
+        st.latency_sum += latency
+        st.request_bytes += request_bytes
+        st.response_bytes += response_bytes
+        if yields is not None:
+            st.yields += yields
+
+    def merge(self, other):
+        for label, st in other.methods.items():
+            self._stats(label).merge(st)
+        self.python_seconds += other.python_seconds
+        self.events += other.events
+        self.fs_cache_hits += other.fs_cache_hits
+        self.fs_cache_misses += other.fs_cache_misses
+
+    def as_dict(self):
+        return {
+            'python_seconds': self.python_seconds,
+            'events': self.events,
+            'fs_cache_hits': self.fs_cache_hits,
+            'fs_cache_misses': self.fs_cache_misses,
+            'methods': {
+                label: st.as_dict()
+                for label, st in sorted(self.methods.items())},
+        }
+
+
+def _escape(v):
+    return str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(k, _escape(v)) for k, v in labels.items()) + '}'
+
+
+def render_prometheus(metrics: SessionMetrics, gauges=(), counters=(),
+                      labels=None) -> str:
+    # text exposition format; gauges and counters are (name, help, value)
+    labels = labels or {}
+    lines = []
+
+    def family(name, kind, help_text, samples):
+        lines.append('# HELP {} {}'.format(name, help_text))
+        lines.append('# TYPE {} {}'.format(name, kind))
+        for suffix, extra, value in samples:
+            lines.append('{}{}{} {}'.format(
+                name, suffix, _labels(dict(labels, **extra)), value))
+
+    for name, help_text, value in gauges:
+        family(name, 'gauge', help_text, [('', {}, value)])
+    for name, help_text, value in counters:
+        family(name, 'counter', help_text, [('', {}, value)])
+    family('cc_python_seconds_total', 'counter',
+           'Time spent running python code of programs.',
+           [('', {}, metrics.python_seconds)])
+    family('cc_events_total', 'counter', 'Events received from computers.',
+           [('', {}, metrics.events)])
+    family('cc_fs_cache_hits_total', 'counter',
+           'fs metadata calls answered by session cache.',
+           [('', {}, metrics.fs_cache_hits)])
+    family('cc_fs_cache_misses_total', 'counter',
+           'fs metadata calls of cached sessions sent to computers.',
+           [('', {}, metrics.fs_cache_misses)])
+
+    methods = sorted(metrics.methods.items())
+    for attr, name, help_text in (
+        ('calls', 'cc_lua_calls_total', 'Lua calls, batched ones included.'),
+        ('round_trips', 'cc_lua_round_trips_total',
+         'Requests which waited for computer.'),
+        ('request_bytes', 'cc_lua_request_bytes_total',
+         'Bytes of requests sent to computers.'),
+        ('response_bytes', 'cc_lua_response_bytes_total',
+         'Bytes of results received from computers.'),
+        ('yields', 'cc_lua_yields_total',
+         'Times Lua tasks were resumed by computer.'),
+    ):
+        family(name, 'counter', help_text, [
+            ('', {'method': label}, getattr(st, attr))
+            for label, st in methods])
+
+    samples = []
+    for label, st in methods:
+        total = 0
+        for bound, n in zip(LATENCY_BUCKETS, st.latency):
+            total += n
+            samples.append(
+                ('_bucket', {'method': label, 'le': str(bound)}, total))
+        samples.append((
+            '_bucket', {'method': label, 'le': '+Inf'}, st.round_trips))
+        samples.append(('_sum', {'method': label}, st.latency_sum))
+        samples.append(('_count', {'method': label}, st.round_trips))
+    family('cc_lua_round_trip_seconds', 'histogram',
+           'Time from sending a request to getting its result.', samples)
+    return '\n'.join(lines) + '\n'
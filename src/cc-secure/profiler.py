@@ -0,0 +1,146 @@
+import sys
+import threading
+import time
+from collections import Counter
+from os.path import basename
+
+
+__all__ = (
+    'Profile',
+    'start',
+    'stop',
+)
+
+
+# Sampling profiler for programs of sessions. A thread looks at every
+# greenlet of profiled sessions each interval: the one running now
+# is charged as running python, suspended ones as waiting, by what they
+# wait for. Weights are microseconds of wall time, output is in folded
+# format of flamegraph.pl / speedscope:
+#   computer 5;running;<module> (prog.py:1);dig (prog.py:10) 120000
+
+PROFILE_INTERVAL = 0.01
+
+RUNNING = 'running'
+# function a greenlet is suspended in -> what it waits for
+_WAIT_STATES = {
+    'eval_lua': 'waiting on Lua',
+    '_eval_lua_batch': 'waiting on Lua',
+    'batch': 'waiting on Lua',
+    'sleep': 'sleeping',
+    'captureEvent': 'waiting for event',
+    'waitForAll': 'waiting for tasks',
+    'waitForAny': 'waiting for tasks',
+}
+_OTHER_WAIT = 'waiting'
+
+
+def _frame_label(code):
+    return '{} ({}:{})'.format(
+        code.co_name, basename(code.co_filename), code.co_firstlineno)
+
+
+class Profile:
+    def __init__(self, sess, interval=PROFILE_INTERVAL):
+        self.sess = sess
+        self.interval = interval
+        self.stacks = Counter()
+        # microseconds by state
+        self.states = Counter()
+        self.started = time.time()
+        self.stopped = None
+
+    def _sample(self, main_frame, weight):
+        for glet in list(self.sess._greenlets.values()):
+            g = glet._g
+            if not g:
+                # not started yet or finished
+                continue
+            frame = g.gr_frame
+            if frame is None:
+                # running right now, in the main thread
+                frame = main_frame
+                state = RUNNING
+            else:
+                state = _WAIT_STATES.get(frame.f_code.co_name, _OTHER_WAIT)
+            labels = []
+            while frame is not None:
+                labels.append(frame.f_code)
+                frame = frame.f_back
+            if labels and labels[-1].co_name == '_run':
+                # CCGreenlet._run wraps every program and task
+                labels.pop()
+            stack = (state, *reversed(labels))
+            self.stacks[stack] += weight
+            self.states[state] += weight
+
+    def folded(self) -> str:
+        root = 'computer {}'.format(self.sess._computer_id)
+        lines = []
+        for (state, *codes), weight in sorted(
+                self.stacks.items(), key=lambda x: -x[1]):
+            lines.append('{} {}'.format(
+                ';'.join([root, state, *map(_frame_label, codes)]), weight))
+        return '\n'.join(lines) + '\n'
+
+    def summary(self) -> dict:
+        # seconds by state
+        return {
+            state: us / 1e6 for state, us in self.states.most_common()}
+
+
+class _Sampler(threading.Thread):
+    def __init__(self, main_thread_id):
+        super().__init__(name='cc-profiler', daemon=True)
+        self._main_thread_id = main_thread_id
+        self._lock = threading.Lock()
+        self.profiles = set()
+        # set under _lock when run stops taking profiles,
+        # is_alive() stays true a while longer
+        self.exited = False
+
+    def run(self):
+        last = time.perf_counter()
+        while True:
+            with self._lock:
+                if not self.profiles:
+                    self.exited = True
+                    return
+                profiles = list(self.profiles)
+            time.sleep(min(p.interval for p in profiles))
+            now = time.perf_counter()
+            weight = int((now - last) * 1e6)
+            last = now
+            main_frame = sys._current_frames().get(self._main_thread_id)
+            for p in profiles:
+                p._sample(main_frame, weight)
+
+
+_sampler = None
+
+
+def start(sess, interval=PROFILE_INTERVAL) -> Profile:
+    # must be called from the thread running sessions
+    global _sampler
+    profile = Profile(sess, interval)
+    sess.profile = profile
+    if _sampler is not None:
+        with _sampler._lock:
+            if not _sampler.exited:
+                _sampler.profiles.add(profile)
+                return profile
+    _sampler = _Sampler(threading.get_ident())
+    _sampler.profiles.add(profile)
+    _sampler.start()
+    return profile
+
+
+def stop(sess) -> Profile:
+    profile = sess.profile
+    if profile is None:
+        return None
+    sess.profile = None
+    profile.stopped = time.time()
+    with _sampler._lock:
+        _sampler.profiles.discard(profile)
+    return profile
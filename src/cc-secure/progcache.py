@@ -0,0 +1,136 @@
+import marshal
+import os
+import sys
+from collections import OrderedDict
+from hashlib import sha256
+from os.path import join
+
+from RestrictedPython import compile_restricted
+from RestrictedPython import transformer
+
+from . import ser
+
+
+__all__ = (
+    'ProgramCache',
+    'ProgramIndex',
+    'program_cache',
+    'program_index',
+)
+
+
+def _file_hash(path):
+    with open(path, 'rb') as f:
+        return sha256(f.read()).digest()
+
+
+# code objects transformed by another version of RestrictedPython
+# may break its newer rules, so they aren't reused
+_POLICY = _file_hash(transformer.__file__)
+
+
+class ProgramCache:
+    # Compiled programs by hash of their path and source, shared by
+    # all sessions. Least recently used code objects are dropped,
+    # with directory set they are also kept on disk as marshal files,
+    # which are run as they are: only the server may write there.
+    def __init__(self, size=128, directory=None):
+        self._size = size
+        self._codes = OrderedDict()
+        self.directory = directory
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def key(path: bytes, source: bytes) -> str:
+        # path is a part of key as it's compiled into code object
+        return sha256(_POLICY + path + b'\0' + source).hexdigest()
+
+    def stats(self):
+        return {
+            'size': len(self._codes),
+            'hits': self.hits,
+            'disk_hits': self.disk_hits,
+            'misses': self.misses,
+        }
+
+    def _disk_path(self, key):
+        # marshal format differs between python versions
+        return join(self.directory, '{}.{}.marshal'.format(
+            key, sys.implementation.cache_tag))
+
+    def _remember(self, key, code):
+        self._codes[key] = code
+        self._codes.move_to_end(key)
+        if len(self._codes) > self._size:
+            self._codes.popitem(last=False)
+
+    def get(self, key):
+        code = self._codes.get(key)
+        if code is not None:
+            self._codes.move_to_end(key)
+            self.hits += 1
+            return code
+        if self.directory is None:
+            return None
+        try:
+            with open(self._disk_path(key), 'rb') as f:
+                code = marshal.load(f)
+        except (OSError, EOFError, ValueError, TypeError):
+            return None
+        self.disk_hits += 1
+        self._remember(key, code)
+        return code
+
+    def _save(self, key, code):
+        path = self._disk_path(key)
+        tmp = '{}.{}.tmp'.format(path, os.getpid())
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(tmp, 'wb') as f:
+                marshal.dump(code, f)
+            os.replace(tmp, path)
+        except OSError:
+            pass
+
+    def compile(self, path: bytes, source: bytes, key: str = None):
+        # raises SyntaxError like compile_restricted does
+        if key is None:
+            key = self.key(path, source)
+        code = self.get(key)
+        if code is not None:
+            return code
+        self.misses += 1
+        code = compile_restricted(
+            ser.decode(source), ser.decode(path), 'exec')
+        self._remember(key, code)
+        if self.directory is not None:
+            self._save(key, code)
+        return code
+
+
+class ProgramIndex:
+    # Programs seen on computers: (computer id, program name) ->
+    # (path, size, modification time, cache key). While size and
+    # modification time of the file are the same, computer doesn't
+    # send the source again.
+    def __init__(self, size=4096):
+        self._size = size
+        self._items = OrderedDict()
+
+    def get(self, computer_id, name):
+        item = self._items.get((computer_id, name))
+        if item is not None:
+            self._items.move_to_end((computer_id, name))
+        return item
+
+    def put(self, computer_id, name, item):
+        self._items[(computer_id, name)] = item
+        self._items.move_to_end((computer_id, name))
+        if len(self._items) > self._size:
+            self._items.popitem(last=False)
+
+
+program_cache = ProgramCache()
+program_index = ProgramIndex()
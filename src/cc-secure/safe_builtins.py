@@ -1,7 +1,6 @@
 import math
 import random
 import string
-from . import subapis
 
 cc_builtins = {}
 
@@ -12,8 +11,6 @@ cc_builtins['whrandom'] = random
 cc_builtins['set'] = set
 cc_builtins['frozenset'] = frozenset
 
-cc_builtins["cc"] = subapis
-
 
 def same_type(arg1, *args):
     """Compares the class or type of two or more objects."""
@@ -3,8 +3,11 @@ A secure version (using RestrictedPython) of python's stdlib codeop
 """
 
 import __future__
+import ast
+import builtins
 import warnings
-from RestrictedPython import compile_restricted as compile
+from collections import OrderedDict
+from RestrictedPython.transformer import RestrictingNodeTransformer
 
 _features = [getattr(__future__, fname)
              for fname in __future__.all_feature_names]
@@ -17,6 +20,19 @@ __all__ = ["compile_command", "Compile", "CommandCompiler"]
 PyCF_DONT_IMPLY_DEDENT = 0x200          
 PyCF_ALLOW_INCOMPLETE_INPUT = 0x4000
 
+# Results of _maybe_compile (code objects, None for incomplete input)
+# with their future flags by source, filename, symbol and compiler flags,
+# shared by all consoles.
+CACHE_SIZE = 256
+_cache = OrderedDict()
+
+def _future_flags(codeob):
+    flags = 0
+    for feature in _features:
+        if codeob.co_flags & feature.compiler_flag:
+            flags |= feature.compiler_flag
+    return flags
+
 def _maybe_compile(compiler, source, filename, symbol):
     # Check for source consisting of only blank lines and comments.
     for line in source.split("\n"):
@@ -27,10 +43,26 @@ def _maybe_compile(compiler, source, filename, symbol):
         if symbol != "eval":
             source = "pass"     # Replace it with a 'pass' statement
 
+    key = (source, filename, symbol, compiler.flags)
+    try:
+        code, flags = _cache[key]
+    except KeyError:
+        pass
+    else:
+        _cache.move_to_end(key)
+        # future statements of the command apply to this compiler too
+        compiler.flags |= flags
+        return code
+
+    # Only parse here, the restricting transformer runs once the input
+    # is known to be complete.
     try:
-        return compiler(source, filename, symbol)
+        tree = compiler.parse(source, filename, symbol)
     except SyntaxError:  # Let other compile() errors propagate.
         pass
+    else:
+        code = compiler.restrict(tree, filename, symbol)
+        return _remember(key, code, _future_flags(code))
 
     # Catch syntax warnings after the first compile
     # to emit warnings (SyntaxWarning, DeprecationWarning) at most once.
@@ -38,12 +70,18 @@ def _maybe_compile(compiler, source, filename, symbol):
         warnings.simplefilter("error")
 
         try:
-            compiler(source + "\n", filename, symbol)
+            compiler.parse(source + "\n", filename, symbol)
         except SyntaxError as e:
             if "incomplete input" in str(e):
-                return None
+                return _remember(key, None)
             raise
 
+def _remember(key, code, flags=0):
+    _cache[key] = (code, flags)
+    if len(_cache) > CACHE_SIZE:
+        _cache.popitem(last=False)
+    return code
+
 def _is_syntax_error(err1, err2):
     rep1 = repr(err1)
     rep2 = repr(err2)
@@ -53,8 +91,6 @@ def _is_syntax_error(err1, err2):
         return True
     return False
 
-def _compile(source, filename, symbol):
-    return compile(source, filename, symbol, PyCF_DONT_IMPLY_DEDENT | PyCF_ALLOW_INCOMPLETE_INPUT)
 
 def compile_command(source, filename="<input>", symbol="single"):
     r"""Compile a command and determine whether it is incomplete.
@@ -75,7 +111,7 @@ def compile_command(source, filename="<input>", symbol="single"):
       syntax error (OverflowError and ValueError can be produced by
       malformed literals).
     """
-    return _maybe_compile(_compile, source, filename, symbol)
+    return _maybe_compile(Compile(), source, filename, symbol)
 
 class Compile:
     """Instances of this class behave much like the built-in compile
@@ -85,13 +121,26 @@ class Compile:
     def __init__(self):
         self.flags = PyCF_DONT_IMPLY_DEDENT | PyCF_ALLOW_INCOMPLETE_INPUT
 
-    def __call__(self, source, filename, symbol):
-        codeob = compile(source, filename, symbol, self.flags, True)
-        for feature in _features:
-            if codeob.co_flags & feature.compiler_flag:
-                self.flags |= feature.compiler_flag
+    def parse(self, source, filename, symbol):
+        return builtins.compile(
+            source, filename, symbol, self.flags | ast.PyCF_ONLY_AST, True)
+
+    def restrict(self, tree, filename, symbol):
+        # same checks as RestrictedPython's compile_restricted
+        errors, warns, used_names = [], [], {}
+        RestrictingNodeTransformer(errors, warns, used_names).visit(tree)
+        for warning in warns:
+            warnings.warn(warning, SyntaxWarning)
+        if errors:
+            raise SyntaxError(tuple(errors))
+        codeob = builtins.compile(tree, filename, symbol, self.flags, True)
+        self.flags |= _future_flags(codeob)
         return codeob
 
+    def __call__(self, source, filename, symbol):
+        return self.restrict(
+            self.parse(source, filename, symbol), filename, symbol)
+
 class CommandCompiler:
     """Instances of this class have __call__ methods identical in
     signature to compile_command; the difference is that if the
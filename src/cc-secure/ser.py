@@ -61,38 +61,57 @@ def serialize(v: Any) -> bytes:
         raise ValueError('Value can\'t be serialized: {}'.format(repr(v)))
 
 
+_KEY = object()  # marks that the next parsed value is a table key
+
+
 def _deserialize(b: bytes, _idx: int) -> Tuple[Any, int]:
-    tok = b[_idx]
-    _idx += 1
-    if tok == 78:  # N
-        return None, _idx
-    elif tok == 70:  # F
-        return False, _idx
-    elif tok == 84:  # T
-        return True, _idx
-    elif tok == 91:  # [
-        newidx = b.index(b']', _idx)
-        f = float(b[_idx:newidx])
-        if f.is_integer():
-            f = int(f)
-        return f, newidx + 1
-    elif tok == 60:  # <
-        newidx = b.index(b'>', _idx)
-        ln = int(b[_idx:newidx])
-        return b[newidx + 1:newidx + 1 + ln], newidx + 1 + ln
-    elif tok == 123:  # {
-        r = {}
-        while True:
-            tok = b[_idx]
-            _idx += 1
-            if tok == 125:  # }
-                break
-            key, _idx = _deserialize(b, _idx)
-            value, _idx = _deserialize(b, _idx)
-            r[key] = value
-        return r, _idx
-    else:
-        raise ValueError
+    # Single pass over the frame without recursion: nested tables are kept
+    # on an explicit stack, values are sliced directly out of the frame.
+    index = b.index
+    stack = []
+    table = key = None
+    while True:
+        tok = b[_idx]
+        _idx += 1
+        if tok == 60:  # <
+            newidx = index(62, _idx)
+            ln = newidx + 1 + int(b[_idx:newidx])
+            v = b[newidx + 1:ln]
+            _idx = ln
+        elif tok == 91:  # [
+            newidx = index(93, _idx)
+            v = b[_idx:newidx]
+            if v.isdigit():
+                v = int(v)
+            else:
+                v = float(v)
+                if v.is_integer():
+                    v = int(v)
+            _idx = newidx + 1
+        elif tok == 58:  # :
+            key = _KEY
+            continue
+        elif tok == 125:  # }
+            v = table
+            table, key = stack.pop()
+        elif tok == 123:  # {
+            stack.append((table, key))
+            table = {}
+            continue
+        elif tok == 78:  # N
+            v = None
+        elif tok == 84:  # T
+            v = True
+        elif tok == 70:  # F
+            v = False
+        else:
+            raise ValueError
+        if key is _KEY:
+            key = v
+        elif table is None:
+            return v, _idx
+        else:
+            table[key] = v
 
 
 def deserialize(b: bytes) -> Any:
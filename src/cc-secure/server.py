@@ -1,20 +1,122 @@
 import argparse
 import asyncio
+import os
 import sys
-from os.path import join, dirname, abspath
+from collections import deque
+from functools import partial
+from os.path import basename, join, dirname, abspath, isdir, normpath
 
 from aiohttp import web, WSMsgType
 
 from .sess import CCSession
-from . import ser
+from .metrics import SessionMetrics, render_prometheus
+from . import profiler
+from .progcache import program_cache
+from .sync import sync as sync_dir
+from . import ser, bser
+from .workers import run_workers
 from .rproc import lua_table_to_list
 
 
 THIS_DIR = dirname(abspath(__file__))
 LUA_FILE = join(THIS_DIR, 'back.lua')
-LUA_FILE_VERSION = 3
+LUA_FILE_VERSION = 9
 PROTO_ERROR = b'C' + ser.serialize(b'protocol error')
+WIRE_FORMATS = {
+    b'text': ser,
+    b'binary': bser,
+}
 DEBUG_PROTO = False
+# incoming messages wait while that many messages are waiting to be sent
+SEND_QUEUE_SIZE = 256
+# computercraft refuses websocket messages over 128k
+MAX_FRAME_SIZE = 65536
+
+
+class CCWriter:
+    # Single coroutine writes to the websocket. Messages queued while
+    # previous frame was being sent go out together as one 'M' frame.
+    def __init__(self, ws, codec, send, size=SEND_QUEUE_SIZE):
+        self._ws = ws
+        self._codec = codec
+        self._send = send
+        self._size = size
+        self._queue = deque()
+        self._pending = asyncio.Event()
+        self._writable = asyncio.Event()
+        self._writable.set()
+        self._closed = False
+        self.frames = 0
+        self.messages = 0
+        self.max_depth = 0
+
+    @property
+    def depth(self):
+        return len(self._queue)
+
+    def stats(self):
+        return {
+            'depth': self.depth,
+            'max_depth': self.max_depth,
+            'frames': self.frames,
+            'messages': self.messages,
+        }
+
+    def send(self, data):
+        if self._closed:
+            return
+        self._queue.append(data)
+        self._pending.set()
+        depth = len(self._queue)
+        if depth > self.max_depth:
+            self.max_depth = depth
+        if depth >= self._size:
+            self._writable.clear()
+
+    async def writable(self):
+        await self._writable.wait()
+
+    def close(self):
+        self._closed = True
+        self._queue.clear()
+        self._pending.set()
+        self._writable.set()
+
+    def _take_frame(self):
+        first = self._queue.popleft()
+        self.messages += 1
+        if not self._queue:
+            return first
+        part = self._codec.serialize(first)
+        parts = [b'M', part]
+        size = 1 + len(part)
+        while self._queue:
+            part = self._codec.serialize(self._queue[0])
+            if size + len(part) > MAX_FRAME_SIZE:
+                break
+            self._queue.popleft()
+            self.messages += 1
+            parts.append(part)
+            size += len(part)
+        if len(parts) == 2:
+            return first
+        return b''.join(parts)
+
+    async def run(self):
+        while True:
+            while not self._queue:
+                if self._closed:
+                    return
+                self._pending.clear()
+                await self._pending.wait()
+            frame = self._take_frame()
+            if len(self._queue) < self._size:
+                self._writable.set()
+            self.frames += 1
+            try:
+                await self._send(self._ws, frame)
+            except ConnectionError:
+                self.close()
 
 
 class CCApplication(web.Application):
@@ -40,7 +142,7 @@ class CCApplication(web.Application):
             action = next(msg)
             if action != b'0':
                 await self._send(ws, PROTO_ERROR)
-                return None
+                return None, None
 
             version = next(msg)
             if version != LUA_FILE_VERSION:
@@ -48,43 +150,81 @@ class CCApplication(web.Application):
                     'protocol version mismatch (expected {}, got {}), redownload py'.format(
                         LUA_FILE_VERSION, version,
                     ))))
-                return None
+                return None, None
 
             computer_id = next(msg)
             args = lua_table_to_list(next(msg), low_index=0)
+            codec = WIRE_FORMATS.get(next(msg))
+            if codec is None:
+                await self._send(ws, b'C' + ser.serialize(b'unknown wire format'))
+                return None, None
 
-            def sender(data):
-                asyncio.create_task(self._send(ws, data))
-
-            sess = CCSession(computer_id, sender)
+            writer = CCWriter(ws, codec, self._send)
+            asyncio.create_task(writer.run())
+            sess = CCSession(computer_id, writer.send, codec)
+            ids = self['profile_ids']
+            if ids == 'all' or (ids is not None and computer_id in ids):
+                profiler.start(sess)
+            # computers get synced directories before their program starts
+            prepare = self._sync_session if self['sync'] else None
             if len(args) >= 2:
-                sess.run_program(args[1], [ser.decode(x) for x in args[2:]])
+                sess.run_program(
+                    args[1], [ser.decode(x) for x in args[2:]], prepare)
             else:
-                sess.run_repl()
-            return sess
+                sess.run_repl(prepare)
+            return sess, writer
+        return None, None
+
+    @classmethod
+    def _handle_message(cls, sess, data):
+        # returns False for unknown action
+        msg = sess._codec.dcmditer(data)
+        action = next(msg)
+        if action == b'E':
+            sess.on_event(
+                next(msg),
+                lua_table_to_list(next(msg)),
+            )
+        elif action == b'T':
+            sess.on_task_result(
+                next(msg),
+                next(msg),
+                next(msg, None),  # ycount
+            )
+        elif action == b'M':  # several messages in one frame
+            for m in msg:
+                if not cls._handle_message(sess, m):
+                    return False
+        else:
+            return False
+        return True
 
     async def ws(self, request):
         ws = web.WebSocketResponse()
         await ws.prepare(request)
 
-        sess = await self._launch_program(ws)
+        sess, writer = await self._launch_program(ws)
         if sess is not None:
+            self['writers'].add(writer)
+            self['sessions'].add(sess)
+            codec = sess._codec
             async for msg in self._bin_messages(ws):
-                msg = ser.dcmditer(msg)
-                action = next(msg)
-                if action == b'E':
-                    sess.on_event(
-                        next(msg),
-                        lua_table_to_list(next(msg)),
-                    )
-                elif action == b'T':
-                    sess.on_task_result(
-                        next(msg),
-                        next(msg),
-                    )
-                else:
-                    await self._send(ws, PROTO_ERROR)
+                # greenlets aren't resumed while computer can't keep up
+                await writer.writable()
+                if not self._handle_message(sess, msg):
+                    await self._send(ws, b'C' + codec.serialize(b'protocol error'))
                     break
+            writer.close()
+            sess.on_close()
+            self['writers'].discard(writer)
+            self['sessions'].discard(sess)
+            self['finished_metrics'].merge(sess.metrics)
+            if sess.profile is not None:
+                self._save_profile(profiler.stop(sess))
+            totals = self['totals']
+            totals['finished'] += 1
+            totals['frames'] += writer.frames
+            totals['messages'] += writer.messages
 
         return ws
 
@@ -100,28 +240,253 @@ class CCApplication(web.Application):
             "local url = '<pyserv>'",
             "local url = '{}://{}/'".format('ws', h)
         )
+        # py downloaded from /?format=text talks the old text wire format
+        wire_format = request.query.get('format', 'binary')
+        if ser.encode(wire_format) not in WIRE_FORMATS:
+            raise web.HTTPBadRequest(text='unknown wire format')
+        fcont = fcont.replace(
+            "local wire_format = 'binary'",
+            "local wire_format = '{}'".format(wire_format)
+        )
         return web.Response(text=fcont)
 
+    def _save_profile(self, profile):
+        summary = ', '.join(
+            '{} {:.2f}s'.format(state, sec)
+            for state, sec in profile.summary().items())
+        print('profile of computer {}: {}'.format(
+            profile.sess._computer_id, summary or 'no samples'), flush=True)
+        if self['profile_dir'] is None:
+            return
+        os.makedirs(self['profile_dir'], exist_ok=True)
+        path = join(self['profile_dir'], 'computer-{}-{}.folded'.format(
+            profile.sess._computer_id, int(profile.started)))
+        with open(path, 'w') as f:
+            f.write(profile.folded())
+
+    @staticmethod
+    async def profile(request):
+        # /profile?id=<computer id>&seconds=10 profiles a connected computer
+        # for a while, responds with flamegraph input
+        try:
+            computer_id = int(request.query['id'])
+            seconds = float(request.query.get('seconds', 10))
+        except (KeyError, ValueError):
+            raise web.HTTPBadRequest(text='id of computer expected')
+        sessions = [
+            sess for sess in request.app['sessions']
+            if sess._computer_id == computer_id and sess.profile is None]
+        if not sessions:
+            raise web.HTTPNotFound(
+                text='computer is not connected or is being profiled')
+        profiles = [profiler.start(sess) for sess in sessions]
+        try:
+            await asyncio.sleep(seconds)
+        finally:
+            for sess in sessions:
+                if sess.profile is not None:
+                    profiler.stop(sess)
+        return web.Response(text=''.join(p.folded() for p in profiles))
+
+    def _sync_session(self, delete=False):
+        # runs in a greenlet of the session
+        return [
+            dict(sync_dir(local, remote, delete), local=local, remote=remote)
+            for local, remote in self['sync']]
+
+    @staticmethod
+    async def sync(request):
+        # POST /sync?id=1,2&delete=1 pushes --sync directories to connected
+        # computers (all by default) side by side, responds with what was sent
+        app = request.app
+        if not app['sync']:
+            raise web.HTTPNotFound(text='no directories to sync')
+        try:
+            ids = request.query.get('id')
+            ids = ids and frozenset(int(x) for x in ids.split(','))
+        except ValueError:
+            raise web.HTTPBadRequest(text='ids of computers expected')
+        if app['workers'] > 1 and not (
+                (ids and len(ids) == 1) or 'worker' in request.query):
+            # request went to one worker, which has only its own computers
+            raise web.HTTPBadRequest(
+                text='with several workers, /sync takes a single id, '
+                     'or worker=<index> for computers of that worker')
+        delete = request.query.get('delete') in ('1', 'true')
+        sessions = [
+            sess for sess in app['sessions']
+            if not ids or sess._computer_id in ids]
+        results = await asyncio.gather(
+            *(sess.run_task(partial(app._sync_session, delete))
+              for sess in sessions),
+            return_exceptions=True)
+        out = []
+        for sess, r in zip(sessions, results):
+            item = {'id': sess._computer_id}
+            if isinstance(r, asyncio.CancelledError):
+                item['error'] = 'computer disconnected'
+            elif isinstance(r, BaseException):
+                item['error'] = str(r) or type(r).__name__
+            else:
+                item['dirs'] = r
+            out.append(item)
+        return web.json_response(out)
+
+    @staticmethod
+    def stats(request):
+        app = request.app
+        writers = app['writers']
+        totals = app['totals']
+        return web.json_response({
+            'worker': app['worker'],
+            'pid': os.getpid(),
+            'sessions': len(writers),
+            'send_queue': sum(w.depth for w in writers),
+            'finished': totals['finished'],
+            'frames': totals['frames'] + sum(w.frames for w in writers),
+            'messages': (
+                totals['messages'] + sum(w.messages for w in writers)),
+            'program_cache': program_cache.stats(),
+        })
+
+    @staticmethod
+    def metrics(request):
+        app = request.app
+        writers = app['writers']
+        totals = app['totals']
+        merged = SessionMetrics()
+        merged.merge(app['finished_metrics'])
+        for sess in app['sessions']:
+            merged.merge(sess.metrics)
+        text = render_prometheus(
+            merged,
+            gauges=[
+                ('cc_sessions', 'Connected computers.', len(writers)),
+                ('cc_send_queue', 'Messages waiting to be sent.',
+                 sum(w.depth for w in writers)),
+            ],
+            counters=[
+                ('cc_sessions_finished_total', 'Finished sessions.',
+                 totals['finished']),
+                ('cc_frames_sent_total', 'Websocket frames sent.',
+                 totals['frames'] + sum(w.frames for w in writers)),
+                ('cc_messages_sent_total', 'Messages sent.',
+                 totals['messages'] + sum(w.messages for w in writers)),
+            ],
+            labels={'worker': app['worker']},
+        )
+        return web.Response(
+            text=text, content_type='text/plain',
+            headers={'X-Content-Type-Options': 'nosniff'})
+
+    @staticmethod
+    def session_metrics(request):
+        # /metrics/session?id=<computer id>, for connected computers
+        try:
+            computer_id = int(request.query['id'])
+        except (KeyError, ValueError):
+            raise web.HTTPBadRequest(text='id of computer expected')
+        dumps = [
+            dict(sess.metrics.as_dict(), id=computer_id)
+            for sess in request.app['sessions']
+            if sess._computer_id == computer_id
+        ]
+        if not dumps:
+            raise web.HTTPNotFound(text='computer is not connected')
+        return web.json_response(dumps)
+
     def initialize(self):
+        # send queues of connected computers
+        self['writers'] = set()
+        self['sessions'] = set()
+        # counts and metrics of finished sessions
+        self['totals'] = {'finished': 0, 'frames': 0, 'messages': 0}
+        self['finished_metrics'] = SessionMetrics()
         self.router.add_get('/', self.backdoor)
         self.router.add_get('/ws/', self.ws)
+        self.router.add_get('/stats', self.stats)
+        self.router.add_get('/metrics', self.metrics)
+        self.router.add_get('/metrics/session', self.session_metrics)
+        self.router.add_get('/profile', self.profile)
+        self.router.add_post('/sync', self.sync)
+
+
+def create_app(port, worker=0, profile_ids=None, profile_dir=None,
+               code_cache_dir=None, sync_dirs=(), workers=1):
+    # profile_ids is 'all' or set of computer ids to profile from start
+    # sync_dirs are (server directory, computer directory) pairs
+    if code_cache_dir is not None:
+        program_cache.directory = code_cache_dir
+    app = CCApplication()
+    app['port'] = port
+    app['worker'] = worker
+    app['workers'] = workers
+    app['profile_ids'] = profile_ids
+    app['profile_dir'] = profile_dir
+    app['sync'] = tuple(sync_dirs)
+    app.initialize()
+    return app
 
 
 def main():
     parser = argparse.ArgumentParser()
     parser.add_argument('--host')
     parser.add_argument('--port', type=int, default=8080)
+    parser.add_argument(
+        '--workers', type=int, default=1,
+        help='number of processes, computers are spread by their id')
+    parser.add_argument(
+        '--profile', metavar='IDS',
+        help='profile programs of these computers (1,2,3 or all)')
+    parser.add_argument(
+        '--profile-dir', default='profiles',
+        help='where profiles are written when sessions end')
+    parser.add_argument(
+        '--code-cache', metavar='DIR',
+        help='keep compiled programs on disk, shared by workers and restarts; '
+             'they are run without the sandbox compile step, so DIR must '
+             'be writable only by the server')
+    parser.add_argument(
+        '--sync', metavar='DIR[:REMOTE]', action='append', default=[],
+        help='directory copied to computers when they connect and '
+             'on POST /sync, only changes are sent; REMOTE defaults '
+             'to name of DIR')
     args = parser.parse_args()
 
+    sync_dirs = []
+    for arg in args.sync:
+        local, sep, remote = arg.rpartition(':')
+        # a colon followed by a path is a windows drive (C:\proj),
+        # not REMOTE
+        if not sep or '\\' in remote or remote.startswith('/'):
+            local, remote = arg, basename(normpath(arg))
+        elif not remote:
+            parser.error('--sync: empty REMOTE in {}'.format(arg))
+        if not isdir(local):
+            parser.error('--sync: {} is not a directory'.format(local))
+        sync_dirs.append((local, remote))
+
+    profile_ids = None
+    if args.profile == 'all':
+        profile_ids = 'all'
+    elif args.profile:
+        profile_ids = frozenset(int(x) for x in args.profile.split(','))
+    make_app = partial(
+        create_app, args.port,
+        profile_ids=profile_ids, profile_dir=args.profile_dir,
+        code_cache_dir=args.code_cache, sync_dirs=sync_dirs,
+        workers=args.workers)
+
+    if args.workers > 1:
+        run_workers(make_app, args.host, args.port, args.workers)
+        return
+
     app_kw = {}
     if args.host is not None:
         app_kw['host'] = args.host
     app_kw['port'] = args.port
 
-    app = CCApplication()
-    app['port'] = args.port
-    app.initialize()
-    web.run_app(app, **app_kw)
+    web.run_app(make_app(), **app_kw)
 
 
 if __name__ == '__main__':
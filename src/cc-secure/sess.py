@@ -2,29 +2,34 @@ import asyncio
 import string
 import sys
 from code import InteractiveConsole
-from collections import deque
+from collections import deque, OrderedDict
 from contextlib import contextmanager
-from functools import partial
+from functools import lru_cache, partial
 from importlib import import_module
 from importlib.abc import MetaPathFinder, Loader
 from importlib.machinery import ModuleSpec
 from itertools import count
+from os import listdir
 from platform import python_version
+from time import perf_counter
 from traceback import format_exc
 from types import ModuleType
 
-from greenlet import greenlet, getcurrent as get_current_greenlet
-from RestrictedPython import compile_restricted as compile
+from greenlet import greenlet, getcurrent as get_current_greenlet, GreenletExit
 
 from .safe_builtins import cc_builtins
 from .lua import lua_string
-from . import rproc, ser
+from .metrics import SessionMetrics, call_label, BATCH_LABEL
+from .progcache import program_cache, program_index
+from . import rproc, ser, subapis
 
 __all__ = (
     'CCSession',
     'get_current_session',
     'eval_lua',
     'lua_context_object',
+    'pipelined',
+    'batch',
 )
 
 
@@ -34,6 +39,11 @@ def debug(*args):
 
 
 DIGITS = string.digits + string.ascii_lowercase
+PIPELINE_SIZE = 128  # queued void calls are sent when there are that many
+# stdout and stderr are sent with the next lua call, or earlier
+# when there are that many bytes or lines (0 disables buffering)
+OUTPUT_BUFFER_SIZE = 4096
+OUTPUT_BUFFER_LINES = 64
 
 
 def base36(n):
@@ -48,13 +58,17 @@ def _is_global_greenlet():
     return not hasattr(get_current_greenlet(), 'cc_greenlet')
 
 
-def get_current_session():
+def _get_current_cc_greenlet():
     try:
-        return get_current_greenlet().cc_greenlet._sess
+        return get_current_greenlet().cc_greenlet
     except AttributeError:
         raise RuntimeError('Computercraft function was called outside context')
 
 
+def get_current_session():
+    return _get_current_cc_greenlet()._sess
+
+
 class StdFileProxy:
     def __init__(self, native, err):
         self._native = native
@@ -80,11 +94,17 @@ class StdFileProxy:
         if _is_global_greenlet():
             return self._native.write(s)
         else:
-            s = ser.dirty_encode(s)
-            if self._err:
-                return eval_lua('io.stderr:write(...)', s).take_none()
-            else:
-                return eval_lua('io.write(...)', s).take_none()
+            _get_current_cc_greenlet().write_output(
+                ser.dirty_encode(s), self._err)
+            return len(s)
+
+    def flush(self):
+        # greenlets are gone by the time stdout is flushed at exit
+        if sys.is_finalizing() or _is_global_greenlet():
+            return self._native.flush()
+        elif not getattr(get_current_greenlet(), 'cc_batch', False):
+            # output of batch() functions goes after the batch
+            _get_current_cc_greenlet().flush_void_calls()
 
     def fileno(self):
         if _is_global_greenlet():
@@ -98,26 +118,99 @@ class StdFileProxy:
         return getattr(self._native, name)
 
 
+@lru_cache(maxsize=None)
+def _subapi_names():
+    # submodules of cc package, without importing them;
+    # base and mixins are helpers of the other subapis
+    return frozenset(
+        name[:-3] for path in subapis.__path__ for name in listdir(path)
+        if name.endswith('.py') and not name.startswith('_')
+    ) - {'base', 'mixins'}
+
+
+_cc_modules = {}
+
+
+class CCModule(ModuleType):
+    # cc modules are shared by all sessions of the process,
+    # names of one session's program can't be rebound for the others
+    def __setattr__(self, name, value):
+        # import system sets submodules on their package
+        sub = _cc_modules.get(self.__name__ + '.' + name)
+        if sub is None or value is not sub:
+            raise AttributeError('cc modules are read-only')
+        super().__setattr__(name, value)
+
+    def __delattr__(self, name):
+        raise AttributeError('cc modules are read-only')
+
+
+def cc_module(name):
+    # cc or cc.* module, created once per process and shared by all
+    # sessions, read-only. The subapis module is imported on first access
+    # to a name, then its __all__ goes to module's dict and module
+    # __getattr__ is removed, so further lookups are plain (and
+    # specialized) dict hits.
+    mod = _cc_modules.get(name)
+    if mod is not None:
+        return mod
+    sn = name.split('.', 1)
+    assert sn[0] == 'cc'
+    subapi = 'cc-secure.subapis.' + (sn[1] if len(sn) > 1 else '_pkg')
+    mod = _cc_modules[name] = CCModule(name)
+    d = mod.__dict__
+
+    def load():
+        rawmod = import_module(subapi)
+        del d['__getattr__'], d['__dir__']
+        for k in rawmod.__all__:
+            d[k] = getattr(rawmod, k)
+        d['__all__'] = rawmod.__all__
+        if name == 'cc':
+            # submodules are lazy too, so it's cheap
+            for k in _subapi_names():
+                d[k] = import_module('cc.' + k)
+
+    def __getattr__(attr):
+        if attr.startswith('_') and attr != '__all__':
+            raise AttributeError(attr)
+        load()
+        try:
+            return d[attr]
+        except KeyError:
+            raise AttributeError('module {!r} has no attribute {!r}'.format(
+                name, attr)) from None
+
+    def __dir__():
+        load()
+        return sorted(d)
+
+    d['__getattr__'] = __getattr__
+    d['__dir__'] = __dir__
+    return mod
+
+
 class ComputerCraftFinder(MetaPathFinder):
     @staticmethod
     def find_spec(fullname, path, target=None):
         if fullname == 'cc':
             return ModuleSpec(fullname, ComputerCraftLoader, is_package=True)
-        if fullname.startswith('cc.'):
+        if fullname.startswith('cc.') and fullname[3:] in _subapi_names():
             return ModuleSpec(fullname, ComputerCraftLoader, is_package=False)
 
 
 class ComputerCraftLoader(Loader):
     @staticmethod
     def create_module(spec):
-        sn = spec.name.split('.', 1)
-        assert sn[0] == 'cc'
-        if len(sn) == 1:
-            sn.append('_pkg')
-        rawmod = import_module('.' + sn[1], 'cc-secure.subapis')
-        mod = ModuleType(spec.name)
-        for k in rawmod.__all__:
-            setattr(mod, k, getattr(rawmod, k))
+        mod = cc_module(spec.name)
+        # import system can't set these on a read-only module
+        d = mod.__dict__
+        if d.get('__spec__') is None:
+            d['__spec__'] = spec
+            d['__loader__'] = spec.loader
+            d['__package__'] = spec.parent
+            if spec.submodule_search_locations is not None:
+                d['__path__'] = spec.submodule_search_locations
         return mod
 
     @staticmethod
@@ -131,23 +224,200 @@ def install_import_hook():
 
 
 install_import_hook()
+cc_builtins['cc'] = cc_module('cc')
 sys.stdin = StdFileProxy(sys.__stdin__, False)
 sys.stdout = StdFileProxy(sys.__stdout__, False)
 sys.stderr = StdFileProxy(sys.__stderr__, True)
 
 
-def eval_lua(lua_code, *params, immediate=False):
+def _code_item(sess, lua_code, params):
+    # refers to compiled chunk in back.lua if it's already there
+    slot, defined = sess._code_cache.lookup(lua_code)
+    if defined:
+        return (slot, params)
+    return (lua_code, params, slot)
+
+
+def _eval_lua_batch(calls, stop=True):
+    # runs [(lua_code, params), ...] in order as a single task,
+    # with stop set calls after the first failed one are not run,
+    # None stands for them
+    glet = _get_current_cc_greenlet()
+    sess = glet._sess
+    codec = sess._codec
+    metrics = sess.metrics
+    for lua_code, _ in calls:
+        metrics.count_call(call_label(lua_code))
+    request = b'B' + codec.serialize(
+        [_code_item(sess, lua_code, params) for lua_code, params in calls]
+    ) + codec.serialize(stop)
+    start = perf_counter()
+    result = sess._server_greenlet.switch(request)
+    metrics.on_round_trip(
+        BATCH_LABEL, perf_counter() - start, len(request), len(result),
+        glet._ycount)
+    rp = rproc.ResultProc(codec.deserialize(result))
+    rp.check_bool_error()
+    results = rp.take_dict()
+    return [
+        None if results.get(i) is None else rproc.ResultProc(results[i])
+        for i in range(1, len(calls) + 1)
+    ]
+
+
+def eval_lua(lua_code, *params, immediate=False, void=False):
     if isinstance(lua_code, str):
         lua_code = ser.encode(lua_code)
-    request = ((b'I' if immediate else b'T') + ser.serialize(lua_code) +
-               ser.serialize(params))
-    result = get_current_session()._server_greenlet.switch(request)
-    rp = rproc.ResultProc(ser.deserialize(result))
+    g = get_current_greenlet()
+    if getattr(g, 'cc_batch', False):
+        # batch() collects this call and resumes with its result
+        rp = g.parent.switch((lua_code, params))
+        if not immediate:
+            rp.check_bool_error()
+        return rp
+    glet = _get_current_cc_greenlet()
+    if immediate:
+        glet.flush_void_calls()
+    elif void and glet._void_calls is not None:
+        glet._void_calls = glet._take_queued()
+        glet._void_calls.append((lua_code, params))
+        if len(glet._void_calls) >= PIPELINE_SIZE:
+            glet.flush_void_calls()
+        return rproc.ResultProc({})
+    else:
+        calls = glet._take_queued()
+        if calls:
+            calls.append((lua_code, params))
+            for rp in _eval_lua_batch(calls):
+                # raises error of a queued call if any
+                rp.check_bool_error()
+            return rp
+    sess = glet._sess
+    codec = sess._codec
+    label = call_label(lua_code)
+    sess.metrics.count_call(label)
+    request = (b'I' if immediate else b'T') + b''.join(
+        codec.serialize(x) for x in _code_item(sess, lua_code, params))
+    start = perf_counter()
+    result = sess._server_greenlet.switch(request)
+    sess.metrics.on_round_trip(
+        label, perf_counter() - start, len(request), len(result),
+        glet._ycount)
+    rp = rproc.ResultProc(codec.deserialize(result))
     if not immediate:
         rp.check_bool_error()
     return rp
 
 
+@contextmanager
+def pipelined():
+    '''
+    Usage:
+
+    with pipelined():
+        term.setCursorPos(1, 1)
+        term.write('text')
+
+    Calls which return nothing don't wait for computer inside this block.
+    They are sent together with the next call returning a value,
+    or at the end of the block. Errors of such calls are raised there.
+    '''
+    glet = _get_current_cc_greenlet()
+    if glet._void_calls is not None:
+        # already pipelined by outer block
+        yield
+        return
+    glet._void_calls = []
+    try:
+        yield
+    finally:
+        glet.flush_void_calls(stop=True)
+
+
+def batch(*calls):
+    '''
+    Usage:
+
+    details = batch(*((turtle.getItemDetail, slot) for slot in range(1, 17)))
+    inputs = batch(*((redstone.getInput, side) for side in sides))
+
+    Each call is a function or a (function, *args) tuple.
+    Functions run side by side, Lua calls they make are sent
+    to computer together and wait for a single round trip.
+    Returns list of function results in the same order.
+    If some functions have failed, error of the first one in order
+    is raised after all of them have finished.
+
+    Functions must not wait for events (os.sleep, os.captureEvent etc).
+    '''
+    glet = _get_current_cc_greenlet()
+    fns = [
+        partial(c[0], *c[1:]) if isinstance(c, tuple) else c
+        for c in calls
+    ]
+    results = [None] * len(fns)
+    errors = {}
+
+    if getattr(get_current_greenlet(), 'cc_batch', False):
+        # nested batch, calls are collected by the outer one anyway
+        for i, fn in enumerate(fns):
+            try:
+                results[i] = fn()
+            except Exception as e:
+                errors[i] = e
+        if errors:
+            raise errors[min(errors)]
+        return results
+
+    glet.flush_void_calls()
+    current = get_current_greenlet()
+    workers = {}
+    for i, fn in enumerate(fns):
+        w = greenlet(fn, parent=current)
+        w.cc_greenlet = glet
+        w.cc_batch = True
+        workers[i] = w
+
+    resume = {i: () for i in workers}
+    while workers:
+        requests = []
+        for i, w in list(workers.items()):
+            try:
+                r = w.switch(*resume[i])
+            except Exception as e:
+                errors[i] = e
+                r = None
+            if w.dead:
+                results[i] = r
+                del workers[i]
+            else:
+                requests.append((i, r))
+        if requests:
+            rps = _eval_lua_batch([r for _, r in requests], stop=False)
+            for (i, _), rp in zip(requests, rps):
+                resume[i] = (rp, )
+
+    # output of the functions is sent like if it was printed here
+    if (
+        glet._out_held
+        or len(glet._out) >= OUTPUT_BUFFER_SIZE
+        or glet._out_lines >= OUTPUT_BUFFER_LINES
+    ):
+        glet._spill_output()
+    if errors:
+        raise errors[min(errors)]
+    return results
+
+
+def forbid_in_batch(what):
+    # waiting for the server from a batch() function would resume
+    # the batch instead of the function
+    if getattr(get_current_greenlet(), 'cc_batch', False):
+        raise RuntimeError(
+            "{} can't be used inside batch(), its functions "
+            "can only make Lua calls".format(what))
+
+
 @contextmanager
 def lua_context_object(create_expr: str,
                        create_params: tuple,
@@ -165,9 +435,9 @@ def lua_context_object(create_expr: str,
 
 
 def eval_lua_method_factory(obj):
-    def method(name, *params):
+    def method(name, *params, void=False):
         code = 'return ' + obj + name + '(...)'
-        return eval_lua(code, *params)
+        return eval_lua(code, *params, void=void)
 
     return method
 
@@ -190,7 +460,21 @@ class CCGreenlet:
             self._parent._children.add(self._task_id)
 
         self._children = set()
-        self._g = greenlet(body_fn)
+        # detached greenlet doesn't close the session when it ends
+        self._detached = False
+        # list of calls queued inside pipelined() block
+        self._void_calls = None
+        # stdout/stderr text not sent yet
+        self._out = bytearray()
+        self._out_err = False
+        self._out_lines = 0
+        # output calls of batch() functions waiting for the batch to end
+        self._out_held = []
+        # times lua task of the last result was resumed
+        self._ycount = None
+        # timer of sleep() in progress
+        self._sleep = None
+        self._g = greenlet(partial(self._run, body_fn))
         self._g.cc_greenlet = self
 
     def detach_children(self):
@@ -199,6 +483,100 @@ class CCGreenlet:
             self._children.clear()
             self._sess.drop(ch)
 
+    def _run(self, body_fn, *args, **kwargs):
+        try:
+            r = body_fn(*args, **kwargs)
+        except GreenletExit:
+            raise
+        except BaseException:
+            # output printed before the error goes first
+            self.flush_void_calls()
+            raise
+        self.flush_void_calls()
+        return r
+
+    def _take_queued(self):
+        # calls queued by pipelined() followed by buffered output
+        calls = []
+        if self._void_calls:
+            calls, self._void_calls = self._void_calls, []
+        if self._out_held:
+            calls.extend(self._out_held)
+            self._out_held.clear()
+        if self._out:
+            calls.append(self._out_call())
+        return calls
+
+    def _out_call(self):
+        if self._out_err:
+            code = b'io.stderr:write(...)'
+        else:
+            code = b'io.write(...)'
+        call = (code, (bytes(self._out), ))
+        self._out.clear()
+        self._out_lines = 0
+        return call
+
+    def write_output(self, data, err):
+        # a batch() function can't wait for computer on its own,
+        # its output is sent after the batch
+        in_batch = getattr(get_current_greenlet(), 'cc_batch', False)
+        if err != self._out_err:
+            if self._out:
+                if in_batch:
+                    self._out_held.append(self._out_call())
+                else:
+                    self._spill_output()
+            self._out_err = err
+        self._out += data
+        self._out_lines += data.count(b'\n')
+        if not in_batch and (
+            len(self._out) >= OUTPUT_BUFFER_SIZE
+            or self._out_lines >= OUTPUT_BUFFER_LINES
+        ):
+            self._spill_output()
+
+    def _spill_output(self):
+        if self._void_calls is not None:
+            # keeps order with queued calls, still not waiting for computer
+            self._void_calls = self._take_queued()
+            if len(self._void_calls) < PIPELINE_SIZE:
+                return
+        self.flush_void_calls()
+
+    def flush_void_calls(self, stop=False):
+        # sends calls queued by pipelined() and buffered output,
+        # must be called from this greenlet; for batch() functions
+        # batch sends them when they are done
+        if getattr(get_current_greenlet(), 'cc_batch', False):
+            calls = None
+        else:
+            calls = self._take_queued()
+        if stop:
+            self._void_calls = None
+        if calls:
+            for rp in _eval_lua_batch(calls):
+                rp.check_bool_error()
+
+    def sleep(self, seconds):
+        # suspends this greenlet using server event loop,
+        # no lua task is waiting for a timer meanwhile
+        forbid_in_batch('sleep')
+        self.flush_void_calls()
+        self._sleep = asyncio.get_running_loop().call_later(
+            max(seconds or 0, 0), self._wake)
+        try:
+            res = self._sess._server_greenlet.switch()
+        finally:
+            self._sleep.cancel()
+            self._sleep = None
+        assert res == 'timer'
+
+    def _wake(self):
+        # greenlet may have been dropped while sleeping
+        if self._sess._greenlets.get(self._task_id) is self:
+            self.switch('timer')
+
     def _on_death(self, error=None):
         self._sess._greenlets.pop(self._task_id, None)
         self.detach_children()
@@ -207,7 +585,7 @@ class CCGreenlet:
                 error = None
             else:
                 error = ser.dirty_encode(error)
-            self._sess._sender(b'C' + ser.serialize(error))
+            self._sess._sender(b'C' + self._sess._codec.serialize(error))
         if self._parent is not None:
             self._parent._children.discard(self._task_id)
 
@@ -218,6 +596,7 @@ class CCGreenlet:
     def switch(self, *args, **kwargs):
         # switch must be called from server greenlet
         assert get_current_greenlet() is self._sess._server_greenlet
+        start = perf_counter()
         try:
             task = self._g.switch(*args, **kwargs)
         except SystemExit:
@@ -226,17 +605,20 @@ class CCGreenlet:
         except Exception:
             self._on_death(format_exc(limit=None, chain=False))
             return
+        finally:
+            self._sess.metrics.python_seconds += perf_counter() - start
 
         # lua_eval call or simply idle
         if isinstance(task, bytes):
             x = self
             while x._g.dead:
                 x = x._parent
-            self._sess._sender(task[0:1] + ser.serialize(x._task_id) +
+            self._sess._sender(task[0:1] +
+                               self._sess._codec.serialize(x._task_id) +
                                task[1:])
 
         if self._g.dead:
-            if self._parent is None:
+            if self._parent is None and not self._detached:
                 self._on_death(True)
             else:
                 self._on_death()
@@ -277,6 +659,12 @@ class CCEventRouter:
                 self._set_task_status(task_id, event, False)
                 self._resume_task(task_id)
 
+    def on_timeout(self, task_id, event):
+        # does nothing if an event has already resumed the task
+        if self._active.get(task_id) == event:
+            self._set_task_status(task_id, event, False)
+            self._resume_task(task_id, 'timeout')
+
     def get_from_stack(self, task_id, event):
         queue = self._stacks[event][task_id]
         try:
@@ -292,29 +680,67 @@ class CCEventRouter:
             self._active.pop(task_id, None)
 
 
+class CCCodeCache:
+    # Mirrors compiled chunk cache of back.lua.
+    # Snippet is sent in full once together with a slot number,
+    # later tasks refer to that slot only.
+    # Lua side just stores chunks by slot, so eviction happens here:
+    # least recently used snippet gives its slot to a new one.
+    def __init__(self, size=512):
+        self._size = size
+        self._slots = OrderedDict()
+
+    def lookup(self, code):
+        # returns (slot, whether back.lua already has the chunk)
+        slot = self._slots.get(code)
+        if slot is not None:
+            self._slots.move_to_end(code)
+            return slot, True
+        if len(self._slots) < self._size:
+            slot = len(self._slots) + 1
+        else:
+            _, slot = self._slots.popitem(last=False)
+        self._slots[code] = slot
+        return slot, False
+
+
 class CCSession:
-    def __init__(self, computer_id, sender):
+    def __init__(self, computer_id, sender, codec=ser):
         # computer_id is unique identifier of a CCSession
+        # codec is ser or bser module, depending on negotiated wire format
         self._computer_id = computer_id
+        self._codec = codec
+        self._code_cache = CCCodeCache()
         self._tid_allocator = map(base36, count(start=1))
         self._sender = sender
         self._greenlets = {}
         self._server_greenlet = get_current_greenlet()
         self._program_greenlet = None
+        # futures of run_task() greenlets
+        self._tasks = set()
+        self.metrics = SessionMetrics()
+        # set by profiler.start()
+        self.profile = None
+        # set by fs.cache()
+        self.fs_cache = None
         self._evr = CCEventRouter(
-            lambda event: self._sender(b'S' + ser.serialize(event)),
-            lambda event: self._sender(b'U' + ser.serialize(event)),
-            lambda task_id: self._greenlets[task_id].defer_switch('event'),
+            lambda event: self._sender(b'S' + codec.serialize(event)),
+            lambda event: self._sender(b'U' + codec.serialize(event)),
+            lambda task_id, reason='event':
+                self._greenlets[task_id].defer_switch(reason),
         )
 
-    def on_task_result(self, task_id, result):
+    def on_task_result(self, task_id, result, ycount=None):
         assert get_current_greenlet() is self._server_greenlet
         if task_id not in self._greenlets:
             # ignore for dropped tasks
             return
-        self._greenlets[task_id].switch(result)
+        g = self._greenlets[task_id]
+        g._ycount = ycount
+        g.switch(result)
 
     def on_event(self, event, params):
+        self.metrics.events += 1
         self._evr.on_event(event, params)
 
     def create_task_id(self):
@@ -331,41 +757,110 @@ class CCSession:
         for task_id in task_ids:
             all_tids.extend(collect(task_id))
 
-        self._sender(b'D' + b''.join(ser.serialize(tid) for tid in all_tids))
+        self._sender(b'D' + b''.join(
+            self._codec.serialize(tid) for tid in all_tids))
+
+    def on_close(self):
+        for fut in self._tasks:
+            if not fut.done():
+                fut.cancel()
+        self._tasks.clear()
+        # sleeping programs must not wake up without a computer
+        for g in self._greenlets.values():
+            if g._sleep is not None:
+                g._sleep.cancel()
+        self._greenlets.clear()
+
+    def run_task(self, fn):
+        # runs fn in a greenlet of its own next to the program,
+        # returns future of its result; unlike the program it doesn't
+        # close the session when it ends
+        fut = asyncio.get_running_loop().create_future()
+
+        def body():
+            try:
+                r = fn()
+            except Exception as e:
+                if not fut.done():
+                    fut.set_exception(e)
+            else:
+                if not fut.done():
+                    fut.set_result(r)
+            finally:
+                self._tasks.discard(fut)
+
+        self._tasks.add(fut)
+        g = CCGreenlet(body, sess=self)
+        g._detached = True
+        g.switch()
+        return fut
+
+    def _run_sandboxed_greenlet(self, fn, prepare=None):
+        if prepare is not None:
+            # runs in program greenlet, before the program
+            body = fn
+
+            def fn():
+                prepare()
+                return body()
 
-    def _run_sandboxed_greenlet(self, fn):
         self._program_greenlet = CCGreenlet(fn, sess=self)
         self._program_greenlet.switch()
 
-    def run_program(self, program, args):
-        def _run_program():
+    def run_program(self, program, args, prepare=None):
+        def _fetch(known):
+            # source is nil when it's the same file as the known one
             rp = eval_lua(
                 '''
-local p = fs.combine(shell.dir(), ...)
+local name, known = ...
+local p = fs.combine(shell.dir(), name)
 if not fs.exists(p) then return nil end
 if fs.isDir(p) then return nil end
+local a = fs.attributes and fs.attributes(p) or {}
+if known ~= nil and known.p == p
+        and a.size == known.size and a.modification == known.modification then
+    return p, nil, a.size, a.modification
+end
 local f = fs.open(p, 'r')
 local code = f.readAll()
 f.close()
-return p, code
-'''.lstrip(), program)
+return p, code or '', a.size, a.modification
+'''.lstrip(), program, known)
             if rp.peek() is None:
+                return None, None, None, None
+            return (
+                rp.take_bytes(), rp.take_option_bytes(),
+                rp.take_option_int(), rp.take_option_int())
+
+        def _run_program():
+            # program is bytes, as it came from computer
+            item = program_index.get(self._computer_id, program)
+            cc = None
+            if item is not None:
+                cc = program_cache.get(item[3])
+            known = None
+            if cc is not None and item[2] is not None:
+                known = {b'p': item[0], b'size': item[1], b'modification': item[2]}
+            p, code, size, modification = _fetch(known)
+            if p is None:
                 print('Program not found', file=sys.stderr)
                 return
-            p = rp.take_string()
-            code = rp.take_string()
-            cc = compile(code, p, 'exec')
+            if code is not None:
+                key = program_cache.key(p, code)
+                program_index.put(
+                    self._computer_id, program, (p, size, modification, key))
+                cc = program_cache.compile(p, code, key)
             exec(cc, {
-                '__file__': p,
+                '__file__': ser.decode(p),
                 'args': args,
                 "__builtins__": cc_builtins
             })
 
-        self._run_sandboxed_greenlet(_run_program)
+        self._run_sandboxed_greenlet(_run_program, prepare)
 
-    def run_repl(self):
+    def run_repl(self, prepare=None):
         def _repl():
             InteractiveConsole(locals={}).interact(banner='Python {}'.format(
                 python_version()), )
 
-        self._run_sandboxed_greenlet(_repl)
+        self._run_sandboxed_greenlet(_repl, prepare)
@@ -2,7 +2,7 @@ from types import ModuleType
 from RestrictedPython import compile_restricted as compile
 from ..errors import LuaException
 from ..lua import lua_string
-from ..sess import eval_lua
+from ..sess import eval_lua, pipelined, batch
 from ..safe_builtins import cc_builtins
 
 
@@ -13,6 +13,8 @@ __all__ = (
     'is_turtle',
     'is_pocket',
     'eval_lua',
+    'pipelined',
+    'batch',
     'LuaException',
 )
 
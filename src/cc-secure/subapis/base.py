@@ -9,6 +9,6 @@ class BaseSubAPI(LuaExpr):
     def get_expr_code(self):
         return self._lua_expr
 
-    def _method(self, name, *params):
+    def _method(self, name, *params, void=False):
         code = 'return {}.{}(...)'.format(self.get_expr_code(), name)
-        return eval_lua(code, *params)
+        return eval_lua(code, *params, void=void)
@@ -0,0 +1,167 @@
+from typing import Tuple
+
+from .. import ser
+from ..sess import pipelined
+from . import colors
+from .mixins import TermMixin, TermTarget
+from .term import TermAPI, tapi
+
+
+__all__ = (
+    'FrameBuffer',
+)
+
+
+_BLIT_CHARS = b'0123456789abcdef'
+
+
+def _blit_char(colorID: int) -> int:
+    return _BLIT_CHARS[colorID.bit_length() - 1]
+
+
+class FrameBuffer:
+    '''
+    Usage:
+
+    fb = FrameBuffer(monitor)
+    while True:
+        fb.setCursorPos(1, 1)
+        fb.write('Energy: {}'.format(energy()))
+        fb.flush()
+
+    Drawing methods mirror term API but only change screen contents
+    kept here. flush() sends rows changed since previous flush
+    as blit calls, all of them in a single message.
+    Target is term (default), term target, window or monitor.
+    Cursor position and colors of the target are not preserved.
+    '''
+    def __init__(self, target=None):
+        if target is None:
+            target = tapi
+        elif isinstance(target, TermTarget):
+            target = TermAPI(target.get_expr_code())
+        elif not isinstance(target, TermMixin):
+            raise TypeError('Terminal object expected')
+        self._target = target
+        self._x = self._y = 1
+        self._fg = _blit_char(colors.white)
+        self._bg = _blit_char(colors.black)
+        self.resize()
+
+    def resize(self):
+        # reads target size again, e.g. after monitor.setTextScale
+        self._width, self._height = self._target.getSize()
+        self._text = [bytearray(b' ' * self._width)
+                      for _ in range(self._height)]
+        self._fgs = [bytearray([self._fg]) * self._width
+                     for _ in range(self._height)]
+        self._bgs = [bytearray([self._bg]) * self._width
+                     for _ in range(self._height)]
+        self.redraw()
+
+    def redraw(self):
+        # next flush sends every row
+        self._shown = [None] * self._height
+
+    def flush(self):
+        rows = []
+        for y in range(self._height):
+            row = (
+                bytes(self._text[y]), bytes(self._fgs[y]), bytes(self._bgs[y]))
+            if row != self._shown[y]:
+                rows.append((y + 1, row))
+        if not rows:
+            return
+        target = self._target
+        with pipelined():
+            for y, (text, fg, bg) in rows:
+                target.setCursorPos(1, y)
+                target.blit(ser.decode(text), fg, bg)
+        # rows are shown once the calls have gone through,
+        # after an error the next flush sends them again
+        for y, row in rows:
+            self._shown[y - 1] = row
+
+    def _put(self, text: bytes, fg: bytes, bg: bytes):
+        # writes at cursor with clipping, moves cursor like term.write
+        y = self._y - 1
+        x = self._x - 1
+        self._x += len(text)
+        if not 0 <= y < self._height:
+            return
+        if x < 0:
+            text, fg, bg = text[-x:], fg[-x:], bg[-x:]
+            x = 0
+        end = min(x + len(text), self._width)
+        if end <= x:
+            return
+        n = end - x
+        self._text[y][x:end] = text[:n]
+        self._fgs[y][x:end] = fg[:n]
+        self._bgs[y][x:end] = bg[:n]
+
+    def write(self, text: str):
+        text = ser.dirty_encode(text)
+        n = len(text)
+        self._put(text, bytes([self._fg]) * n, bytes([self._bg]) * n)
+
+    def blit(self, text: str, textColors: bytes, backgroundColors: bytes):
+        text = ser.dirty_encode(text)
+        if not len(text) == len(textColors) == len(backgroundColors):
+            raise ValueError('Arguments must be the same length')
+        self._put(text, textColors.lower(), backgroundColors.lower())
+
+    def clear(self):
+        for y in range(self._height):
+            self._clear_row(y)
+
+    def clearLine(self):
+        if 0 < self._y <= self._height:
+            self._clear_row(self._y - 1)
+
+    def _clear_row(self, y: int):
+        self._text[y][:] = b' ' * self._width
+        self._fgs[y][:] = bytes([self._fg]) * self._width
+        self._bgs[y][:] = bytes([self._bg]) * self._width
+
+    def scroll(self, lines: int):
+        lines = max(-self._height, min(lines, self._height))
+        if lines == 0:
+            return
+        for rows in (self._text, self._fgs, self._bgs):
+            if lines > 0:
+                del rows[:lines]
+            else:
+                del rows[len(rows) + lines:]
+        blank = abs(lines)
+        for rows, c in ((self._text, b' '[0]), (self._fgs, self._fg),
+                        (self._bgs, self._bg)):
+            new = [bytearray([c]) * self._width for _ in range(blank)]
+            if lines > 0:
+                rows.extend(new)
+            else:
+                rows[:0] = new
+
+    def getCursorPos(self) -> Tuple[int, int]:
+        return self._x, self._y
+
+    def setCursorPos(self, x: int, y: int):
+        self._x, self._y = x, y
+
+    def getSize(self) -> Tuple[int, int]:
+        return self._width, self._height
+
+    def isColor(self) -> bool:
+        return self._target.isColor()
+
+    def setTextColor(self, colorID: int):
+        self._fg = _blit_char(colorID)
+
+    def getTextColor(self) -> int:
+        return colors.chars[chr(self._fg)]
+
+    def setBackgroundColor(self, colorID: int):
+        self._bg = _blit_char(colorID)
+
+    def getBackgroundColor(self) -> int:
+        return colors.chars[chr(self._bg)]
@@ -1,36 +1,245 @@
+import io
+import posixpath
 from contextlib import contextmanager
-from typing import Optional, List
+from time import monotonic
+from typing import Dict, Iterator, Optional, List, Tuple
 
 from .base import BaseSubAPI
 from .. import ser
-from ..sess import eval_lua_method_factory, lua_context_object
+from ..rproc import lua_table_to_list
+from ..sess import (
+    batch, eval_lua, eval_lua_method_factory, get_current_session,
+    lua_context_object)
+
+
+# Streams move data in chunks of this size (one Lua read or write call each),
+# a round trip carries read_ahead / write_behind chunks. Results of a round
+# trip are a single websocket message, keep it below the message limit
+# of computers (128 KiB by default).
+CHUNK_SIZE = 16 * 1024
+READ_AHEAD = 4
+WRITE_BEHIND = 4
+# entries (and directories) walk() gets per round trip,
+# computer yields every WALK_YIELD of them
+WALK_BATCH = 500
+WALK_YIELD = 100
+# results fs.cache() keeps, the oldest go first
+METADATA_CACHE_SIZE = 4096
 
 
 class SeekMixin:
     def seek(self, whence: str = None, offset: int = None) -> int:
         # whence: set, cur, end
+        if self._stream is not None:
+            # position of the handle is ahead by data the stream has read
+            back = self._stream._rewind()
+            if whence in (None, 'cur'):
+                offset = (offset or 0) - back
         rp = self._method('seek', ser.nil_encode(whence), offset)
         rp.check_nil_error()
         return rp.take_int()
 
 
+class ChunkedReader(io.BufferedIOBase):
+    '''
+    File-like reader of a handle opened in read mode. Requests read_ahead
+    chunks per round trip and serves reads from them. Handle must not be
+    read directly while the stream is in use.
+    '''
+    def __init__(self, handle, chunk_size=CHUNK_SIZE, read_ahead=READ_AHEAD):
+        self._handle = handle
+        self._chunk_size = chunk_size
+        self._read_ahead = read_ahead
+        self._buf = bytearray()
+        self._eof = False
+
+    def readable(self):
+        return True
+
+    def _read_chunk(self):
+        return self._handle._method('read', self._chunk_size).take_option_bytes()
+
+    def _fill(self):
+        for chunk in batch(*[self._read_chunk] * self._read_ahead):
+            if not chunk:
+                self._eof = True
+                break
+            self._buf += chunk
+
+    def peek(self, size=0):
+        if not self._buf and not self._eof:
+            self._fill()
+        return bytes(self._buf)
+
+    def read1(self, size=-1):
+        self.peek()
+        if size is None or size < 0:
+            size = len(self._buf)
+        r = bytes(self._buf[:size])
+        del self._buf[:size]
+        return r
+
+    def read(self, size=-1):
+        if size is None or size < 0:
+            while not self._eof:
+                self._fill()
+            r, self._buf = bytes(self._buf), bytearray()
+            return r
+        while len(self._buf) < size and not self._eof:
+            self._fill()
+        return self.read1(size)
+
+    def readinto(self, b):
+        with memoryview(b) as view, view.cast('B') as view:
+            while len(self._buf) < len(view) and not self._eof:
+                self._fill()
+            n = min(len(view), len(self._buf))
+            view[:n] = self._buf[:n]
+        del self._buf[:n]
+        return n
+
+    def readinto1(self, b):
+        self.peek()
+        with memoryview(b) as view, view.cast('B') as view:
+            n = min(len(view), len(self._buf))
+            view[:n] = self._buf[:n]
+        del self._buf[:n]
+        return n
+
+    def readline(self, size=-1):
+        if size is None or size < 0:
+            size = None
+        while True:
+            end = self._buf.find(b'\n', 0, size)
+            if end >= 0:
+                end += 1
+                break
+            if self._eof or (size is not None and len(self._buf) >= size):
+                end = len(self._buf) if size is None else size
+                break
+            self._fill()
+        r = bytes(self._buf[:end])
+        del self._buf[:end]
+        return r
+
+    def _rewind(self):
+        # drops data read ahead, returns its size
+        n = len(self._buf)
+        self._buf.clear()
+        self._eof = False
+        return n
+
+
+class ChunkedWriter(io.BufferedIOBase):
+    '''
+    File-like writer of a handle opened in write or append mode. Keeps
+    written data until there are write_behind chunks, then sends them
+    in one round trip. flush() sends the rest and flushes the handle.
+    Closing the handle with fs.open block flushes the stream too.
+    '''
+    def __init__(self, handle, chunk_size=CHUNK_SIZE, write_behind=WRITE_BEHIND):
+        self._handle = handle
+        self._chunk_size = chunk_size
+        self._write_behind = write_behind
+        self._buf = bytearray()
+
+    def writable(self):
+        return True
+
+    def _write_chunk(self, chunk):
+        return self._handle._method('write', chunk).take_none()
+
+    def _send(self, size, *calls):
+        # at most write_behind chunks per round trip, calls go with the last
+        chunks = [
+            (self._write_chunk, bytes(self._buf[i:i + self._chunk_size]))
+            for i in range(0, size, self._chunk_size)]
+        del self._buf[:size]
+        while len(chunks) > self._write_behind:
+            batch(*chunks[:self._write_behind])
+            del chunks[:self._write_behind]
+        if chunks or calls:
+            batch(*chunks, *calls)
+
+    def write(self, b):
+        if self.closed:
+            raise ValueError('write to closed file')
+        with memoryview(b) as view:
+            n = view.nbytes
+            self._buf += view
+        full = self._chunk_size * self._write_behind
+        if len(self._buf) >= full:
+            self._send(len(self._buf) - len(self._buf) % full)
+        return n
+
+    def flush(self):
+        if self.closed:
+            return
+        self._send(len(self._buf), self._handle._flush_handle)
+
+    def _rewind(self):
+        self._send(len(self._buf))
+        return 0
+
+
 class ReadMixin:
+    _stream = None
+    _text_stream = None
+
     def _take(self, rp):
         raise NotImplementedError
 
+    def _decode(self, b):
+        raise NotImplementedError
+
+    def stream(self, chunk_size: int = CHUNK_SIZE, read_ahead: int = READ_AHEAD):
+        '''
+        Usage:
+
+        with fs.open('big.log', 'rb') as f:
+            data = f.stream().read()
+
+        Binary file-like object, see ChunkedReader.
+        '''
+        if self._stream is None:
+            self._stream = ChunkedReader(self, chunk_size, read_ahead)
+        return self._stream
+
+    # Once there is a stream (iteration makes one), reads are served by it,
+    # as the handle itself is ahead by data the stream has read.
+
     def read(self, count: int = 1) -> Optional[str]:
+        if self._stream is not None:
+            data = self._stream.read(count)
+            return self._decode(data) if data or not count else None
         return self._take(self._method('read', count))
 
     def readLine(self, withTrailing: bool = False) -> Optional[str]:
+        if self._stream is not None:
+            line = self._stream.readline()
+            if not line:
+                return None
+            if not withTrailing:
+                # like CC, the \r of \r\n goes too
+                if line.endswith(b'\r\n'):
+                    line = line[:-2]
+                elif line.endswith(b'\n'):
+                    line = line[:-1]
+            return self._decode(line)
         return self._take(self._method('readLine', withTrailing))
 
     def readAll(self) -> Optional[str]:
+        if self._stream is not None:
+            data = self._stream.read()
+            return self._decode(data) if data else None
         return self._take(self._method('readAll'))
 
     def __iter__(self):
         return self
 
     def __next__(self):
+        # lines are split here from blocks of stream()
+        self.stream()
         line = self.readLine()
         if line is None:
             raise StopIteration
@@ -38,25 +247,65 @@ class ReadMixin:
 
 
 class WriteMixin:
+    _stream = None
+    _text_stream = None
+
     def _put(self, t):
         raise NotImplementedError
 
+    def _flush_handle(self):
+        return self._method('flush').take_none()
+
+    def stream(self, chunk_size: int = CHUNK_SIZE, write_behind: int = WRITE_BEHIND):
+        '''
+        Usage:
+
+        with fs.open('big.log', 'wb') as f:
+            s = f.stream()
+            for record in records:
+                s.write(record)
+
+        Binary file-like object, see ChunkedWriter.
+        '''
+        if self._stream is None:
+            self._stream = ChunkedWriter(self, chunk_size, write_behind)
+        return self._stream
+
     def write(self, text: str):
+        if self._stream is not None:
+            # keeps order with data buffered by stream
+            self._stream.write(self._put(text))
+            return None
         return self._method('write', self._put(text)).take_none()
 
     def flush(self):
-        return self._method('flush').take_none()
+        if self._stream is not None:
+            return self._stream.flush()
+        return self._flush_handle()
 
 
 class ReadHandle(ReadMixin, BaseSubAPI):
     def _take(self, rp):
         return rp.take_option_unicode()
 
+    def _decode(self, b):
+        return b.decode('utf-8')
+
+    def textStream(self, chunk_size: int = CHUNK_SIZE, read_ahead: int = READ_AHEAD):
+        # utf-8 text over stream()
+        if self._text_stream is None:
+            self._text_stream = io.TextIOWrapper(
+                self.stream(chunk_size, read_ahead), encoding='utf-8', newline='')
+        return self._text_stream
+
 
 class BinaryReadHandle(ReadMixin, SeekMixin, BaseSubAPI):
     def _take(self, rp):
         return rp.take_option_bytes()
 
+    def _decode(self, b):
+        return b
+
 
 class WriteHandle(WriteMixin, BaseSubAPI):
     def _put(self, t: str) -> bytes:
@@ -65,12 +314,106 @@ class WriteHandle(WriteMixin, BaseSubAPI):
     def writeLine(self, text: str):
         return self.write(text + '\n')
 
+    def textStream(self, chunk_size: int = CHUNK_SIZE, write_behind: int = WRITE_BEHIND):
+        # utf-8 text over stream(), buffered there only
+        if self._text_stream is None:
+            self._text_stream = io.TextIOWrapper(
+                self.stream(chunk_size, write_behind), encoding='utf-8',
+                newline='', write_through=True)
+        return self._text_stream
+
 
 class BinaryWriteHandle(WriteMixin, SeekMixin, BaseSubAPI):
     def _put(self, b: bytes) -> bytes:
         return b
 
 
+class MetadataCache:
+    '''
+    Results of exists, isDir, getSize, list and attributes of a session
+    which has called fs.cache(). Files changed through fs of the same
+    session drop results of their paths, parent directories and
+    everything under them. Other changes (programs on computer,
+    disk inserted or ejected) are seen after ttl seconds, if it's set,
+    or after fs.invalidate().
+    '''
+    def __init__(self, metrics, ttl=None, size=METADATA_CACHE_SIZE):
+        self._metrics = metrics
+        self._size = size
+        # (name, normalized path): (time it was fetched, result)
+        self._results = {}
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'size': len(self._results),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / total if total else 0.0,
+        }
+
+    def get(self, name, path, fetch):
+        p = _normalize(path)
+        if p is None:
+            # error of computer is raised as is
+            return fetch()
+        key = (name, p)
+        item = self._results.get(key)
+        if item is not None and (
+                self.ttl is None or monotonic() - item[0] < self.ttl):
+            self.hits += 1
+            self._metrics.fs_cache_hits += 1
+            return item[1]
+        self.misses += 1
+        self._metrics.fs_cache_misses += 1
+        r = fetch()
+        self._results.pop(key, None)
+        if len(self._results) >= self._size:
+            del self._results[next(iter(self._results))]
+        self._results[key] = (monotonic(), r)
+        return r
+
+    def invalidate(self, path=None):
+        p = None if path is None else _normalize(path)
+        if not p:
+            # root is a parent of everything
+            self._results.clear()
+            return
+        under = p + '/'
+        for key in [
+            key for key in self._results
+            if key[1] == p or key[1].startswith(under)
+            or under.startswith(key[1] + '/') or not key[1]
+        ]:
+            del self._results[key]
+
+
+def _normalize(path):
+    # path as computer sees it, None for paths above root
+    p = posixpath.normpath(path.replace('\\', '/').lstrip('/'))
+    if p == '..' or p.startswith('../'):
+        return None
+    return '' if p == '.' else p
+
+
+def _cached(name, path, fetch):
+    c = get_current_session().fs_cache
+    if c is None:
+        return fetch()
+    return c.get(name, path, fetch)
+
+
+def _touch(*paths):
+    # session is about to change these paths
+    c = get_current_session().fs_cache
+    if c is not None:
+        for p in paths:
+            c.invalidate(p)
+
+
 method = eval_lua_method_factory('fs.')
 
 
@@ -95,19 +438,26 @@ __all__ = (
     'isDriveRoot',
     'complete',
     'attributes',
+    'walk',
+    'tree',
+    'cache',
+    'invalidate',
 )
 
 
 def list(path: str) -> List[str]:
-    return method('list', ser.encode(path)).take_list_of_strings()
+    return _cached('list', path, lambda: method(
+        'list', ser.encode(path)).take_list_of_strings())[:]
 
 
 def exists(path: str) -> bool:
-    return method('exists', ser.encode(path)).take_bool()
+    return _cached('exists', path, lambda: method(
+        'exists', ser.encode(path)).take_bool())
 
 
 def isDir(path: str) -> bool:
-    return method('isDir', ser.encode(path)).take_bool()
+    return _cached('isDir', path, lambda: method(
+        'isDir', ser.encode(path)).take_bool())
 
 
 def isReadOnly(path: str) -> bool:
@@ -119,7 +469,8 @@ def getDrive(path: str) -> Optional[str]:
 
 
 def getSize(path: str) -> int:
-    return method('getSize', ser.encode(path)).take_int()
+    return _cached('getSize', path, lambda: method(
+        'getSize', ser.encode(path)).take_int())
 
 
 def getFreeSpace(path: str) -> int:
@@ -131,18 +482,22 @@ def getCapacity(path: str) -> int:
 
 
 def makeDir(path: str):
+    _touch(path)
     return method('makeDir', ser.encode(path)).take_none()
 
 
 def move(fromPath: str, toPath: str):
+    _touch(fromPath, toPath)
     return method('move', ser.encode(fromPath), ser.encode(toPath)).take_none()
 
 
 def copy(fromPath: str, toPath: str):
+    _touch(toPath)
     return method('copy', ser.encode(fromPath), ser.encode(toPath)).take_none()
 
 
 def delete(path: str):
+    _touch(path)
     return method('delete', ser.encode(path)).take_none()
 
 
@@ -162,6 +517,9 @@ def open(path: str, mode: str):
         for line in f:
             ...
     '''
+    writes = 'r' not in mode
+    if writes:
+        _touch(path)
     with lua_context_object(
         'fs.open(...)',
         (ser.encode(path), ser.encode(mode.replace('b', '') + 'b')),
@@ -171,7 +529,18 @@ def open(path: str, mode: str):
             hcls = BinaryReadHandle if 'r' in mode else BinaryWriteHandle
         else:
             hcls = ReadHandle if 'r' in mode else WriteHandle
-        yield hcls(var)
+        handle = hcls(var)
+        try:
+            yield handle
+        finally:
+            if handle._text_stream is not None:
+                handle._text_stream.close()
+            if handle._stream is not None:
+                # data buffered by stream goes before close
+                handle._stream.close()
+            if writes:
+                # size and time were cached while it was written
+                _touch(path)
 
 
 def find(wildcard: str) -> List[str]:
@@ -198,7 +567,7 @@ def complete(
     ).take_list_of_strings()
 
 
-def attributes(path: str) -> dict:
+def _fetch_attributes(path):
     tp = method('attributes', ser.encode(path)).take_dict((
         b'created',
         b'modification',
@@ -211,3 +580,145 @@ def attributes(path: str) -> dict:
     r['isDir'] = tp.take_bool()
     r['size'] = tp.take_int()
     return r
+
+
+def attributes(path: str) -> dict:
+    return dict(_cached(
+        'attributes', path, lambda: _fetch_attributes(path)))
+
+
+# Continues depth-first traversal from stack of {dir, entries done,
+# subdirs found}, returns {dir, {{name, attributes}, ...}, dir done} items
+# and the stack left. Directories are normalized by fs.combine,
+# fs.attributes is missing before CC 1.81.
+_WALK = '''
+local stack, limit, every = ...
+local attributes = fs.attributes or function(p)
+    return {isDir = fs.isDir(p), size = fs.getSize(p)}
+end
+local out, n = {}, 0
+while #stack > 0 and n < limit do
+    local top = table.remove(stack)
+    local dir, i, subdirs = fs.combine(top[1], ''), top[2], top[3] or {}
+    local names = fs.list(dir)
+    local entries = {}
+    while i < #names and n < limit do
+        i = i + 1
+        local p = fs.combine(dir, names[i])
+        local a = attributes(p)
+        entries[#entries + 1] = {names[i], a}
+        if a.isDir then subdirs[#subdirs + 1] = p end
+        n = n + 1
+        if n % every == 0 then
+            os.queueEvent('cc_walk')
+            coroutine.yield('cc_walk')
+        end
+    end
+    local done = i >= #names
+    out[#out + 1] = {dir, entries, done}
+    if done then
+        for j = #subdirs, 1, -1 do stack[#stack + 1] = {subdirs[j], 0} end
+    else
+        stack[#stack + 1] = {dir, i, subdirs}
+    end
+    n = n + 1
+end
+return out, stack
+'''.lstrip()
+
+
+def _attributes(a: dict) -> dict:
+    return {
+        'created': a.get(b'created'),
+        'modification': a.get(b'modification'),
+        'isDir': a[b'isDir'],
+        'size': a[b'size'],
+    }
+
+
+def _walk_dirs(path: str) -> Iterator[Tuple[str, List[Tuple[str, dict]]]]:
+    # (dir, [(name, attributes), ...]) for every directory, top-down
+    stack = [(ser.encode(path), 0)]
+    current, entries = None, []
+    while stack:
+        rp = eval_lua(_WALK, stack, WALK_BATCH, WALK_YIELD)
+        items = lua_table_to_list(rp.take_dict())
+        stack = [
+            tuple(lua_table_to_list(x, 3)) for x in lua_table_to_list(rp.take_dict())]
+        for item in items:
+            d, part, done = lua_table_to_list(item, 3)
+            if d != current:
+                current, entries = d, []
+            entries.extend(
+                (ser.decode(e[1]), _attributes(e[2]))
+                for e in lua_table_to_list(part))
+            if done:
+                yield ser.decode(d), entries
+                current, entries = None, []
+
+
+def walk(path: str) -> Iterator[Tuple[str, List[str], List[str]]]:
+    '''
+    Usage:
+
+    for dirpath, dirnames, filenames in fs.walk('/'):
+        ...
+
+    Like os.walk, top-down. Computer walks the tree itself and sends
+    entries in batches, removing names from dirnames doesn't prune it.
+    '''
+    for d, entries in _walk_dirs(path):
+        yield (
+            d,
+            [name for name, a in entries if a['isDir']],
+            [name for name, a in entries if not a['isDir']],
+        )
+
+
+def tree(path: str) -> Dict[str, dict]:
+    '''
+    Attributes (as of fs.attributes) of everything under path,
+    by full path, in a few round trips.
+    '''
+    r = {}
+    for d, entries in _walk_dirs(path):
+        for name, a in entries:
+            r[d + '/' + name if d else name] = a
+    return r
+
+
+def cache(enabled: bool = True, ttl: float = None) -> Optional[MetadataCache]:
+    '''
+    Usage:
+
+    c = fs.cache(ttl=5)
+    while True:
+        if fs.exists('jobs/next'):
+            ...
+    print(c.stats())
+
+    Makes exists, isDir, getSize, list and attributes of this session
+    remember their results, see MetadataCache. Calling it again sets
+    ttl (seconds, None for no expiry) and keeps what's cached,
+    enabled=False drops the cache.
+    '''
+    sess = get_current_session()
+    if not enabled:
+        sess.fs_cache = None
+        return None
+    if sess.fs_cache is None:
+        sess.fs_cache = MetadataCache(sess.metrics, ttl)
+    else:
+        sess.fs_cache.ttl = ttl
+    return sess.fs_cache
+
+
+def invalidate(path: str = None):
+    '''
+    Drops cached results of path, its parents and everything under it,
+    or all of them. For changes fs of this session doesn't know about,
+    e.g. on disk and disk_eject events.
+    '''
+    c = get_current_session().fs_cache
+    if c is not None:
+        c.invalidate(path)
@@ -6,29 +6,29 @@ from ..lua import LuaExpr
 
 class TermMixin:
     def write(self, text: str):
-        return self._method('write', ser.dirty_encode(text)).take_none()
+        return self._method('write', ser.dirty_encode(text), void=True).take_none()
 
     def blit(self, text: str, textColors: bytes, backgroundColors: bytes):
-        return self._method('blit', ser.dirty_encode(text), textColors, backgroundColors).take_none()
+        return self._method('blit', ser.dirty_encode(text), textColors, backgroundColors, void=True).take_none()
 
     def clear(self):
-        return self._method('clear').take_none()
+        return self._method('clear', void=True).take_none()
 
     def clearLine(self):
-        return self._method('clearLine').take_none()
+        return self._method('clearLine', void=True).take_none()
 
     def getCursorPos(self) -> Tuple[int, int]:
         rp = self._method('getCursorPos')
         return tuple(rp.take_int() for _ in range(2))
 
     def setCursorPos(self, x: int, y: int):
-        return self._method('setCursorPos', x, y).take_none()
+        return self._method('setCursorPos', x, y, void=True).take_none()
 
     def getCursorBlink(self) -> bool:
         return self._method('getCursorBlink').take_bool()
 
     def setCursorBlink(self, value: bool):
-        return self._method('setCursorBlink', value).take_none()
+        return self._method('setCursorBlink', value, void=True).take_none()
 
     def isColor(self) -> bool:
         return self._method('isColor').take_bool()
@@ -38,16 +38,16 @@ class TermMixin:
         return tuple(rp.take_int() for _ in range(2))
 
     def scroll(self, lines: int):
-        return self._method('scroll', lines).take_none()
+        return self._method('scroll', lines, void=True).take_none()
 
     def setTextColor(self, colorID: int):
-        return self._method('setTextColor', colorID).take_none()
+        return self._method('setTextColor', colorID, void=True).take_none()
 
     def getTextColor(self) -> int:
         return self._method('getTextColor').take_int()
 
     def setBackgroundColor(self, colorID: int):
-        return self._method('setBackgroundColor', colorID).take_none()
+        return self._method('setBackgroundColor', colorID, void=True).take_none()
 
     def getBackgroundColor(self) -> int:
         return self._method('getBackgroundColor').take_int()
@@ -57,7 +57,7 @@ class TermMixin:
         return tuple(rp.take_number() for _ in range(3))
 
     def setPaletteColor(self, colorID: int, r: float, g: float, b: float):
-        return self._method('setPaletteColor', colorID, r, g, b).take_none()
+        return self._method('setPaletteColor', colorID, r, g, b, void=True).take_none()
 
 
 class TermTarget(LuaExpr):
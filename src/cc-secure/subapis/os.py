@@ -1,8 +1,10 @@
+import asyncio
 from typing import Optional
 
 from .. import ser
 from ..lua import LuaNum
-from ..sess import eval_lua_method_factory, get_current_greenlet
+from ..sess import (
+    eval_lua_method_factory, forbid_in_batch, get_current_greenlet)
 
 
 method = eval_lua_method_factory('os.')
@@ -51,7 +53,9 @@ def run(environment: dict, programPath: str, *args: str):
     return method('run', environment, ser.encode(programPath), *args).take_bool()
 
 
-def captureEvent(event: str):
+def captureEvent(event: str, timeout: LuaNum = None):
+    # with timeout iteration stops when no event came for that many seconds
+    forbid_in_batch('os.captureEvent')
     event = ser.encode(event)
     glet = get_current_greenlet().cc_greenlet
     sess = glet._sess
@@ -61,7 +65,18 @@ def captureEvent(event: str):
         while True:
             val = evr.get_from_stack(glet._task_id, event)
             if val is None:
-                res = sess._server_greenlet.switch()
+                glet.flush_void_calls()
+                if timeout is None:
+                    res = sess._server_greenlet.switch()
+                else:
+                    handle = asyncio.get_running_loop().call_later(
+                        timeout, evr.on_timeout, glet._task_id, event)
+                    try:
+                        res = sess._server_greenlet.switch()
+                    finally:
+                        handle.cancel()
+                    if res == 'timeout':
+                        return
                 assert res == 'event'
             else:
                 yield val
@@ -95,8 +110,14 @@ def epoch() -> int:
     return method('epoch', b'ingame').take_int()
 
 
-def sleep(seconds: LuaNum):
-    return method('sleep', seconds).take_none()
+def sleep(seconds: LuaNum, ingame: bool = False):
+    # sleeps on server side, ingame=True uses computer timer instead,
+    # which follows game ticks when server is lagging;
+    # functions of batch() can only wait for computer
+    g = get_current_greenlet()
+    if ingame or getattr(g, 'cc_batch', False):
+        return method('sleep', seconds).take_none()
+    g.cc_greenlet.sleep(seconds)
 
 
 def startTimer(timeout: LuaNum) -> int:
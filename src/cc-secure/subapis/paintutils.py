@@ -27,20 +27,20 @@ def loadImage(path: str) -> List[List[int]]:
 
 
 def drawPixel(x: int, y: int, color: int = None):
-    return method('drawPixel', x, y, color).take_none()
+    return method('drawPixel', x, y, color, void=True).take_none()
 
 
 def drawLine(startX: int, startY: int, endX: int, endY: int, color: int = None):
-    return method('drawLine', startX, startY, endX, endY, color).take_none()
+    return method('drawLine', startX, startY, endX, endY, color, void=True).take_none()
 
 
 def drawBox(startX: int, startY: int, endX: int, endY: int, color: int = None):
-    return method('drawBox', startX, startY, endX, endY, color).take_none()
+    return method('drawBox', startX, startY, endX, endY, color, void=True).take_none()
 
 
 def drawFilledBox(startX: int, startY: int, endX: int, endY: int, color: int = None):
-    return method('drawFilledBox', startX, startY, endX, endY, color).take_none()
+    return method('drawFilledBox', startX, startY, endX, endY, color, void=True).take_none()
 
 
 def drawImage(image: List[List[int]], xPos: int, yPos: int):
-    return method('drawImage', image, xPos, yPos).take_none()
+    return method('drawImage', image, xPos, yPos, void=True).take_none()
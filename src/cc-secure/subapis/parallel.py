@@ -1,4 +1,4 @@
-from ..sess import CCGreenlet, get_current_greenlet
+from ..sess import CCGreenlet, forbid_in_batch, get_current_greenlet
 
 
 __all__ = (
@@ -8,8 +8,10 @@ __all__ = (
 
 
 def waitForAny(*task_fns):
+    forbid_in_batch('parallel.waitForAny')
     pgl = get_current_greenlet().cc_greenlet
     sess = pgl._sess
+    pgl.flush_void_calls()
 
     gs = [CCGreenlet(fn) for fn in task_fns]
     for g in gs:
@@ -22,8 +24,10 @@ def waitForAny(*task_fns):
 
 
 def waitForAll(*task_fns):
+    forbid_in_batch('parallel.waitForAll')
     pgl = get_current_greenlet().cc_greenlet
     sess = pgl._sess
+    pgl.flush_void_calls()
 
     gs = [CCGreenlet(fn) for fn in task_fns]
     for g in gs:
@@ -15,9 +15,10 @@ class BasePeripheral:
         self._lua_method_expr = lua_method_expr
         self._prepend_params = prepend_params
 
-    def _method(self, name, *params):
+    def _method(self, name, *params, void=False):
         code = 'return ' + self._lua_method_expr + '(...)'
-        return eval_lua(code, *self._prepend_params, ser.encode(name), *params)
+        return eval_lua(
+            code, *self._prepend_params, ser.encode(name), *params, void=void)
 
 
 class CCDrive(BasePeripheral):
@@ -60,7 +61,7 @@ class CCMonitor(BasePeripheral, TermMixin):
         return self._method('getTextScale').take_int()
 
     def setTextScale(self, scale: int):
-        return self._method('setTextScale', scale).take_none()
+        return self._method('setTextScale', scale, void=True).take_none()
 
 
 class ComputerMixin:
@@ -31,7 +31,7 @@ def getInput(side: str) -> bool:
 
 
 def setOutput(side: str, value: bool):
-    return method('setOutput', ser.encode(side), value).take_none()
+    return method('setOutput', ser.encode(side), value, void=True).take_none()
 
 
 def getOutput(side: str) -> bool:
@@ -43,7 +43,7 @@ def getAnalogInput(side: str) -> int:
 
 
 def setAnalogOutput(side: str, strength: int):
-    return method('setAnalogOutput', ser.encode(side), strength).take_none()
+    return method('setAnalogOutput', ser.encode(side), strength, void=True).take_none()
 
 
 def getAnalogOutput(side: str) -> int:
@@ -57,7 +57,7 @@ def getBundledInput(side: str) -> int:
 
 
 def setBundledOutput(side: str, colors: int):
-    return method('setBundledOutput', ser.encode(side), colors).take_none()
+    return method('setBundledOutput', ser.encode(side), colors, void=True).take_none()
 
 
 def getBundledOutput(side: str) -> int:
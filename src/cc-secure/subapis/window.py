@@ -8,20 +8,20 @@ from .mixins import TermMixin, TermTarget
 
 class CCWindow(BaseSubAPI, TermMixin):
     def setVisible(self, visibility: bool):
-        return self._method('setVisible', visibility).take_none()
+        return self._method('setVisible', visibility, void=True).take_none()
 
     def redraw(self):
-        return self._method('redraw').take_none()
+        return self._method('redraw', void=True).take_none()
 
     def restoreCursor(self):
-        return self._method('restoreCursor').take_none()
+        return self._method('restoreCursor', void=True).take_none()
 
     def getPosition(self) -> Tuple[int, int]:
         rp = self._method('getPosition')
         return tuple(rp.take_int() for _ in range(2))
 
     def reposition(self, x: int, y: int, width: int = None, height: int = None, parent: TermTarget = None):
-        return self._method('reposition', x, y, width, height, parent).take_none()
+        return self._method('reposition', x, y, width, height, parent, void=True).take_none()
 
     def getLine(self, y: int) -> Tuple[str, bytes, bytes]:
         rp = self._method('getLine', y)
@@ -0,0 +1,271 @@
+import os
+import zlib
+from os.path import abspath, join, relpath
+
+from . import ser
+from .rproc import lua_table_to_list
+from .sess import batch, eval_lua
+from .subapis import fs
+
+
+__all__ = (
+    'LocalTree',
+    'block_sums',
+    'sync',
+)
+
+
+# Files are compared by blocks of this size at fixed offsets.
+BLOCK_SIZE = 4096
+# blocks a computer sums per round trip, sums of a block take up to
+# 36 bytes of the result message
+SUMS_BATCH = 1024
+# computer yields every that many blocks while summing
+SUMS_YIELD = 32
+# data per round trip of small files and changed blocks,
+# a round trip is a single websocket message
+PATCH_BYTES = 48 * 1024
+# modulus of the second block sum, h * 256 + 255 stays exact in lua numbers
+_PRIME = 2147483647
+
+
+def block_sums(data: bytes, block_size: int = BLOCK_SIZE) -> list:
+    # adler32 and big-endian value mod _PRIME of every block, flat;
+    # _SUMS computes the same on computer
+    r = []
+    for pos in range(0, len(data), block_size):
+        block = data[pos:pos + block_size]
+        r.append(zlib.adler32(block))
+        r.append(int.from_bytes(block, 'big') % _PRIME)
+    return r
+
+
+_SUMS = '''
+local paths, block, every = ...
+local P = 2147483647
+local out, n = {}, 0
+for i, p in ipairs(paths) do
+    if fs.exists(p) and not fs.isDir(p) then
+        local f = fs.open(p, 'rb')
+        local data = f.readAll() or ''
+        f.close()
+        local sums = {}
+        for pos = 1, #data, block do
+            local last = math.min(pos + block - 1, #data)
+            local a, b, h = 1, 0, 0
+            for s = pos, last, 256 do
+                local t = {data:byte(s, math.min(s + 255, last))}
+                for k = 1, #t do
+                    local c = t[k]
+                    a = a + c
+                    b = b + a
+                    h = (h * 256 + c) % P
+                end
+            end
+            sums[#sums + 1] = (b % 65521) * 65536 + a % 65521
+            sums[#sums + 1] = h
+            n = n + 1
+            if n % every == 0 then
+                os.queueEvent('cc_sync')
+                coroutine.yield('cc_sync')
+            end
+        end
+        out[i] = {#data, sums}
+    end
+end
+return out
+'''.lstrip()
+
+# blocks is a table of new blocks by 1-based index, the rest
+# is kept from the file as it is
+_PATCH = '''
+local p, size, blocks, block = ...
+local old
+local parts = {}
+for i = 1, math.ceil(size / block) do
+    local b = blocks[i]
+    if b == nil then
+        if old == nil then
+            old = ''
+            if fs.exists(p) then
+                local f = fs.open(p, 'rb')
+                old = f.readAll() or ''
+                f.close()
+            end
+        end
+        b = old:sub((i - 1) * block + 1, i * block)
+    end
+    parts[i] = b
+end
+local f = fs.open(p, 'wb')
+f.write(table.concat(parts):sub(1, size))
+f.close()
+'''.lstrip()
+
+
+class LocalTree:
+    # Files under a server directory with their block sums,
+    # sums are computed again only for files with changed size or mtime.
+    def __init__(self, directory, block_size=BLOCK_SIZE):
+        self.directory = directory
+        self.block_size = block_size
+        self._files = {}
+
+    def files(self):
+        # {relative path with '/': (data, sums)}
+        seen = {}
+        for dirpath, dirnames, filenames in os.walk(self.directory):
+            dirnames.sort()
+            for name in sorted(filenames):
+                path = join(dirpath, name)
+                st = os.stat(path)
+                rel = relpath(path, self.directory).replace(os.sep, '/')
+                item = self._files.get(rel)
+                if item is None or item[0] != (st.st_size, st.st_mtime_ns):
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    item = (
+                        (st.st_size, st.st_mtime_ns),
+                        data, block_sums(data, self.block_size))
+                seen[rel] = item
+        self._files = seen
+        return {rel: item[1:] for rel, item in seen.items()}
+
+
+_trees = {}
+
+
+def _local_tree(directory):
+    directory = abspath(directory)
+    tree = _trees.get(directory)
+    if tree is None:
+        tree = _trees[directory] = LocalTree(directory)
+    return tree
+
+
+def _groups(items, weight, limit):
+    # consecutive items of total weight up to limit, a heavier item
+    # goes alone
+    group, total = [], 0
+    for x in items:
+        w = weight(x)
+        if group and total + w > limit:
+            yield group
+            group, total = [], 0
+        group.append(x)
+        total += w
+    if group:
+        yield group
+
+
+def _remote_sums(paths, sizes, block_size):
+    # {path: (size, sums)} of files existing on computer,
+    # in round trips of up to SUMS_BATCH blocks
+    r = {}
+    for group in _groups(
+            list(zip(paths, sizes)),
+            lambda x: x[1] // block_size + 1, SUMS_BATCH):
+        out = eval_lua(
+            _SUMS, [ser.encode(p) for p, _ in group], block_size, SUMS_YIELD,
+        ).take_dict()
+        for i, x in out.items():
+            size, sums = lua_table_to_list(x)
+            r[group[i - 1][0]] = (size, lua_table_to_list(sums))
+    return r
+
+
+def _send_file(path, data):
+    with fs.open(path, 'wb') as f:
+        f.stream().write(data)
+
+
+def sync(local: str, remote: str, delete: bool = False) -> dict:
+    '''
+    Makes directory remote of the computer the same as server
+    directory local. Computer sums blocks of its files, only files
+    and blocks that differ are sent. With delete files and directories
+    under remote which local doesn't have are deleted.
+
+    Must run in a greenlet of the session, see CCSession.run_task.
+    Returns counts of files and bytes sent.
+    '''
+    remote = fs.combine(remote, '')
+    if delete and not remote:
+        # rom and disks are under root
+        raise ValueError('delete needs a directory other than root')
+    tree = _local_tree(local)
+    block_size = tree.block_size
+    files = tree.files()
+    paths = sorted(files)
+    # local paths are normalized already
+    rpaths = [remote + '/' + p if remote else p for p in paths]
+    theirs = _remote_sums(
+        rpaths, [len(files[p][0]) for p in paths], block_size)
+
+    stats = {
+        'files': len(paths), 'unchanged': 0, 'sent': 0, 'patched': 0,
+        'blocks': 0, 'bytes': 0, 'deleted': 0,
+    }
+    # (path, size, {1-based index: block}) calls of _PATCH
+    patches = []
+    for p, rp in zip(paths, rpaths):
+        data, sums = files[p]
+        blocks = len(sums) // 2
+        size, rsums = theirs.get(rp, (None, None))
+        if size == len(data) and rsums == sums:
+            stats['unchanged'] += 1
+            continue
+        if size is None:
+            changed = range(blocks)
+        else:
+            changed = [
+                i for i in range(blocks)
+                if rsums[2 * i:2 * i + 2] != sums[2 * i:2 * i + 2]]
+        if len(changed) * 2 > blocks and len(data) > PATCH_BYTES:
+            _send_file(rp, data)
+            stats['sent'] += 1
+            stats['bytes'] += len(data)
+            continue
+        stats['sent' if len(changed) == blocks else 'patched'] += 1
+        stats['blocks'] += len(changed)
+        part = {}
+        for i in changed:
+            part[i + 1] = data[i * block_size:(i + 1) * block_size]
+            stats['bytes'] += len(part[i + 1])
+            if len(part) * block_size >= PATCH_BYTES:
+                patches.append((rp, len(data), part))
+                part = {}
+        if part or not patches or patches[-1][0] != rp:
+            patches.append((rp, len(data), part))
+
+    # patches of several files go in one round trip
+    for group in _groups(
+            patches, lambda x: sum(map(len, x[2].values())), PATCH_BYTES):
+        batch(*(
+            (eval_lua, _PATCH, ser.encode(p), n, part, block_size)
+            for p, n, part in group))
+    # patches went around fs.cache() of the session
+    fs.invalidate(remote)
+
+    if delete:
+        stats['deleted'] = _delete_extra(remote, set(rpaths))
+    return stats
+
+
+def _delete_extra(remote, keep):
+    # deletes what isn't in keep nor a directory on the way to it
+    dirs = set()
+    for p in keep:
+        while '/' in p:
+            p = p.rsplit('/', 1)[0]
+            dirs.add(p)
+    extra = []
+    for p, a in sorted(fs.tree(remote).items()):
+        if p in keep or (a['isDir'] and p in dirs):
+            continue
+        if extra and p.startswith(extra[-1] + '/'):
+            continue
+        extra.append(p)
+    if extra:
+        batch(*((fs.delete, p) for p in extra))
+    return len(extra)
@@ -0,0 +1,165 @@
+import asyncio
+import multiprocessing
+import os
+import socket
+import sys
+from itertools import count
+from multiprocessing.reduction import sendfds, recvfds
+from urllib.parse import urlsplit, parse_qs
+
+from aiohttp import web
+
+from .sess import StdFileProxy
+
+
+__all__ = (
+    'run_workers',
+    'pick_worker',
+)
+
+
+# Front process accepts connections, peeks at the request line and hands
+# the socket over to a worker process, which runs its own CCApplication.
+# back.lua connects to /ws/?id=<computer id>, so a computer always lands
+# on the same worker. Anything else goes to /?worker=<index> or round robin.
+
+PEEK_TIMEOUT = 10
+MAX_REQUEST_LINE = 4096
+
+
+def pick_worker(request_line: bytes, worker_count: int, fallback: int) -> int:
+    parts = request_line.split()
+    if len(parts) >= 2:
+        query = parse_qs(urlsplit(parts[1].decode('latin1')).query)
+        for key in ('id', 'worker'):
+            try:
+                return int(query[key][0]) % worker_count
+            except (KeyError, ValueError):
+                pass
+    return fallback % worker_count
+
+
+async def _wait_readable(loop, fd):
+    fut = loop.create_future()
+    loop.add_reader(fd, fut.set_result, None)
+    try:
+        await fut
+    finally:
+        loop.remove_reader(fd)
+
+
+async def _peek_request_line(loop, conn):
+    while True:
+        await _wait_readable(loop, conn.fileno())
+        data = conn.recv(MAX_REQUEST_LINE, socket.MSG_PEEK)
+        if not data:
+            raise ConnectionError
+        if b'\n' in data or len(data) >= MAX_REQUEST_LINE:
+            return data.split(b'\n', 1)[0]
+        # socket stays readable until the rest of the line comes
+        await asyncio.sleep(0.01)
+
+
+async def _serve_worker(index, channel, make_app):
+    runner = web.AppRunner(make_app(index))
+    await runner.setup()
+    loop = asyncio.get_running_loop()
+    channel.setblocking(False)
+    print('worker {} running, pid {}'.format(index, os.getpid()), flush=True)
+    try:
+        while True:
+            await _wait_readable(loop, channel.fileno())
+            while True:
+                try:
+                    fds = recvfds(channel, 1)
+                except BlockingIOError:
+                    break
+                except EOFError:
+                    # front process has gone
+                    return
+                for fd in fds:
+                    conn = socket.socket(fileno=fd)
+                    conn.setblocking(False)
+                    await loop.connect_accepted_socket(runner.server, conn)
+    finally:
+        await runner.cleanup()
+
+
+def _worker_main(index, channel, make_app):
+    # multiprocessing replaces stdin of child processes
+    if not isinstance(sys.stdin, StdFileProxy):
+        sys.stdin = StdFileProxy(sys.stdin, False)
+    try:
+        asyncio.run(_serve_worker(index, channel, make_app))
+    except KeyboardInterrupt:
+        pass
+
+
+class _Worker:
+    def __init__(self, index, make_app, mp):
+        self._index = index
+        self._make_app = make_app
+        self._mp = mp
+        self._start()
+
+    def _start(self):
+        self._channel, child = socket.socketpair()
+        self._process = self._mp.Process(
+            target=_worker_main,
+            args=(self._index, child, self._make_app),
+            daemon=True,
+        )
+        self._process.start()
+        child.close()
+
+    def hand_over(self, conn):
+        if not self._process.is_alive():
+            print('worker {} has died, restarting'.format(self._index),
+                  flush=True)
+            self._channel.close()
+            self._start()
+        sendfds(self._channel, [conn.fileno()])
+
+
+async def _serve_front(sock, workers):
+    loop = asyncio.get_running_loop()
+    sock.setblocking(False)
+    rr = count()
+
+    async def route(conn):
+        try:
+            line = await asyncio.wait_for(
+                _peek_request_line(loop, conn), PEEK_TIMEOUT)
+            index = pick_worker(line, len(workers), next(rr))
+            workers[index].hand_over(conn)
+        except (asyncio.TimeoutError, OSError):
+            pass
+        finally:
+            # worker has its own copy of the socket
+            conn.close()
+
+    while True:
+        conn, _ = await loop.sock_accept(sock)
+        asyncio.ensure_future(route(conn))
+
+
+def run_workers(make_app, host, port, worker_count):
+    # make_app(worker_index) creates application of a worker process
+    if not hasattr(socket, 'AF_UNIX'):
+        raise RuntimeError('Multiple workers require unix sockets')
+    sock = socket.socket()
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host or '', port))
+    sock.listen(128)
+    # spawn keeps listening socket and other channels out of workers
+    mp = multiprocessing.get_context('spawn')
+    workers = [_Worker(i, make_app, mp) for i in range(worker_count)]
+    print('======== Running on http://{}:{} with {} workers ========'.format(
+        host or '0.0.0.0', port, worker_count))
+    print('(Press CTRL+C to quit)', flush=True)
+    try:
+        asyncio.run(_serve_front(sock, workers))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        sock.close()
@@ -0,0 +1,95 @@
+-- Messages back.lua sends in one main loop iteration: a lone message goes
+-- as is, several go as 'M' frames, split to stay under 64k, in order.
+--
+-- Usage (from repository root, stock Lua 5.1):
+--   lua tests/back_frames.lua
+
+local loadstring = loadstring or load
+
+local sent = {}
+local ws = {
+    send = function(data, binary)
+        assert(binary == true)
+        sent[#sent + 1] = data
+    end,
+}
+
+local function load_back_lua()
+    local f = assert(io.open('src/cc-secure/back.lua', 'r'))
+    local src = f:read('*a')
+    f:close()
+    local from = assert(src:find('local serialize\n', 1, true))
+    local to = assert(src:find('\nfunction set_filter', 1, true))
+    local send_from = assert(src:find('local outbox = {}', 1, true))
+    local send_to = assert(src:find('\nfunction safe_unpack', 1, true))
+    local chunk = table.concat({
+        'local genv = getfenv and getfenv() or _G',
+        'local ws = ...',
+        src:sub(from, to),
+        src:sub(send_from, send_to),
+        'serialize, deserialize = bin_serialize, bin_deserialize',
+        'return serialize, deserialize',
+    }, '\n')
+    return assert(loadstring(chunk))(ws)
+end
+
+local serialize, deserialize = load_back_lua()
+
+
+-- a lone message is sent as is
+ws_send('T', 1, 'x', 0)
+ws_flush()
+assert(#sent == 1)
+assert(sent[1] == 'T' .. serialize(1) .. serialize('x') .. serialize(0))
+
+sent = {}
+ws_flush()
+assert(#sent == 0)
+
+
+-- several messages go in 'M' frames
+local function unpack_frames()
+    local r = {}
+    for _, frame in ipairs(sent) do
+        assert(#frame <= 65536, #frame)
+        local s = create_stream(frame)
+        assert(s.fixed(1) == 'M')
+        while not s.isend() do
+            local m = create_stream(deserialize(s))
+            assert(m.fixed(1) == 'T')
+            r[#r + 1] = {deserialize(m), deserialize(m), deserialize(m)}
+            assert(m.isend())
+        end
+    end
+    return r
+end
+
+sent = {}
+ws_send('T', 1, 'a', 0)
+ws_send('T', 2, 'b', 0)
+ws_flush()
+assert(#sent == 1)
+local msgs = unpack_frames()
+assert(#msgs == 2)
+assert(msgs[1][1] == 1 and msgs[1][2] == 'a' and msgs[1][3] == 0)
+assert(msgs[2][1] == 2 and msgs[2][2] == 'b' and msgs[2][3] == 0)
+
+
+-- more than 64k is split, order is kept
+sent = {}
+local data = string.rep('x', 1000)
+for i = 1, 200 do
+    ws_send('T', i, data, i % 7)
+end
+ws_flush()
+assert(#sent == 4, #sent)
+for i = 1, #sent - 1 do
+    assert(#sent[i] > 60000, #sent[i])
+end
+msgs = unpack_frames()
+assert(#msgs == 200)
+for i, m in ipairs(msgs) do
+    assert(m[1] == i and m[2] == data and m[3] == i % 7)
+end
+
+print('ALL OK')
@@ -0,0 +1,321 @@
+-- copy of the binary wire format of back.lua
+local substr = string.sub
+local genv = getfenv and getfenv() or _G
+local function unexpected_token(tok)
+    error('Unexpected token ' .. tostring(tok), 0)
+end
+
+local bin_serialize, bin_deserialize
+do
+    local byte, char, floor = string.byte, string.char, math.floor
+    local frexp, ldexp = math.frexp, math.ldexp
+    local huge = math.huge
+    local int_limit = 2 ^ 53
+
+    local pack_double, unpack_double
+    if string.pack ~= nil then
+        pack_double = function(x) return string.pack('>d', x) end
+        unpack_double = function(s) return (string.unpack('>d', s)) end
+    else
+        pack_double = function(x)
+            local sign = 0
+            if x < 0 or (x == 0 and 1 / x < 0) then
+                sign = 128
+                x = -x
+            end
+            local mant, expo
+            if x ~= x then
+                return char(127, 248, 0, 0, 0, 0, 0, 0)
+            elseif x == huge then
+                mant, expo = 0, 2047
+            elseif x == 0 then
+                mant, expo = 0, 0
+            else
+                local m, e = frexp(x)
+                expo = e + 1022
+                if expo <= 0 then
+                    mant, expo = ldexp(x, 1074), 0
+                else
+                    mant = ldexp(m, 53) - 2 ^ 52
+                end
+            end
+            local r = {}
+            for i = 8, 3, -1 do
+                r[i] = char(mant % 256)
+                mant = floor(mant / 256)
+            end
+            r[2] = char((expo % 16) * 16 + mant)
+            r[1] = char(sign + floor(expo / 16))
+            return table.concat(r)
+        end
+        unpack_double = function(s)
+            local b1, b2 = byte(s, 1, 2)
+            local expo = (b1 % 128) * 16 + floor(b2 / 16)
+            local mant = b2 % 16
+            for i = 3, 8 do
+                mant = mant * 256 + byte(s, i)
+            end
+            local x
+            if expo == 2047 then
+                if mant == 0 then x = huge else x = 0 / 0 end
+            elseif expo == 0 then
+                x = ldexp(mant, -1074)
+            else
+                x = ldexp(mant + 2 ^ 52, expo - 1075)
+            end
+            if b1 >= 128 then x = -x end
+            return x
+        end
+    end
+
+    local function put_varint(buf, n)
+        while n >= 128 do
+            buf[#buf + 1] = char(n % 128 + 128)
+            n = floor(n / 128)
+        end
+        buf[#buf + 1] = char(n)
+    end
+
+    local function s_rec(v, buf, tracking)
+        local t = type(v)
+        if v == nil then
+            buf[#buf + 1] = 'N'
+        elseif v == false then
+            buf[#buf + 1] = 'F'
+        elseif v == true then
+            buf[#buf + 1] = 'T'
+        elseif t == 'number' then
+            if v ~= floor(v) or v >= int_limit or v <= -int_limit then
+                buf[#buf + 1] = 'd' .. pack_double(v)
+            elseif v >= 0 and v < 64 then
+                buf[#buf + 1] = char(128 + v)
+            elseif v >= 0 then
+                buf[#buf + 1] = 'i'
+                put_varint(buf, v)
+            else
+                buf[#buf + 1] = 'j'
+                put_varint(buf, -v)
+            end
+        elseif t == 'string' then
+            if #v < 64 then
+                buf[#buf + 1] = char(192 + #v)
+            else
+                buf[#buf + 1] = 's'
+                put_varint(buf, #v)
+            end
+            buf[#buf + 1] = v
+        elseif t == 'table' then
+            if tracking[v] ~= nil then
+                error('Cannot serialize table with recursive entries', 0)
+            end
+            tracking[v] = true
+            buf[#buf + 1] = '{'
+            for k, x in pairs(v) do
+                s_rec(k, buf, tracking)
+                s_rec(x, buf, tracking)
+            end
+            buf[#buf + 1] = '}'
+        else
+            error('Cannot serialize type ' .. t, 0)
+        end
+    end
+    bin_serialize = function(v)
+        local buf = {}
+        s_rec(v, buf, {})
+        return table.concat(buf)
+    end
+
+    local function get_varint(s, idx)
+        local n, mul = 0, 1
+        while true do
+            local b = byte(s, idx)
+            if b == nil then error('Unexpected end of stream') end
+            idx = idx + 1
+            if b < 128 then return n + b * mul, idx end
+            n = n + (b - 128) * mul
+            mul = mul * 128
+        end
+    end
+
+    local table_end = {}
+
+    local function d_rec(s, idx)
+        local tok = byte(s, idx)
+        idx = idx + 1
+        if tok == nil then
+            unexpected_token(tok)
+        elseif tok >= 192 then
+            local e = idx + tok - 192
+            return substr(s, idx, e - 1), e
+        elseif tok >= 128 then
+            return tok - 128, idx
+        elseif tok == 125 then  -- }
+            return table_end, idx
+        elseif tok == 123 then  -- {
+            local r = {}
+            while true do
+                local key, value
+                key, idx = d_rec(s, idx)
+                if key == table_end then break end
+                value, idx = d_rec(s, idx)
+                r[key] = value
+            end
+            return r, idx
+        elseif tok == 105 then  -- i
+            return get_varint(s, idx)
+        elseif tok == 106 then  -- j
+            local n
+            n, idx = get_varint(s, idx)
+            return -n, idx
+        elseif tok == 100 then  -- d
+            return unpack_double(substr(s, idx, idx + 7)), idx + 8
+        elseif tok == 115 then  -- s
+            local n
+            n, idx = get_varint(s, idx)
+            return substr(s, idx, idx + n - 1), idx + n
+        elseif tok == 78 then  -- N
+            return nil, idx
+        elseif tok == 70 then  -- F
+            return false, idx
+        elseif tok == 84 then  -- T
+            return true, idx
+        elseif tok == 69 then  -- E
+            local n
+            n, idx = get_varint(s, idx)
+            local fn = assert(loadstring(substr(s, idx, idx + n - 1)))
+            setfenv(fn, genv)
+            return fn(), idx + n
+        else
+            unexpected_token(tok)
+        end
+    end
+    bin_deserialize = function(stream)
+        local r
+        r, stream.idx = d_rec(stream.s, stream.idx)
+        return r
+    end
+end
+
+
+local function serialize(v) return bin_serialize(v) end
+local function deserialize(s)
+    return bin_deserialize({s=s, idx=1})
+end
+
+
+print(serialize(nil))
+assert(deserialize(serialize(nil)) == nil)
+
+
+local inf = math.huge
+local roundtrip_vals = {
+    true,
+    false,
+    0,
+    1,
+    -1,
+    -- small ints end at 63, varints start at 64
+    63,
+    64,
+    -63,
+    -64,
+    127,
+    128,
+    16383,
+    16384,
+    -128,
+    -16384,
+    2 ^ 53 - 1,
+    -(2 ^ 53 - 1),
+    1e6,
+    1.5,
+    -1.5,
+    2.4e-9,
+    inf,
+    -inf,
+    '',
+    'string',
+    '\n\r\0',
+    '\0',
+    '2',
+    -- short strings end at 63 bytes
+    string.rep('x', 31),
+    string.rep('x', 32),
+    string.rep('x', 63),
+    string.rep('x', 64),
+    string.rep('x', 300),
+}
+
+
+for _, v in ipairs(roundtrip_vals) do
+    assert(v == deserialize(serialize(v)), tostring(v))
+end
+
+
+local nan = deserialize(serialize(0 / 0))
+assert(nan ~= nan)
+
+
+-- tag boundaries, bser.py must produce the same bytes
+local exact_vals = {
+    {0, '\128'},
+    {63, '\191'},
+    {64, 'i\64'},
+    {128, 'i\128\1'},
+    {-1, 'j\1'},
+    {-64, 'j\64'},
+    {-300, 'j\172\2'},
+    {1.5, 'd\63\248\0\0\0\0\0\0'},
+    {inf, 'd\127\240\0\0\0\0\0\0'},
+    {-inf, 'd\255\240\0\0\0\0\0\0'},
+    {'', '\192'},
+    {string.rep('x', 31), '\223' .. string.rep('x', 31)},
+    {string.rep('x', 32), '\224' .. string.rep('x', 32)},
+    {string.rep('x', 63), '\255' .. string.rep('x', 63)},
+    {string.rep('x', 64), 's\64' .. string.rep('x', 64)},
+}
+
+
+for _, p in ipairs(exact_vals) do
+    assert(serialize(p[1]) == p[2], tostring(p[1]))
+    assert(deserialize(p[2]) == p[1], tostring(p[1]))
+end
+
+
+function areTablesEqual(a, b)
+    assert(type(a) == 'table')
+    assert(type(b) == 'table')
+    for k, v in pairs(a) do
+        if type(v) == 'table' then
+            if not areTablesEqual(v, b[k]) then return false end
+        else
+            if b[k] ~= v then return false end
+        end
+    end
+    for k, v in pairs(b) do
+        if type(v) == 'table' then
+            if not areTablesEqual(v, a[k]) then return false end
+        else
+            if a[k] ~= v then return false end
+        end
+    end
+    return true
+end
+
+
+local roundtrip_tables = {
+    {},
+    {[2]=4},
+    {[-5]=-70000},
+    {a=1, b=true, c={}, d={x=8}},
+    {1, 2, 3},
+    {'abc'},
+    {[string.rep('k', 64)]=string.rep('v', 64)},
+}
+
+
+for _, v in ipairs(roundtrip_tables) do
+    assert(areTablesEqual(v, deserialize(serialize(v))))
+end
+
+print('ALL OK')
@@ -0,0 +1,100 @@
+from importlib import import_module
+from math import inf, nan, isnan
+
+bser = import_module('cc-secure.bser')
+serialize, deserialize = bser.serialize, bser.deserialize
+
+
+roundtrip_vals = [
+    None,
+    True,
+    False,
+    0,
+    1,
+    -1,
+    # small ints end at 63, varints start at 64
+    63,
+    64,
+    -63,
+    -64,
+    127,
+    128,
+    16383,
+    16384,
+    -128,
+    -16384,
+    2 ** 53 - 1,
+    -(2 ** 53 - 1),
+    1e6,
+    1.5,
+    -1.5,
+    2.4e-9,
+    # nan,
+    inf,
+    -inf,
+    b'',
+    b'string',
+    b'\n\r\0',
+    b'\0',
+    b'2',
+    # short strings end at 63 bytes
+    b'x' * 31,
+    b'x' * 32,
+    b'x' * 63,
+    b'x' * 64,
+    b'x' * 300,
+    bytes(range(256)),
+    {},
+    {2: 4},
+    {-5: -70000},
+    {b'a': 1, b'b': None, b'c': {}, b'd': {b'x': 8}},
+    {1: 1, 2: 2, 3: 3},
+    {1: b'abc'},
+]
+
+
+for v in roundtrip_vals:
+    print(serialize(v))
+    assert v == deserialize(serialize(v))
+
+
+print(serialize(nan))
+assert isnan(deserialize(serialize(nan)))
+
+
+# tag boundaries, back.lua must produce the same bytes
+exact_vals = [
+    (0, b'\x80'),
+    (63, b'\xbf'),
+    (64, b'i\x40'),
+    (128, b'i\x80\x01'),
+    (-1, b'j\x01'),
+    (-64, b'j\x40'),
+    (-300, b'j\xac\x02'),
+    (1.5, b'd\x3f\xf8\x00\x00\x00\x00\x00\x00'),
+    (inf, b'd\x7f\xf0\x00\x00\x00\x00\x00\x00'),
+    (-inf, b'd\xff\xf0\x00\x00\x00\x00\x00\x00'),
+    (b'', b'\xc0'),
+    (b'x' * 31, b'\xdf' + b'x' * 31),
+    (b'x' * 32, b'\xe0' + b'x' * 32),
+    (b'x' * 63, b'\xff' + b'x' * 63),
+    (b'x' * 64, b's\x40' + b'x' * 64),
+]
+
+
+for v, b in exact_vals:
+    assert serialize(v) == b, (v, serialize(v))
+    assert deserialize(b) == v
+
+
+oneway_vals = [
+    ([b'a', b'b', b'c'], {1: b'a', 2: b'b', 3: b'c'}),
+    (2.0, 2),
+]
+
+
+for a, b in oneway_vals:
+    print(serialize(a))
+    assert b == deserialize(serialize(a))
+
+print('ALL OK')
@@ -0,0 +1,46 @@
+from importlib import import_module
+
+sess = import_module('cc-secure.sess')
+bser = import_module('cc-secure.bser')
+subapi_os = import_module('cc-secure.subapis.os')
+
+
+def run_program(computer_id, fn):
+    s = sess.CCSession(computer_id, lambda data: None, bser)
+    s._run_sandboxed_greenlet(fn)
+
+
+def rebind():
+    import cc
+    import cc.os
+    for target, name in ((cc.os, 'sleep'), (cc, 'os'), (cc, 'nope')):
+        try:
+            setattr(target, name, print)
+        except AttributeError:
+            pass
+        else:
+            raise AssertionError('{} rebound'.format(name))
+    try:
+        del cc.os.sleep
+    except AttributeError:
+        pass
+    else:
+        raise AssertionError('sleep deleted')
+
+
+seen = {}
+
+
+def look():
+    import cc
+    from cc import os
+    seen['os'] = cc.os is os
+    seen['sleep'] = os.sleep is subapi_os.sleep
+    seen['nope'] = hasattr(cc, 'nope')
+
+
+run_program(1, rebind)
+run_program(2, look)
+assert seen == {'os': True, 'sleep': True, 'nope': False}, seen
+
+print('ALL OK')
@@ -0,0 +1,49 @@
+import sys
+from importlib import import_module
+from os.path import join, dirname, abspath
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'benchmarks'))
+from _lib import FakeComputer  # noqa: E402
+
+emulator = import_module('cc-secure.emulator')
+errors = import_module('cc-secure.errors')
+framebuffer = import_module('cc-secure.subapis.framebuffer')
+term = import_module('cc-secure.subapis.term')
+
+
+computer = emulator.VirtualComputer(0)
+fc = FakeComputer(0, lambda code, params: emulator.compile_chunk(
+    code)(computer, params))
+
+
+class FailingTerm(term.TermAPI):
+    # term whose blit fails while fail is set
+    fail = False
+
+    def blit(self, text, textColors, backgroundColors):
+        if self.fail:
+            raise errors.LuaException('disconnected')
+        return super().blit(text, textColors, backgroundColors)
+
+
+def program():
+    target = FailingTerm('term')
+    fb = framebuffer.FrameBuffer(target)
+    fb.flush()
+    fb.write('hello')
+    target.fail = True
+    try:
+        fb.flush()
+    except errors.LuaException:
+        pass
+    else:
+        raise AssertionError('flush must fail')
+    target.fail = False
+    # rows which didn't make it are sent again
+    fb.flush()
+
+
+fc.run(program)
+assert computer.term.lines()[0].startswith(b'hello'), computer.term.lines()[0]
+
+print('ALL OK')
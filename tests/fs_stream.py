@@ -0,0 +1,64 @@
+import sys
+from importlib import import_module
+from os.path import join, dirname, abspath
+
+sys.path.insert(0, join(dirname(dirname(abspath(__file__))), 'benchmarks'))
+from _lib import FakeComputer  # noqa: E402
+
+emulator = import_module('cc-secure.emulator')
+fs = import_module('cc-secure.subapis.fs')
+sync = import_module('cc-secure.sync')
+
+# websocket message limit of computers
+MESSAGE_LIMIT = 128 * 1024
+
+
+class Computer(FakeComputer):
+    # emulated fs, remembers sizes of messages sent to computer
+    def __init__(self):
+        self.computer = emulator.VirtualComputer(0)
+        self.sizes = []
+        super().__init__(0, lambda code, params: emulator.compile_chunk(
+            code)(self.computer, params))
+
+    def send(self, data):
+        self.sizes.append(len(data))
+        super().send(data)
+
+
+data = bytes(range(256)) * 2000
+
+
+def write_once():
+    with fs.open('big', 'wb') as f:
+        assert f.stream().write(data) == len(data)
+
+
+def write_small():
+    with fs.open('big', 'wb') as f:
+        s = f.stream()
+        for i in range(0, len(data), 1000):
+            s.write(data[i:i + 1000])
+
+
+def send_file():
+    sync._send_file('big', data)
+
+
+def read_back():
+    with fs.open('big', 'rb') as f:
+        assert f.stream().read() == data
+
+
+for program in (write_once, write_small, send_file):
+    c = Computer()
+    c.run(program)
+    assert max(c.sizes) < MESSAGE_LIMIT, (program.__name__, max(c.sizes))
+    # a message carries up to write_behind chunks and a little framing
+    full = fs.CHUNK_SIZE * fs.WRITE_BEHIND
+    assert max(c.sizes) < full + 1024, c.sizes
+    assert sum(size >= full for size in c.sizes) >= len(data) // full - 1
+    assert c.computer.fs.read_file('big') == data
+    c.run(read_back)
+
+print('ALL OK')
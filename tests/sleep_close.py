@@ -0,0 +1,41 @@
+import asyncio
+from importlib import import_module
+
+sess = import_module('cc-secure.sess')
+bser = import_module('cc-secure.bser')
+subapi_os = import_module('cc-secure.subapis.os')
+
+
+woke = []
+
+
+def program():
+    subapi_os.sleep(0.2)
+    woke.append(True)
+
+
+async def main():
+    s = sess.CCSession(0, lambda data: None, bser)
+    s._run_sandboxed_greenlet(program)
+    await asyncio.sleep(0.05)
+    # computer disconnects while the program sleeps
+    s.on_close()
+    await asyncio.sleep(0.4)
+    assert not woke
+    assert not s._greenlets
+
+
+asyncio.run(main())
+
+
+# without a disconnect it wakes up
+async def main_awake():
+    s = sess.CCSession(0, lambda data: None, bser)
+    s._run_sandboxed_greenlet(program)
+    await asyncio.sleep(0.4)
+    assert woke == [True]
+
+
+asyncio.run(main_awake())
+
+print('ALL OK')